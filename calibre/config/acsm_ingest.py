@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+"""
+ACSM ingestion service: imports new .acsm files into Calibre as they land.
+
+Replaces the polling loop in watch-acsm.sh. The download directory is
+watched with inotify, so a new file is picked up within a second, with a
+full rescan on startup (and every RESCAN_INTERVAL, for anything inotify
+missed on a network mount). Where inotify is not available it falls back
+to polling the directory every POLL_INTERVAL seconds.
+
+Every file becomes a row in an SQLite job table keyed by filename, so
+"already processed?" is an index lookup however long the history gets:
+
+    pending -> running -> done
+                       -> pending   (retry after backoff: RETRY_BASE * 2^n, capped)
+                       -> failed    (MAX_ATTEMPTS reached, or not retryable)
+
+Each job records its attempts, last error, the Calibre book id and the
+time spent in each stage (add, check, count, metadata). The per-book work
+is the same as watch-acsm.sh: add through the write queue, reject raw
+ACSM imports, count pages and fetch metadata on the calibre-worker (or
+calibre-debug, if the worker is down). Those last two run on thread
+pools, overlapping across the books of a batch; they only read the
+library, and their writes are queued and applied together at the end of
+the batch, followed by a single GUI refresh and a per-stage report.
+
+Runs on the host with plain python3 (see calibre-acsm-watcher.service):
+    python3 config/acsm_ingest.py                # serve
+    python3 config/acsm_ingest.py --once         # rescan, process what is due, exit
+    python3 config/acsm_ingest.py --status
+    python3 config/acsm_ingest.py --retry-failed
+
+The old processed_acsm.txt history is imported as done jobs on first start.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import re
+import select
+import sqlite3
+import struct
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import calibre_worker
+import count_pages_cli
+import fetch_metadata
+import write_queue
+
+CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+COMPOSE_DIR = os.path.dirname(CONFIG_DIR)
+WATCH_DIR = os.environ.get('ACSM_WATCH_DIR', '/mnt/boston/media/downloads/books')
+CONTAINER_WATCH_DIR = '/incoming'
+JOBS_PATH = os.environ.get('ACSM_JOBS_PATH', os.path.join(CONFIG_DIR, 'acsm-jobs.sqlite3'))
+LOG_FILE = os.path.join(COMPOSE_DIR, 'acsm-watcher.log')
+PROCESSED_FILE = os.path.join(COMPOSE_DIR, 'processed_acsm.txt')
+WORKER_SOCKET = os.environ.get('CALIBRE_WORKER_SOCKET', os.path.join(CONFIG_DIR, 'calibre-worker.sock'))
+
+POLL_INTERVAL = 2          # seconds, only without inotify
+RESCAN_INTERVAL = 300      # seconds between full directory rescans
+RETRY_BASE = 60            # seconds before the first retry, doubled per attempt
+RETRY_MAX = 6 * 3600
+MAX_ATTEMPTS = 8
+COUNT_WORKERS = 2          # count_pages jobs in flight (CPU-bound, on the worker)
+METADATA_WORKERS = 4       # fetch_metadata jobs in flight (mostly waiting on Thunder)
+STAGES = ('add', 'check', 'count', 'metadata')
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+_EVENT = struct.Struct('iIII')
+
+
+def log(msg):
+    line = f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {msg}"
+    print(line, flush=True)
+    try:
+        with open(LOG_FILE, 'a') as f:
+            f.write(line + '\n')
+    except OSError:
+        pass
+
+
+class RetryableError(Exception):
+    """The import did not complete; try again later."""
+
+
+class PermanentError(Exception):
+    """The file can never be imported; do not retry."""
+
+
+# ---------------------------------------------------------------------------
+# Job table
+# ---------------------------------------------------------------------------
+
+class JobStore:
+    """SQLite job table, one row per ACSM filename."""
+
+    def __init__(self, path=JOBS_PATH):
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                filename TEXT PRIMARY KEY,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                book_id INTEGER,
+                timings TEXT,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_due ON jobs (state, next_attempt_at);
+        """)
+        # A job left running by a crash or restart starts over
+        self.conn.execute("UPDATE jobs SET state = 'pending' WHERE state = 'running'")
+        self.conn.commit()
+
+    def import_history(self, path=PROCESSED_FILE):
+        """Mark processed_acsm.txt entries done, once, on a fresh table."""
+        if self.conn.execute("SELECT 1 FROM jobs LIMIT 1").fetchone() or not os.path.exists(path):
+            return 0
+        now = time.time()
+        with open(path) as f:
+            names = {line.strip() for line in f if line.strip()}
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO jobs (filename, state, created_at, updated_at) "
+                "VALUES (?, 'done', ?, ?)", ((n, now, now) for n in names))
+        return len(names)
+
+    def add(self, filenames):
+        """Queue new files; known ones (in any state) are left alone. Returns how many were new."""
+        now = time.time()
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO jobs (filename, created_at, updated_at) VALUES (?, ?, ?)",
+                ((n, now, now) for n in filenames))
+            return self.conn.total_changes - before
+
+    def claim_due(self):
+        """Mark the oldest due pending job running and return it, or None."""
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT * FROM jobs WHERE state = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at, created_at LIMIT 1", (time.time(),)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1, updated_at = ? "
+                "WHERE filename = ?", (time.time(), row['filename']))
+        return dict(row, attempts=row['attempts'] + 1)
+
+    def finish(self, job, state, error=None, book_id=None, timings=None, delay=0):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, last_error = ?, book_id = COALESCE(?, book_id), "
+                "timings = ?, next_attempt_at = ?, updated_at = ? WHERE filename = ?",
+                (state, error, book_id, json.dumps(timings) if timings else None,
+                 time.time() + delay, time.time(), job['filename']))
+
+    def seconds_until_due(self):
+        row = self.conn.execute(
+            "SELECT MIN(next_attempt_at) FROM jobs WHERE state = 'pending'").fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def retry_failed(self):
+        with self.conn:
+            return self.conn.execute(
+                "UPDATE jobs SET state = 'pending', attempts = 0, next_attempt_at = 0 "
+                "WHERE state = 'failed'").rowcount
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def recent(self, states, limit=10):
+        marks = ','.join('?' * len(states))
+        return self.conn.execute(
+            f"SELECT * FROM jobs WHERE state IN ({marks}) ORDER BY updated_at DESC LIMIT ?",
+            (*states, limit)).fetchall()
+
+
+def backoff(attempts):
+    return min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1))
+
+
+# ---------------------------------------------------------------------------
+# Watching
+# ---------------------------------------------------------------------------
+
+class InotifyWatcher:
+    """Names of files finished writing or moved into a directory."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f'inotify_add_watch failed for {path}')
+
+    def wait(self, timeout):
+        """New names within timeout seconds; None if events were lost (rescan)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names, offset = [], 0
+        while offset < len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+
+class PollingWatcher:
+    """Same interface as InotifyWatcher, by listing the directory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.seen = set(_acsm_files(path))
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, POLL_INTERVAL))
+        current = set(_acsm_files(self.path))
+        new, self.seen = current - self.seen, current
+        return sorted(new)
+
+
+def open_watcher(path, poll=False):
+    if not poll:
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError) as e:
+            log(f"WARNING: inotify unavailable ({e}) — polling every {POLL_INTERVAL}s")
+    return PollingWatcher(path)
+
+
+def _acsm_files(path):
+    try:
+        return [e.name for e in os.scandir(path) if e.name.lower().endswith('.acsm') and e.is_file()]
+    except FileNotFoundError:
+        return []
+
+
+# ---------------------------------------------------------------------------
+# Per-book pipeline
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def _stage(timings, name):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.monotonic() - started, 2)
+
+
+def stage_report(batch):
+    """One line per stage: books through it and seconds spent, from the jobs' timings."""
+    lines = []
+    for name in STAGES:
+        spent = [timings[name] for timings in batch if name in timings]
+        busy = sum(spent)
+        avg = busy / len(spent) if spent else 0.0
+        lines.append(f"  {name:9s} {len(spent):4d} books  {busy:7.1f}s busy  {avg:6.1f}s/book")
+    return lines
+
+
+def calibre_job(op, book_id, script, *script_args):
+    """
+    KEY=VALUE output of a count_pages / fetch_metadata job as a dict.
+
+    Runs on the calibre-worker; falls back to calibre-debug in the GUI
+    container when the worker is not reachable, passing script_args (so
+    the script can be told not to write). Either way, writes are left to
+    the write queue.
+    """
+    try:
+        response = calibre_worker.call(WORKER_SOCKET, op, book_id, write=False)
+    except (OSError, ConnectionError) as e:
+        log(f"WARNING: calibre worker not reachable ({e}) — running {script} via calibre-debug")
+        proc = subprocess.run(
+            ['docker', 'exec', '-u', 'abc', '-e', 'DISPLAY=:1', 'calibre',
+             'calibre-debug', '-e', f'/config/{script}', str(book_id), *script_args],
+            capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{script} exited with code {proc.returncode}: {proc.stderr.strip()[-300:]}")
+        lines = proc.stdout.splitlines()
+    else:
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        formatter = {'count_pages': count_pages_cli.output_lines,
+                     'fetch_metadata': fetch_metadata.output_lines}[op]
+        lines = formatter(response['result'])
+    return dict(line.split('=', 1) for line in lines if '=' in line)
+
+
+def _is_raw_acsm_import(formats_json):
+    return bool(re.search(r'\.acsm"', formats_json, re.I)) and not re.search(r'\.(epub|pdf)"', formats_json, re.I)
+
+
+def add_book(filename, timings):
+    """
+    Add one ACSM file and check it was fulfilled. Returns the book id, or
+    None if it is already in the library; raises Retryable/PermanentError.
+    """
+    with _stage(timings, 'add'):
+        rc, result, _ = write_queue.run(['add', f'{CONTAINER_WATCH_DIR}/{filename}'])
+    log(result.strip())
+    match = re.search(r'Added book ids: (\d+)', result)
+    if not match:
+        if 'already exist in the database' in result:
+            return None
+        raise RetryableError(f"could not extract book id (calibredb exit {rc})")
+    book_id = int(match.group(1))
+
+    with _stage(timings, 'check'):
+        _, formats_json, _ = write_queue.run(
+            ['list', '--for-machine', '--search', f'id:{book_id}', '--fields', 'formats'])
+    if _is_raw_acsm_import(formats_json.replace('\n', '')):
+        write_queue.enqueue(['remove', '--permanent', str(book_id)])
+        if 'E_ADEPT_REQUEST_EXPIRED' in result:
+            raise PermanentError("ACSM expired; raw import removed")
+        raise RetryableError("imported only as raw ACSM; DeACSM fulfillment did not complete")
+    log(f"Book added with ID: {book_id}")
+    return book_id
+
+
+def count_stage(book_id):
+    """calibredb commands saving the page/word counts, and a note on failure."""
+    try:
+        counts = calibre_job('count_pages', book_id, 'count_pages_cli.py')
+    except RuntimeError as e:
+        log(f"WARNING: Count Pages failed for book {book_id} (book was still imported): {e}")
+        return [], f"count pages: {e}"
+    commands = []
+    for column, key in (('pages', 'BOOK_PAGES'), ('word_count', 'BOOK_WORDS')):
+        if counts.get(key):
+            commands.append(['set_custom', column, str(book_id), counts[key]])
+            log(f"Book {book_id}: {column} {counts[key]}")
+    return commands, None
+
+
+def metadata_stage(book_id):
+    """calibredb command saving series/pubdate from Thunder, and a note on failure."""
+    try:
+        meta = calibre_job('fetch_metadata', book_id, 'fetch_metadata.py', '--no-write')
+    except RuntimeError as e:
+        log(f"WARNING: fetch_metadata failed for book {book_id}: {e}")
+        return [], f"metadata: {e}"
+    if meta.get('METADATA_SKIPPED') or meta.get('METADATA_ERROR'):
+        log(f"Book {book_id} metadata: {meta.get('METADATA_SKIPPED') or meta.get('METADATA_ERROR')}")
+    fields = [f"{field}:{meta[key]}" for field, key in (
+        ('series', 'METADATA_SERIES'), ('series_index', 'METADATA_SERIES_INDEX'),
+        ('pubdate', 'METADATA_PUBDATE')) if meta.get(key)]
+    if not fields:
+        return [], None
+    log(f"Book {book_id} metadata: {', '.join(fields)}")
+    cmd = ['set_metadata', str(book_id)]
+    for field in fields:
+        cmd += ['--field', field]
+    return [cmd], None
+
+
+def _run_stage(name, fn, book_id, timings):
+    with _stage(timings, name):
+        return fn(book_id)
+
+
+def _fail(store, job, e, timings):
+    filename = job['filename']
+    if isinstance(e, PermanentError):
+        store.finish(job, 'failed', error=str(e), timings=timings)
+        log(f"❌ {filename}: {e}")
+        return
+    error = str(e) if isinstance(e, RetryableError) else f"{type(e).__name__}: {e}"
+    if job['attempts'] >= MAX_ATTEMPTS:
+        store.finish(job, 'failed', error=error, timings=timings)
+        log(f"❌ {filename}: {error} — giving up after {job['attempts']} attempts")
+    else:
+        delay = backoff(job['attempts'])
+        store.finish(job, 'pending', error=error, timings=timings, delay=delay)
+        log(f"⚠️  {filename}: {error} — retrying in {delay // 60}m")
+
+
+def _collect(store, futures, wait):
+    """Finish the jobs whose count and metadata stages are both done."""
+    done = as_completed(list(futures)) if wait else [f for f in list(futures) if f.done()]
+    for future in done:
+        entry = futures.pop(future)
+        try:
+            commands, note = future.result()
+        except Exception as e:
+            commands, note = [], f"{type(e).__name__}: {e}"
+        entry['commands'] += commands
+        if note:
+            entry['notes'].append(note)
+        entry['left'] -= 1
+        if entry['left']:
+            continue
+        # Writes go to the queue only once the book is complete; flushed per batch
+        for cmd in entry['commands']:
+            write_queue.enqueue(cmd)
+        job, timings = entry['job'], entry['timings']
+        store.finish(job, 'done', error='; '.join(entry['notes']) or None,
+                     book_id=entry['book_id'], timings=timings)
+        stages = ' '.join(f"{k}={v}s" for k, v in timings.items())
+        log(f"✅ Finished {job['filename']} (book ID: {entry['book_id']}) {stages}")
+
+
+def process_due(store):
+    """
+    Import every due job. Add and check run one book at a time (both are
+    calibredb calls); each added book then goes to the count and metadata
+    pools, so its counting overlaps the next book's import and other
+    books' Thunder lookups. Writes are applied together at the end,
+    followed by one refresh.
+    """
+    started = time.monotonic()
+    processed = 0
+    batch = []     # each job's stage timings, for the report
+    futures = {}   # future -> job entry shared by its count and metadata futures
+    with ThreadPoolExecutor(COUNT_WORKERS, thread_name_prefix='count') as counters, \
+            ThreadPoolExecutor(METADATA_WORKERS, thread_name_prefix='metadata') as fetchers:
+        while (job := store.claim_due()) is not None:
+            processed += 1
+            timings = {}
+            batch.append(timings)
+            if not os.path.exists(os.path.join(WATCH_DIR, job['filename'])):
+                store.finish(job, 'failed', error='file no longer in watch directory')
+                log(f"Skipping {job['filename']}: file is gone")
+                continue
+            log(f"Processing {job['filename']} (attempt {job['attempts']})")
+            try:
+                book_id = add_book(job['filename'], timings)
+            except Exception as e:
+                _fail(store, job, e, timings)
+                continue
+            if book_id is None:
+                store.finish(job, 'done', error='already in library', timings=timings)
+                log(f"{job['filename']} is already in the library")
+                continue
+            entry = {'job': job, 'book_id': book_id, 'timings': timings,
+                     'commands': [], 'notes': [], 'left': 2}
+            futures[counters.submit(_run_stage, 'count', count_stage, book_id, timings)] = entry
+            futures[fetchers.submit(_run_stage, 'metadata', metadata_stage, book_id, timings)] = entry
+            _collect(store, futures, wait=False)
+        _collect(store, futures, wait=True)
+
+    if processed:
+        finish_batch()
+        busy = sum(sum(timings.values()) for timings in batch)
+        log(f"Batch of {processed} in {time.monotonic() - started:.1f}s "
+            f"({busy:.1f}s of stage work):\n" + "\n".join(stage_report(batch)))
+    return processed
+
+
+def finish_batch():
+    """Apply the batch's queued writes and refresh the GUI once."""
+    failed, report = write_queue.flush()
+    for cmd, output in failed:
+        log(f"WARNING: calibredb {' '.join(cmd)} failed: {output.strip()}")
+    if report:
+        log(write_queue.report_line(report))
+    refresh_calibre()
+
+
+def refresh_calibre():
+    # calibredb writes bypass the GUI, so send it Ctrl+R to re-scan the
+    # library; the content server then serves the new books
+    proc = subprocess.run(['docker', 'exec', '-u', 'abc', '-e', 'DISPLAY=:1', 'calibre',
+                           'xdotool', 'search', '--class', 'calibre'], capture_output=True, text=True)
+    wid = proc.stdout.split()[0] if proc.stdout.split() else None
+    if wid:
+        subprocess.run(['docker', 'exec', '-u', 'abc', '-e', 'DISPLAY=:1', 'calibre',
+                        'xdotool', 'key', '--window', wid, 'ctrl+r'], capture_output=True)
+        log("Sent Ctrl+R to Calibre (library + content server refreshed)")
+    else:
+        log("WARNING: Could not find Calibre window — content server may not show new books until next refresh")
+
+
+def rescan(store):
+    new = store.add(_acsm_files(WATCH_DIR))
+    if new:
+        log(f"Rescan found {new} new ACSM file(s)")
+
+
+def serve(store, watcher):
+    rescan(store)
+    next_rescan = time.monotonic() + RESCAN_INTERVAL
+    while True:
+        process_due(store)
+        due = store.seconds_until_due()
+        timeout = max(0.0, min(next_rescan - time.monotonic(), RESCAN_INTERVAL if due is None else due))
+        names = watcher.wait(timeout)
+        if names is None or time.monotonic() >= next_rescan:
+            rescan(store)
+            next_rescan = time.monotonic() + RESCAN_INTERVAL
+        elif names:
+            acsm = [n for n in names if n.lower().endswith('.acsm')]
+            if store.add(acsm):
+                log(f"New ACSM detected: {', '.join(acsm)}")
+
+
+def prepare_calibre():
+    """Start the worker and make sure the #pages column exists, as watch-acsm.sh did."""
+    if subprocess.run(['docker', 'compose', 'up', '-d', 'calibre-worker'], cwd=COMPOSE_DIR,
+                      capture_output=True).returncode != 0:
+        log("WARNING: could not start calibre-worker — falling back to calibre-debug per book")
+    _, columns, _ = write_queue.run(['custom_columns'])
+    if not re.search(r'^pages ', columns, re.M):
+        log("Creating #pages custom column...")
+        write_queue.run(['add_custom_column', 'pages', 'Page Count', 'int'])
+
+
+def print_status(store):
+    counts = store.counts()
+    print("Jobs: " + ", ".join(f"{state} {counts.get(state, 0)}"
+                               for state in ('pending', 'running', 'failed', 'done')))
+    for row in store.recent(('pending', 'failed')):
+        when = time.strftime('%Y-%m-%d %H:%M', time.localtime(row['next_attempt_at']))
+        retry = f", next try {when}" if row['state'] == 'pending' and row['attempts'] else ''
+        print(f"  {row['state']:7s} {row['filename']} (attempts {row['attempts']}{retry}): "
+              f"{row['last_error'] or '-'}")
+    for row in store.recent(('done',), limit=5):
+        print(f"  done    {row['filename']} book {row['book_id'] or '-'} {row['timings'] or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import new ACSM files into Calibre as they arrive')
+    parser.add_argument('--once', action='store_true', help='Rescan, process due jobs and exit')
+    parser.add_argument('--poll', action='store_true', help='Poll the directory instead of using inotify')
+    parser.add_argument('--status', action='store_true', help='Show the job table and exit')
+    parser.add_argument('--retry-failed', action='store_true', help='Requeue failed jobs and exit')
+    args = parser.parse_args()
+
+    store = JobStore()
+    imported = store.import_history()
+    if imported:
+        log(f"Imported {imported} entries from {PROCESSED_FILE} as done")
+
+    if args.status:
+        print_status(store)
+        return
+    if args.retry_failed:
+        print(f"Requeued {store.retry_failed()} failed job(s)")
+        return
+    if args.once:
+        rescan(store)
+        process_due(store)
+        return
+
+    log("==========================================")
+    log("ACSM ingestion started")
+    log(f"Watching: {WATCH_DIR}")
+    log(f"Jobs: {JOBS_PATH}")
+    log("==========================================")
+    prepare_calibre()
+    try:
+        serve(store, open_watcher(WATCH_DIR, poll=args.poll))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
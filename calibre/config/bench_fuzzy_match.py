@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Benchmark fuzzy_match against the original difflib best_match().
+
+Builds a synthetic catalogue of titles/authors, derives queries from it
+(exact, re-punctuated, typos, added subtitles, reordered author names) plus
+titles that are not in it, and checks which item each matcher picks:
+
+    python3 bench_fuzzy_match.py --candidates 5000 --queries 300
+
+Reports accuracy against the known answer, agreement with difflib, and
+time per query for a Thunder-sized list (10 items) and the full catalogue.
+"""
+
+import argparse
+import difflib
+import random
+import re
+import time
+
+import fuzzy_match
+
+WORDS = """
+shadow river night empire stone winter garden silent iron crown glass
+storm ember hollow wolf orchard lantern salt bone harbor ashes whisper
+kingdom tide copper raven thorn mirror paper summer letters north city
+daughter house secret island sparrow midnight dragon forest memory star
+bridge widow queen machine ocean fire blood song clock dust mountain
+orphan library lighthouse tea thief heart promise traveler map voyage
+""".split()
+FIRST = "Ann Bob Cara Dev Elif Frank Gwen Hiro Ines Jon Kira Liam Mara Nils Omar Pia".split()
+LAST = ("Herbert Atwood Okafor Lindqvist Moreau Tanaka Quinn Reyes Sato Brennan "
+        "Holloway Vance Adeyemi Castellano Ishikawa Novak").split()
+
+
+# The scoring fetch_metadata.py used before fuzzy_match.py
+def _legacy_norm(s):
+    s = s.lower().strip()
+    s = re.sub(r"[^\w\s]", " ", s)
+    s = re.sub(r"\b(the|a|an)\b", " ", s)
+    return re.sub(r"\s+", " ", s).strip()
+
+
+def legacy_best_match(items, title, author):
+    t_norm = _legacy_norm(title)
+    a_norm = _legacy_norm(author)
+    best, best_score = None, 0.0
+    for item in items:
+        t_ratio = difflib.SequenceMatcher(None, t_norm, _legacy_norm(item.get("title", ""))).ratio()
+        if t_ratio < 0.75:
+            continue
+        a_ratio = difflib.SequenceMatcher(
+            None, a_norm, _legacy_norm(item.get("firstCreatorName", ""))
+        ).ratio() if a_norm else 0.6
+        score = t_ratio * 0.65 + a_ratio * 0.35
+        if score > best_score:
+            best_score, best = score, item
+    return best if best_score >= 0.70 else None
+
+
+def make_catalogue(rng, n):
+    seen, items = set(), []
+    while len(items) < n:
+        title = " ".join(rng.sample(WORDS, rng.randint(2, 5))).title()
+        if rng.random() < 0.3:
+            title = "The " + title
+        if title in seen:
+            continue
+        seen.add(title)
+        items.append({"title": title, "firstCreatorName": f"{rng.choice(FIRST)} {rng.choice(LAST)}"})
+    return items
+
+
+def _typo(rng, s):
+    i = rng.randrange(1, len(s) - 1)
+    return s[:i] + s[i + 1:] if rng.random() < 0.5 else s[:i] + s[i + 1] + s[i] + s[i + 2:]
+
+
+def make_queries(rng, items, n):
+    """(title, author, expected item or None, kind)."""
+    queries = []
+    titles = {item["title"] for item in items}
+    for _ in range(n):
+        kind = rng.choice(("exact", "punct", "typo", "subtitle", "author-order", "absent"))
+        item = rng.choice(items)
+        title, author = item["title"], item["firstCreatorName"]
+        if kind == "punct":
+            title = title.upper().replace(" ", " - ", 1) + "!"
+        elif kind == "typo":
+            title = _typo(rng, title)
+        elif kind == "subtitle":
+            title = f"{title}: A Novel"
+        elif kind == "author-order":
+            first, last = author.split(" ", 1)
+            author = f"{last}, {first}"
+        elif kind == "absent":
+            while title in titles:
+                title = " ".join(rng.sample(WORDS, rng.randint(2, 5))).title()
+            item = None
+        queries.append((title, author, item, kind))
+    return queries
+
+
+def run(matcher, queries):
+    started = time.perf_counter()
+    picks = [matcher(title, author) for title, author, _, _ in queries]
+    return picks, time.perf_counter() - started
+
+
+def report(label, picks, elapsed, queries, reference=None):
+    correct = sum(p is q[2] for p, q in zip(picks, queries))
+    line = (f"  {label:26s} {correct / len(queries) * 100:6.1f}% correct  "
+            f"{elapsed / len(queries) * 1e6:10.1f} µs/query")
+    if reference is not None:
+        agree = sum(p is r for p, r in zip(picks, reference))
+        line += f"  {agree / len(queries) * 100:6.1f}% agree with difflib"
+    print(line)
+
+
+def per_kind(picks, queries):
+    kinds = {}
+    for pick, (_, _, expected, kind) in zip(picks, queries):
+        ok, total = kinds.get(kind, (0, 0))
+        kinds[kind] = (ok + (pick is expected), total + 1)
+    return "  ".join(f"{k} {ok}/{total}" for k, (ok, total) in sorted(kinds.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark fuzzy_match vs difflib best_match')
+    parser.add_argument('--candidates', type=int, default=5000, help='Catalogue size')
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    catalogue = make_catalogue(rng, args.candidates)
+    queries = make_queries(rng, catalogue, args.queries)
+
+    # Thunder-sized: the right item (if any) among 9 random others
+    def shortlist(q):
+        pool = rng.sample(catalogue, 9) + ([q[2]] if q[2] else [rng.choice(catalogue)])
+        rng.shuffle(pool)
+        return pool
+    shortlists = [shortlist(q) for q in queries]
+
+    print(f"🧪 {args.queries} queries, 10-item lists and a {args.candidates}-title catalogue")
+    print()
+    print("10 items per query (one Thunder response):")
+    it = iter(shortlists)
+    legacy, t = run(lambda ti, au: legacy_best_match(next(it), ti, au), queries)
+    report("difflib (legacy)", legacy, t, queries)
+    it = iter(shortlists)
+    fast, t = run(lambda ti, au: fuzzy_match.best_match(next(it), ti, au), queries)
+    report("fuzzy_match.best_match", fast, t, queries, legacy)
+
+    print()
+    print(f"{args.candidates} candidates per query:")
+    big_queries = queries[:max(1, args.queries // 10)]
+    legacy, t = run(lambda ti, au: legacy_best_match(catalogue, ti, au), big_queries)
+    report("difflib (legacy)", legacy, t, big_queries)
+    started = time.perf_counter()
+    index = fuzzy_match.CandidateIndex(catalogue)
+    build = time.perf_counter() - started
+    indexed, t = run(index.best_match, big_queries)
+    report("CandidateIndex", indexed, t, big_queries, legacy)
+    all_indexed, _ = run(index.best_match, queries)
+    print(f"  (index built in {build * 1000:.0f} ms)")
+    print()
+    print("CandidateIndex by query kind:", per_kind(all_indexed, queries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the scripts that open the Calibre library directly.
+
+Calibre modules are imported inside the functions so the scripts that use
+this can still be imported (e.g. for the worker's client mode) outside
+calibre-debug.
+"""
+
+import os
+
+LIBRARY_PATH = '/config/library'
+
+
+def open_cache(library_path=LIBRARY_PATH):
+    """Open the library and load its metadata. Returns (db, cache)."""
+    from calibre.db.cache import Cache
+    from calibre.db.backend import DB
+
+    db = DB(library_path)
+    cache = Cache(db)
+    cache.init()
+    return db, cache
+
+
+def metadata_mtime(library_path=LIBRARY_PATH):
+    """Newest mtime of metadata.db and its journal, to notice outside writes."""
+    newest = 0
+    for suffix in ('', '-wal', '-journal'):
+        try:
+            newest = max(newest, os.stat(os.path.join(library_path, 'metadata.db' + suffix)).st_mtime_ns)
+        except OSError:
+            pass
+    return newest
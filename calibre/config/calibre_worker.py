@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Long-lived Calibre worker: keeps the library Cache loaded and runs jobs.
+
+Starting calibre-debug and loading the library costs seconds per call; the
+worker pays that once and then only does the per-book work. Jobs are JSON
+lines, one response line per job:
+
+    {"id": 1, "op": "count_pages", "book_id": 42}
+    {"id": 2, "op": "fetch_metadata", "book_id": 42}
+    {"id": 3, "op": "set_fields", "book_id": 42, "fields": {"#pages": 249}}
+    {"id": 4, "op": "ping"}
+
+    {"id": 1, "ok": true, "result": {"pages": 249, "words": 95672}, "elapsed": 3.1}
+    {"id": 2, "ok": false, "error": "...", "elapsed": 0.4}
+
+The library is reloaded when metadata.db changes underneath it (calibredb
+or the GUI writing), so reads never see stale metadata.
+
+Connections are served on threads. Library access (loading, reads, writes)
+is serialized by one lock, but counting a book file and waiting on Thunder
+happen outside it, so a count and a metadata fetch for different books
+overlap.
+
+Server (calibre-worker service in docker-compose.yml):
+    calibre-debug -e /config/calibre_worker.py --socket /config/calibre-worker.sock
+    calibre-debug -e /config/calibre_worker.py          # jobs on stdin, results on stdout
+
+Client (host side, plain python3, prints the same KEY=VALUE lines as the
+per-book scripts; exit 3 if the worker is not reachable):
+    python3 config/calibre_worker.py --socket config/calibre-worker.sock --call count_pages 42
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import calibre_library
+import count_pages_cli
+import fetch_metadata
+
+DEFAULT_SOCKET = os.environ.get('CALIBRE_WORKER_SOCKET', '/config/calibre-worker.sock')
+CALL_TIMEOUT = 600
+EXIT_UNREACHABLE = 3
+
+# Fields Calibre stores as dates; JSON carries them as strings
+DATE_FIELDS = ('pubdate', 'timestamp', 'last_modified')
+
+
+class Worker:
+    """Owns one open library and dispatches jobs against it."""
+
+    def __init__(self, library_path=calibre_library.LIBRARY_PATH):
+        self.library_path = library_path
+        self.db = self.cache = None
+        self.loaded_mtime = None
+        self.reloads = 0
+        self.lock = threading.RLock()
+        self.ops = {
+            'ping': self.ping,
+            'count_pages': self.count_pages,
+            'fetch_metadata': self.fetch_metadata,
+            'set_fields': self.set_fields,
+            'reload': self.reload,
+        }
+
+    def ensure_fresh(self):
+        """Open the library, or reopen it if someone else wrote to it. Call with self.lock held."""
+        mtime = calibre_library.metadata_mtime(self.library_path)
+        if self.cache is not None and mtime == self.loaded_mtime:
+            return
+        if self.db is not None:
+            self.db.close()
+            self.reloads += 1
+            print(f"Library changed on disk, reloading ({self.reloads})", file=sys.stderr)
+        started = time.monotonic()
+        self.db, self.cache = calibre_library.open_cache(self.library_path)
+        self.loaded_mtime = mtime
+        print(f"Library loaded in {time.monotonic() - started:.1f}s", file=sys.stderr)
+
+    def _wrote(self):
+        # Our own writes should not force a reload on the next job
+        self.loaded_mtime = calibre_library.metadata_mtime(self.library_path)
+
+    @contextlib.contextmanager
+    def library(self, write=False):
+        """
+        Hold the lock and yield the up-to-date cache. With `write`, the
+        block's own write is remembered so it does not force a reload.
+        """
+        with self.lock:
+            self.ensure_fresh()
+            yield self.cache
+            if write:
+                self._wrote()
+
+    def ping(self, job):
+        return {'pid': os.getpid(), 'reloads': self.reloads}
+
+    def reload(self, job):
+        with self.lock:
+            self.loaded_mtime = None
+            self.ensure_fresh()
+            return {'reloads': self.reloads}
+
+    def count_pages(self, job):
+        with self.library() as cache:
+            book_path = count_pages_cli.choose_format(cache, int(job['book_id']))
+        # Counting only reads the book file
+        return count_pages_cli.count_file(book_path, fast=job.get('fast', False))
+
+    def fetch_metadata(self, job):
+        # The library may be reloaded during the Thunder search; the write
+        # goes to whatever cache is current by then
+        return fetch_metadata.fetch_for_book(None, int(job['book_id']),
+                                             write=job.get('write', True), library=self.library)
+
+    def set_fields(self, job):
+        with self.library(write=True) as cache:
+            book_id = int(job['book_id'])
+            for field, value in job['fields'].items():
+                if field in DATE_FIELDS and isinstance(value, str):
+                    from calibre.utils.date import parse_date
+                    value = parse_date(value)
+                cache.set_field(field, {book_id: value})
+            return {'updated': sorted(job['fields'])}
+
+    def handle(self, line):
+        """Run one JSON job line and return the JSON response line."""
+        started = time.monotonic()
+        job_id = None
+        try:
+            job = json.loads(line)
+            job_id = job.get('id')
+            op = self.ops.get(job.get('op'))
+            if op is None:
+                raise ValueError(f"unknown op {job.get('op')!r}")
+            response = {'id': job_id, 'ok': True, 'result': op(job)}
+        except Exception as e:
+            response = {'id': job_id, 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        response['elapsed'] = round(time.monotonic() - started, 3)
+        return json.dumps(response, default=str)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+
+def serve_stdio(worker):
+    for line in sys.stdin:
+        if line.strip():
+            print(worker.handle(line), flush=True)
+
+
+def serve_socket(worker, path):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if line.strip():
+                    self.wfile.write(worker.handle(line.decode()).encode() + b'\n')
+                    self.wfile.flush()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    # Threaded: Worker.lock keeps the Cache single-writer
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        server.daemon_threads = True
+        os.chmod(path, 0o660)
+        print(f"Calibre worker listening on {path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+def call(path, op, book_id=None, timeout=CALL_TIMEOUT, **extra):
+    """Send one job to a running worker and return its response dict."""
+    job = {'id': os.getpid(), 'op': op, **extra}
+    if book_id is not None:
+        job['book_id'] = book_id
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(job).encode() + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("worker closed the connection")
+    return json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Long-lived Calibre job worker')
+    parser.add_argument('--socket', help=f'Unix socket to serve on / call (default: stdin/stdout '
+                                         f'when serving, {DEFAULT_SOCKET} with --call)')
+    parser.add_argument('--library', default=calibre_library.LIBRARY_PATH)
+    parser.add_argument('--call', metavar='OP', help='Client mode: send one job and print the result')
+    parser.add_argument('book_id', nargs='?', type=int)
+    args = parser.parse_args()
+
+    if args.call:
+        try:
+            response = call(args.socket or DEFAULT_SOCKET, args.call, args.book_id)
+        except (OSError, ConnectionError) as e:
+            print(f"ERROR: calibre worker unreachable: {e}", file=sys.stderr)
+            sys.exit(EXIT_UNREACHABLE)
+        if not response['ok']:
+            print(f"ERROR: {response['error']}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Worker {args.call} took {response['elapsed']}s", file=sys.stderr)
+        formatter = {'count_pages': count_pages_cli.output_lines,
+                     'fetch_metadata': fetch_metadata.output_lines}.get(args.call)
+        if formatter:
+            for line in formatter(response['result']):
+                print(line)
+        else:
+            print(json.dumps(response['result']))
+        return
+
+    worker = Worker(args.library)
+    worker.ensure_fresh()
+    try:
+        if args.socket:
+            serve_socket(worker, args.socket)
+        else:
+            serve_stdio(worker)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.close()
+
+
+if __name__ == "__main__":
+    main()
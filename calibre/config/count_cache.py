@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Content-hash cache for page/word counts.
+
+Counts depend only on the book file and the counting parameters, so they are
+stored under the SHA-256 of the file plus a parameter string. A re-import
+after an ACSM retry, a format swap back to an identical file or the same
+book in another library gets its counts back without re-parsing.
+
+Override the location with COUNT_CACHE_PATH.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+
+CACHE_PATH = os.environ.get('COUNT_CACHE_PATH', '/config/count-cache.sqlite3')
+CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CountCache:
+    """(sha256, params) -> pages, words and how long the original count took."""
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        # Pool processes share the file; wait out each other's writes
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS counts (
+                sha256 TEXT NOT NULL,
+                params TEXT NOT NULL,
+                pages INTEGER,
+                words INTEGER,
+                elapsed REAL NOT NULL,
+                counted_at REAL NOT NULL,
+                PRIMARY KEY (sha256, params)
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, sha256, params):
+        """{'pages', 'words', 'elapsed'} or None."""
+        row = self.conn.execute(
+            "SELECT pages, words, elapsed FROM counts WHERE sha256 = ? AND params = ?",
+            (sha256, params),
+        ).fetchone()
+        if row is None:
+            return None
+        return {'pages': row[0], 'words': row[1], 'elapsed': row[2]}
+
+    def put(self, sha256, params, pages, words, elapsed):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO counts (sha256, params, pages, words, elapsed, counted_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (sha256, params, pages, words, elapsed, time.time()),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+_cache = None
+
+
+def get_cache():
+    """Per-process cache, or None if the file cannot be opened."""
+    global _cache
+    if _cache is None:
+        try:
+            _cache = CountCache()
+        except sqlite3.Error:
+            return None
+    return _cache
+
+
+if __name__ == "__main__":
+    c = CountCache()
+    total, saved = c.conn.execute("SELECT COUNT(*), COALESCE(SUM(elapsed), 0) FROM counts").fetchone()
+    print(f"{total} cached counts ({saved:.0f}s of counting saved per full re-run)")
+    print(f"Cache file: {c.path}")
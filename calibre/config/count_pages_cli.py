@@ -11,47 +11,108 @@ Prints structured output consumed by the watcher script:
 
 The watcher then writes these to the library via calibredb set_custom (GUI-connected),
 so Calibre's UI updates immediately without a restart or manual refresh.
+
+Batch mode (backfills) takes ID lists, ranges or a Calibre search, counts
+on a process pool and streams one JSON line per book as it finishes:
+    calibre-debug -e /config/count_pages_cli.py 12,40-90,377 --jobs 4
+    calibre-debug -e /config/count_pages_cli.py --missing
+    calibre-debug -e /config/count_pages_cli.py --search 'tags:"fantasy"'
+
+    {"book_id": 40, "pages": 312, "words": 98211, "cached": false, "elapsed": 4.21}
+    {"book_id": 41, "error": "No formats found for book ID 41", "elapsed": 0.0}
+
+Counts are cached by the file's SHA-256 (count_cache.py), so a file that
+was counted before comes back instantly; --no-cache forces a recount.
+--fast counts EPUBs with epub_wordcount.py instead of the plugin (check it
+against your library first with epub_wordcount.py --validate).
+
+count_book() is also used by calibre_worker.py, which keeps the library open
+between books.
 """
 
-import sys
+import argparse
+import json
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+import count_cache
+import epub_wordcount
+from calibre_library import open_cache
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: calibre-debug -e /config/count_pages_cli.py <book_id>")
-        sys.exit(1)
+# Prefer EPUB, then PDF, then MOBI
+FORMAT_PREFERENCE = ('EPUB', 'PDF', 'MOBI')
+
+# Count Pages plugin page algorithm 2 = Adobe Digital Editions (ADE)
+PAGE_ALGORITHM = 2
+CUSTOM_CHARS_PER_PAGE = 0
+
+# Books without a page or word count yet
+MISSING_SEARCH = '#pages:false or #word_count:false'
 
-    book_id = int(sys.argv[1])
-    library_path = '/config/library'
 
-    from calibre.db.cache import Cache
-    from calibre.db.backend import DB
+class CountError(Exception):
+    """The book cannot be counted (no usable format)."""
 
-    db = DB(library_path)
-    cache = Cache(db)
-    cache.init()
 
+def choose_format(cache, book_id):
+    """Absolute path of the book's preferred format."""
     formats = cache.formats(book_id)
     if not formats:
-        print(f"ERROR: No formats found for book ID {book_id}", file=sys.stderr)
-        sys.exit(1)
+        raise CountError(f"No formats found for book ID {book_id}")
 
     print(f"Book {book_id} formats: {formats}", file=sys.stderr)
 
-    # Prefer EPUB, then PDF, then MOBI
-    book_path = None
-    for fmt in ['EPUB', 'PDF', 'MOBI']:
+    for fmt in FORMAT_PREFERENCE:
         if fmt in formats:
-            book_path = cache.format_abspath(book_id, fmt)
-            break
+            return cache.format_abspath(book_id, fmt)
+    raise CountError(f"No supported format (EPUB/PDF/MOBI) found for book {book_id}")
 
-    db.close()
 
-    if not book_path:
-        print(f"ERROR: No supported format (EPUB/PDF/MOBI) found for book {book_id}", file=sys.stderr)
-        sys.exit(1)
+def count_params(ext, fast=False):
+    """Cache key part: everything besides the file that changes the result."""
+    if ext == '.epub' and fast:
+        return "epub/streaming/ade-estimate/words"
+    if ext == '.epub':
+        return f"epub/page-algorithm={PAGE_ALGORITHM}/custom-chars={CUSTOM_CHARS_PER_PAGE}/words"
+    if ext == '.pdf':
+        return "pdf/pages"
+    return None
+
 
+def count_file(book_path, use_cache=True, fast=False):
+    """
+    Page and word counts for a book file: {'pages': int|None, 'words': int|None}.
+
+    Results are looked up by the file's SHA-256 first (count_cache.py);
+    'cached' in the result says whether they came from there. With `fast`,
+    EPUBs are counted by epub_wordcount.py straight from the zip instead of
+    the Count Pages plugin.
+    """
+    ext = os.path.splitext(book_path)[1].lower()
+    params = count_params(ext, fast)
+    cache = count_cache.get_cache() if use_cache and params else None
+    if cache is not None:
+        sha256 = count_cache.file_sha256(book_path)
+        hit = cache.get(sha256, params)
+        if hit is not None:
+            print(f"Cached counts for {book_path} (saved {hit['elapsed']:.1f}s)", file=sys.stderr)
+            return {'pages': hit['pages'], 'words': hit['words'], 'cached': True}
+
+    started = time.monotonic()
+    if fast and ext == '.epub':
+        counts = epub_wordcount.count_epub(book_path)
+        result = {'pages': counts['pages'], 'words': counts['words']}
+    else:
+        result = _compute_counts(book_path)
+    if cache is not None:
+        cache.put(sha256, params, result['pages'], result['words'], time.monotonic() - started)
+    result['cached'] = False
+    return result
+
+
+def _compute_counts(book_path):
     print(f"Processing: {book_path}", file=sys.stderr)
     ext = os.path.splitext(book_path)[1].lower()
 
@@ -61,31 +122,61 @@ def main():
     word_count = None
     page_count = None
 
-    try:
-        if ext == '.epub':
-            iterator = EbookIterator(book_path)
-            iterator.__enter__(only_input_plugin=True, run_char_count=True, read_anchor_map=False)
+    if ext == '.epub':
+        iterator = EbookIterator(book_path)
+        iterator.__enter__(only_input_plugin=True, run_char_count=True, read_anchor_map=False)
+
+        # Word count
+        iterator, word_count = get_word_count(iterator, book_path, False)
+
+        # Page count — algorithm 2 = Adobe Digital Editions (ADE)
+        iterator, page_count = get_page_count(iterator, book_path, PAGE_ALGORITHM, CUSTOM_CHARS_PER_PAGE)
+
+        iterator.__exit__(None, None, None)
+
+    elif ext == '.pdf':
+        from calibre_plugins.count_pages.statistics import get_pdf_page_count
+        page_count = get_pdf_page_count(book_path)
+
+    else:
+        print(f"Unsupported format: {ext} — skipping count", file=sys.stderr)
+
+    return {
+        'pages': int(page_count) if page_count is not None else None,
+        'words': word_count,
+    }
+
 
-            # Word count
-            iterator, word_count = get_word_count(iterator, book_path, False)
+def count_book(cache, book_id, use_cache=True, fast=False):
+    """Counts for a book in an open library."""
+    return count_file(choose_format(cache, book_id), use_cache, fast)
 
-            # Page count — algorithm 2 = Adobe Digital Editions (ADE)
-            iterator, page_count = get_page_count(iterator, book_path, 2, 0)
 
-            iterator.__exit__(None, None, None)
+def output_lines(result):
+    """Machine-readable lines for the watcher."""
+    if result.get('pages') is not None:
+        yield f"BOOK_PAGES={result['pages']}"
+    if result.get('words') is not None:
+        yield f"BOOK_WORDS={result['words']}"
 
-        elif ext == '.pdf':
-            from calibre_plugins.count_pages.statistics import get_pdf_page_count
-            page_count = get_pdf_page_count(book_path)
 
-        else:
-            print(f"Unsupported format: {ext} — skipping count", file=sys.stderr)
+def count_single(book_id):
+    """The watcher's one-book mode: KEY=VALUE lines on stdout."""
+    db, cache = open_cache()
+    try:
+        book_path = choose_format(cache, book_id)
+    except CountError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        db.close()
+
+    try:
+        result = count_file(book_path)
 
         # Print machine-readable values on stdout for the watcher to parse
-        if page_count is not None:
-            print(f"BOOK_PAGES={int(page_count)}")
-        if word_count is not None:
-            print(f"BOOK_WORDS={word_count}")
+        for line in output_lines(result):
+            print(line)
 
     except Exception as e:
         print(f"ERROR: {e}", file=sys.stderr)
@@ -94,5 +185,103 @@ def main():
         sys.exit(1)
 
 
+def parse_ids(specs):
+    """Book IDs from arguments like "12", "40-90" or "1,2,5-7"."""
+    ids = []
+    for spec in specs:
+        for part in spec.replace(',', ' ').split():
+            if '-' in part:
+                lo, hi = part.split('-', 1)
+                ids.extend(range(int(lo), int(hi) + 1))
+            else:
+                ids.append(int(part))
+    return list(dict.fromkeys(ids))
+
+
+def _warm_worker():
+    """Import the counting stack once per pool process rather than per book."""
+    from calibre_plugins.count_pages.statistics import get_page_count  # noqa: F401
+    from calibre.ebooks.oeb.iterator.book import EbookIterator  # noqa: F401
+
+
+def _count_job(book_id, book_path, use_cache=True, fast=False):
+    """Process-pool entry point: one book, never raises."""
+    started = time.monotonic()
+    try:
+        record = {'book_id': book_id, **count_file(book_path, use_cache, fast)}
+    except Exception as e:
+        record = {'book_id': book_id, 'error': f"{type(e).__name__}: {e}"}
+    record['elapsed'] = round(time.monotonic() - started, 3)
+    return record
+
+
+def run_batch(book_ids, search, jobs, use_cache=True, fast=False):
+    """Count many books on a process pool, printing one JSON line per book."""
+    db, cache = open_cache()
+    try:
+        if search:
+            book_ids = sorted(set(book_ids) | set(cache.search(search)))
+        paths, records = {}, []
+        for book_id in book_ids:
+            try:
+                paths[book_id] = choose_format(cache, book_id)
+            except Exception as e:
+                records.append({'book_id': book_id, 'error': str(e), 'elapsed': 0.0})
+    finally:
+        db.close()
+
+    for record in records:
+        print(json.dumps(record), flush=True)
+
+    print(f"Counting {len(paths)} books on {jobs} processes", file=sys.stderr)
+    started = time.monotonic()
+    failed = len(records)
+    cached = 0
+    # calibre-debug -e runs this file in calibre.debug's globals, so the jobs
+    # must be pickled by reference to the importable module, not to __main__
+    import count_pages_cli as jobs_module
+
+    # Each worker process builds its own EbookIterator per book; nothing is shared
+    with ProcessPoolExecutor(max_workers=jobs, initializer=jobs_module._warm_worker) as pool:
+        futures = [pool.submit(jobs_module._count_job, book_id, path, use_cache, fast)
+                   for book_id, path in paths.items()]
+        for future in as_completed(futures):
+            record = future.result()
+            failed += 'error' in record
+            cached += bool(record.get('cached'))
+            print(json.dumps(record), flush=True)
+
+    elapsed = time.monotonic() - started
+    print(f"Done: {len(book_ids)} books, {cached} from cache, {failed} errors, {elapsed:.1f}s "
+          f"({len(paths) / elapsed if elapsed else 0:.2f} books/s)", file=sys.stderr)
+    return failed
+
+
+def main():
+    if len(sys.argv) == 2 and sys.argv[1].isdigit():
+        count_single(int(sys.argv[1]))
+        return
+
+    parser = argparse.ArgumentParser(description='Page/word counts for one or many Calibre books')
+    parser.add_argument('ids', nargs='*', help='Book IDs, lists or ranges (e.g. 12 40-90 1,2,3)')
+    parser.add_argument('--search', help='Calibre search selecting the books to count')
+    parser.add_argument('--missing', action='store_true',
+                        help=f'Books missing a page or word count ({MISSING_SEARCH})')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes (default: all cores)')
+    parser.add_argument('--no-cache', action='store_true', help='Recount even files counted before')
+    parser.add_argument('--fast', action='store_true',
+                        help='Count EPUBs with the streaming counter (epub_wordcount.py) '
+                             'instead of the Count Pages plugin')
+    args = parser.parse_args()
+
+    search = MISSING_SEARCH if args.missing else args.search
+    book_ids = parse_ids(args.ids)
+    if not book_ids and not search:
+        parser.error("give book IDs, --search or --missing")
+
+    sys.exit(1 if run_batch(book_ids, search, max(1, args.jobs), not args.no_cache, args.fast) else 0)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Streaming EPUB word/character counter that does not need Calibre.
+
+EbookIterator unpacks and preprocesses the whole book into a temp directory
+before the Count Pages plugin can count it. This reads the spine straight
+out of the zip instead: each XHTML member is decompressed in chunks and fed
+to an incremental HTML parser, so nothing touches disk and memory stays at
+about one chunk plus the parser's pending tag. The ADE-style page estimate
+(one page per started 1024 compressed bytes of each spine item) comes from
+the zip directory alone.
+
+Usage:
+    ./epub_wordcount.py book.epub [...]
+    calibre-debug -e /config/epub_wordcount.py --validate /nas-books/some/dir
+
+--validate counts every EPUB both ways (this module and the Count Pages
+plugin through count_pages_cli) and reports the deviation, so the fast path
+can be checked on a real corpus before relying on it.
+"""
+
+import codecs
+import math
+import os
+import posixpath
+import re
+import time
+import zipfile
+from html.parser import HTMLParser
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+CHUNK = 64 * 1024
+ADE_BYTES_PER_PAGE = 1024
+
+# "don't" and "well-known" are one word each
+_WORD = re.compile(r"\w+(?:['’\-]\w+)*")
+_SPACE = re.compile(r'\s+')
+# Trailing text that could still grow into (or join) a word in the next chunk
+_TAIL = re.compile(r"[\w'’\-]+$")
+
+# Tags that end a word even without whitespace around them
+BLOCK_TAGS = frozenset((
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt',
+    'figcaption', 'figure', 'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header',
+    'hr', 'img', 'li', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul',
+))
+SKIP_TAGS = frozenset(('head', 'script', 'style', 'title'))
+
+CONTAINER_NS = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+OPF_NS = '{http://www.idpf.org/2007/opf}'
+XHTML_TYPES = frozenset(('application/xhtml+xml', 'text/html', 'application/x-dtbook+xml'))
+
+
+class _TextCounter(HTMLParser):
+    """Counts words and characters of body text as it is fed."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.words = 0
+        self.chars = 0
+        self.skip_depth = 0
+        self.pending = ''   # text that may continue a word in the next data chunk
+        self.last_space = True
+
+    def _flush(self):
+        if self.pending:
+            self.words += len(_WORD.findall(self.pending))
+            self.pending = ''
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._flush()
+            self.last_space = True
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._flush()
+            self.last_space = True
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self._flush()
+            self.last_space = True
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        # Characters with whitespace runs collapsed, as a reader would see them
+        text = _SPACE.sub(' ', data)
+        if self.last_space and text.startswith(' '):
+            text = text[1:]
+        if text:
+            self.chars += len(text)
+            self.last_space = text.endswith(' ')
+
+        data = self.pending + data
+        self.pending = ''
+        tail = _TAIL.search(data)
+        if tail:
+            self.pending = tail.group()
+            data = data[:tail.start()]
+        self.words += len(_WORD.findall(data))
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def _opf_path(zf):
+    container = ElementTree.fromstring(zf.read('META-INF/container.xml'))
+    rootfile = container.find(f'.//{CONTAINER_NS}rootfile')
+    if rootfile is None:
+        raise ValueError("META-INF/container.xml has no rootfile")
+    return rootfile.get('full-path')
+
+
+def spine_members(zf):
+    """Zip member names of the spine's XHTML documents, in reading order."""
+    opf_path = _opf_path(zf)
+    opf = ElementTree.fromstring(zf.read(opf_path))
+    base = posixpath.dirname(opf_path)
+    manifest = {}
+    for item in opf.iter(f'{OPF_NS}item'):
+        href = unquote(item.get('href', '').split('#')[0])
+        manifest[item.get('id')] = (posixpath.normpath(posixpath.join(base, href)),
+                                    item.get('media-type'))
+    names = set(zf.namelist())
+    members = []
+    for itemref in opf.iter(f'{OPF_NS}itemref'):
+        name, media_type = manifest.get(itemref.get('idref'), (None, None))
+        if name in names and (media_type in XHTML_TYPES or media_type is None):
+            members.append(name)
+    return members
+
+
+def _decoder_for(head):
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return codecs.getincrementaldecoder('utf-16')(errors='replace')
+    return codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+
+
+def count_member(zf, name):
+    """(words, chars) of one spine document, streamed in CHUNK-sized pieces."""
+    counter = _TextCounter()
+    with zf.open(name) as f:
+        chunk = f.read(max(CHUNK, 4))
+        decoder = _decoder_for(chunk)
+        while chunk:
+            counter.feed(decoder.decode(chunk))
+            chunk = f.read(CHUNK)
+        counter.feed(decoder.decode(b'', final=True))
+    counter.close()
+    return counter.words, counter.chars
+
+
+def count_epub(path):
+    """{'words', 'chars', 'pages'} for an EPUB; pages is the ADE-style estimate."""
+    words = chars = pages = 0
+    with zipfile.ZipFile(path) as zf:
+        for name in spine_members(zf):
+            w, c = count_member(zf, name)
+            words += w
+            chars += c
+            pages += max(1, math.ceil(zf.getinfo(name).compress_size / ADE_BYTES_PER_PAGE))
+    return {'words': words, 'chars': chars, 'pages': pages}
+
+
+def _epubs(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith('.epub'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def _deviation(fast, reference):
+    if not reference:
+        return None
+    return (fast - reference) / reference * 100
+
+
+def validate(paths):
+    """Compare against the Count Pages plugin (run inside calibre-debug)."""
+    from count_pages_cli import _compute_counts
+
+    word_devs, page_devs = [], []
+    fast_time = plugin_time = 0.0
+    print(f"{'words%':>8} {'pages%':>8} {'fast s':>7} {'plugin s':>8}  book")
+    for path in _epubs(paths):
+        try:
+            started = time.monotonic()
+            fast = count_epub(path)
+            fast_elapsed = time.monotonic() - started
+            started = time.monotonic()
+            reference = _compute_counts(path)
+            plugin_elapsed = time.monotonic() - started
+        except Exception as e:
+            print(f"{'-':>8} {'-':>8} {'-':>7} {'-':>8}  {os.path.basename(path)}: ❌ {e}")
+            continue
+        fast_time += fast_elapsed
+        plugin_time += plugin_elapsed
+        wd = _deviation(fast['words'], reference['words'])
+        pd = _deviation(fast['pages'], reference['pages'])
+        if wd is not None:
+            word_devs.append(wd)
+        if pd is not None:
+            page_devs.append(pd)
+        fmt = lambda d: f"{d:+8.2f}" if d is not None else f"{'-':>8}"
+        print(f"{fmt(wd)} {fmt(pd)} {fast_elapsed:7.2f} {plugin_elapsed:8.2f}  {os.path.basename(path)}")
+
+    print()
+    for label, devs in (('words', word_devs), ('pages', page_devs)):
+        if devs:
+            mean_abs = sum(abs(d) for d in devs) / len(devs)
+            print(f"{label}: {len(devs)} books, mean |deviation| {mean_abs:.2f}%, "
+                  f"max {max(devs, key=abs):+.2f}%")
+    if plugin_time:
+        print(f"time: fast {fast_time:.1f}s vs plugin {plugin_time:.1f}s "
+              f"({plugin_time / fast_time if fast_time else 0:.1f}x)")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Streaming EPUB word/character counter')
+    parser.add_argument('paths', nargs='+', help='EPUB files or directories')
+    parser.add_argument('--validate', action='store_true',
+                        help='Compare with the Count Pages plugin (needs calibre-debug)')
+    args = parser.parse_args()
+
+    if args.validate:
+        validate(args.paths)
+        return
+    for path in _epubs(args.paths):
+        started = time.monotonic()
+        counts = count_epub(path)
+        print(f"{counts['words']:8d} words {counts['chars']:9d} chars {counts['pages']:5d} pages "
+              f"{time.monotonic() - started:6.2f}s  {path}")
+
+
+if __name__ == "__main__":
+    main()
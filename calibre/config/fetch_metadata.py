@@ -4,9 +4,21 @@ Fetch series and publication date from OverDrive Thunder API for a Calibre book.
 
 Searches Thunder API by title+author, finds the best match, and writes
 series name, series index, and publication date back to the Calibre library.
+fetch_for_book() is also used by calibre_worker.py.
 
 Usage (inside container):
-    calibre-debug -e /config/fetch_metadata.py <book_id>
+    calibre-debug -e /config/fetch_metadata.py <book_id> [--no-write]
+    calibre-debug -e /config/fetch_metadata.py --all [--dry-run] [--workers N]
+
+--all selects every book missing series or pubdate, resolves them a few at
+a time and writes everything back with one set_field call per field in a
+single transaction, printing a diff first (--dry-run stops there).
+With --no-write a single book is only looked up; the caller applies the
+printed values itself (acsm_ingest.py queues them for the write queue).
+
+Libraries are searched concurrently over keep-alive connections, and
+responses are cached on disk (thunder_cache.py). THUNDER_BASE overrides
+the API root; tests/test_fetch_metadata.py runs against a stub server.
 
 Prints to stdout for the watcher script:
     METADATA_SERIES=The Book of Tea
@@ -16,30 +28,156 @@ Prints to stdout for the watcher script:
     METADATA_ERROR=<message>    (on failure)
 """
 
-import difflib
+import contextlib
+import http.client
 import json
-import re
+import os
+import socket
 import sys
+import threading
+import time
 import urllib.parse
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import fuzzy_match
+import ratelimit
+import thunder_cache
+from calibre_library import open_cache
 
-THUNDER_BASE = "https://thunder.api.overdrive.com/v2/libraries"
-# Libraries to try in order — first hit with a good match wins
+# Point THUNDER_BASE at a local stub server to test without OverDrive
+THUNDER_BASE = os.environ.get("THUNDER_BASE", "https://thunder.api.overdrive.com/v2/libraries")
+THUNDER_TIMEOUT = 12
+# Libraries searched concurrently — first good match wins, the rest are cancelled
 SEARCH_LIBRARIES = ["ppld", "pueblolibrary", "arapahoe", "jeffco"]
+# Books resolved at once in --all mode (each fans out to every library)
+BACKFILL_WORKERS = 4
 
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
 
-def _norm(s: str) -> str:
-    s = s.lower().strip()
-    s = re.sub(r"[^\w\s]", " ", s)
-    s = re.sub(r"\b(the|a|an)\b", " ", s)
-    return re.sub(r"\s+", " ", s).strip()
+_norm = fuzzy_match.normalize
+
+
+class SearchCancelled(Exception):
+    pass
+
+
+class _Cancel:
+    """Cancels one fan-out: stops queued searches and aborts in-flight ones."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.inflight = set()
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def register(self, conn):
+        with self.lock:
+            if self.event.is_set():
+                raise SearchCancelled()
+            self.inflight.add(conn)
+
+    def unregister(self, conn):
+        with self.lock:
+            self.inflight.discard(conn)
+
+    def cancel(self):
+        with self.lock:
+            self.event.set()
+            for conn in self.inflight:
+                # shutdown() wakes a thread blocked in recv(); close() alone may not
+                if conn.sock is not None:
+                    try:
+                        conn.sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+
+class _ConnectionPool:
+    """Idle keep-alive connections per host, shared by the search threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def get(self, scheme, netloc):
+        with self.lock:
+            conns = self.idle.get((scheme, netloc))
+            if conns:
+                return conns.pop()
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(netloc, timeout=THUNDER_TIMEOUT)
+
+    def put(self, scheme, netloc, conn):
+        with self.lock:
+            self.idle.setdefault((scheme, netloc), []).append(conn)
+
+
+_connections = _ConnectionPool()
+_executor = ThreadPoolExecutor(max_workers=2 * len(SEARCH_LIBRARIES), thread_name_prefix="thunder")
+
+
+def _get_json(url: str, cancel: "_Cancel" = None):
+    """GET a JSON document over a pooled keep-alive connection, behind the rate limiter."""
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    host = parts.hostname
+    limiter = ratelimit.get_limiter()
+
+    for attempt in range(ratelimit.MAX_RETRIES + 1):
+        limiter.acquire(host)
+        conn = _connections.get(parts.scheme, parts.netloc)
+        try:
+            # Inside the try: a search cancelled before it starts still closes its connection
+            if cancel is not None:
+                cancel.register(conn)
+            try:
+                conn.request("GET", path, headers={"Accept": "application/json"})
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # The server dropped an idle keep-alive connection; reconnect once
+                if cancel is not None and cancel.is_set():
+                    raise
+                conn.close()
+                conn.request("GET", path, headers={"Accept": "application/json"})
+                response = conn.getresponse()
+            body = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        finally:
+            if cancel is not None:
+                cancel.unregister(conn)
+
+        _connections.put(parts.scheme, parts.netloc, conn)
+        if response.status in ratelimit.RETRY_STATUSES:
+            # Recorded even on the last attempt so the next search backs off too
+            delay = limiter.throttled(host, ratelimit.parse_retry_after(response.getheader("Retry-After")))
+            if attempt < ratelimit.MAX_RETRIES:
+                print(f"  ⏳ {host} returned {response.status}, backing off {delay:.1f}s", file=sys.stderr)
+                continue
+        if response.status != 200:
+            raise OSError(f"HTTP {response.status} {response.reason}")
+        limiter.success(host)
+        return json.loads(body)
+
+
+def query_key(title: str, author: str) -> str:
+    return f"{_norm(title)}|{_norm(author)}"
 
 
-def thunder_search(library_key: str, title: str, author: str) -> list:
+def thunder_search(library_key: str, title: str, author: str, cancel: "_Cancel" = None) -> list:
+    cache = thunder_cache.get_cache()
+    key = query_key(title, author)
+    if cache is not None:
+        items = cache.get(library_key, key)
+        if items is not None:
+            return items
+
     query = f"{title} {author}".strip()
     params = urllib.parse.urlencode({
         "query": query,
@@ -48,85 +186,57 @@ def thunder_search(library_key: str, title: str, author: str) -> list:
         "perPage": 10,
     })
     url = f"{THUNDER_BASE}/{library_key}/media?{params}"
-    req = urllib.request.Request(url, headers={"Accept": "application/json"})
     try:
-        with urllib.request.urlopen(req, timeout=12) as r:
-            return json.loads(r.read()).get("items", [])
+        items = _get_json(url, cancel).get("items", [])
     except Exception as e:
-        print(f"  Thunder [{library_key}] error: {e}", file=sys.stderr)
+        if cancel is None or not cancel.is_set():
+            print(f"  Thunder [{library_key}] error: {e}", file=sys.stderr)
         return []
+    if cache is not None:
+        cache.put(library_key, key, items)
+    return items
 
 
 def best_match(items: list, title: str, author: str):
     """Return the best-matching Thunder item, or None if confidence is too low."""
-    t_norm = _norm(title)
-    a_norm = _norm(author)
-    best, best_score = None, 0.0
-    for item in items:
-        t_ratio = difflib.SequenceMatcher(
-            None, t_norm, _norm(item.get("title", ""))
-        ).ratio()
-        if t_ratio < 0.75:
-            continue
-        a_ratio = difflib.SequenceMatcher(
-            None, a_norm, _norm(item.get("firstCreatorName", ""))
-        ).ratio() if a_norm else 0.6
-        score = t_ratio * 0.65 + a_ratio * 0.35
-        if score > best_score:
-            best_score, best = score, item
-    return best if best_score >= 0.70 else None
-
+    return fuzzy_match.best_match(items, title, author)
 
-# ---------------------------------------------------------------------------
-# Main
-# ---------------------------------------------------------------------------
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: calibre-debug -e /config/fetch_metadata.py <book_id>")
-        sys.exit(1)
-
-    book_id = int(sys.argv[1])
-    library_path = "/config/library"
-
-    from calibre.db.cache import Cache
-    from calibre.db.backend import DB
-
-    db_obj = DB(library_path)
-    cache = Cache(db_obj)
-    cache.init()
-
-    title = cache.field_for("title", book_id) or ""
-    raw_authors = cache.field_for("authors", book_id) or ()
-    author = raw_authors[0] if raw_authors else ""
-    current_series = cache.field_for("series", book_id) or ""
-    current_pubdate = cache.field_for("pubdate", book_id)
-
-    print(f"Book {book_id}: '{title}' by '{author}'", file=sys.stderr)
-    print(f"  Current series: '{current_series}' | pubdate: {current_pubdate}", file=sys.stderr)
+def find_match(title: str, author: str):
+    """
+    Search every library at once and return the first confident match as
+    (item, library); the searches still outstanding are cancelled.
+    """
+    cancel = _Cancel()
+    futures = {_executor.submit(thunder_search, lib, title, author, cancel): lib
+               for lib in SEARCH_LIBRARIES}
+    try:
+        for future in as_completed(futures):
+            lib = futures[future]
+            match = best_match(future.result(), title, author)
+            if match:
+                print(f"  Matched '{match['title']}' in [{lib}]", file=sys.stderr)
+                return match, lib
+    finally:
+        cancel.cancel()
+        for future in futures:
+            future.cancel()
+    return None, None
 
-    # Decide what we need to fetch
-    need_series = not current_series
-    need_pubdate = (current_pubdate is None or current_pubdate.year < 1800)
 
-    if not need_series and not need_pubdate:
-        print("METADATA_SKIPPED=already complete")
-        db_obj.close()
-        return
+def needs(current_series, current_pubdate):
+    """(need_series, need_pubdate) for a book's current values."""
+    return not current_series, (current_pubdate is None or current_pubdate.year < 1800)
 
-    # Search Thunder API
-    match = None
-    for lib in SEARCH_LIBRARIES:
-        items = thunder_search(lib, title, author)
-        match = best_match(items, title, author)
-        if match:
-            print(f"  Matched '{match['title']}' in [{lib}]", file=sys.stderr)
-            break
 
+def resolve(title: str, author: str, need_series: bool, need_pubdate: bool) -> dict:
+    """
+    Thunder values for whatever is missing: a dict with any of series,
+    series_index, pubdate, or error with a reason. Nothing is written.
+    """
+    match, _ = find_match(title, author)
     if not match:
-        print("METADATA_ERROR=no matching title found in Thunder API")
-        db_obj.close()
-        return
+        return {"error": "no matching title found in Thunder API"}
 
     ds = match.get("detailedSeries") or {}
     series_name = ds.get("seriesName", "")
@@ -136,27 +246,182 @@ def main():
     print(f"  Thunder data: series='{series_name}' #{series_index} date={publish_date}",
           file=sys.stderr)
 
-    # Write back
+    result = {}
     if need_series and series_name:
-        cache.set_field("series", {book_id: series_name})
-        print(f"METADATA_SERIES={series_name}")
+        result["series"] = series_name
         if series_index:
             try:
-                cache.set_field("series_index", {book_id: float(series_index)})
-                print(f"METADATA_SERIES_INDEX={series_index}")
+                float(series_index)
+                result["series_index"] = series_index
             except (ValueError, TypeError):
                 pass
 
     if need_pubdate and publish_date:
         try:
             from calibre.utils.date import parse_date
-            pd = parse_date(publish_date)
-            cache.set_field("pubdate", {book_id: pd})
-            print(f"METADATA_PUBDATE={publish_date}")
+            parse_date(publish_date)
+            result["pubdate"] = publish_date
         except Exception as e:
             print(f"  Date write error: {e}", file=sys.stderr)
 
-    db_obj.close()
+    return result
+
+
+def apply_updates(cache, results: dict) -> int:
+    """
+    Write {book_id: resolve() result} back with one set_field call per
+    field, all in one SQLite transaction. Returns the number of books changed.
+    """
+    from calibre.utils.date import parse_date
+
+    series, series_index, pubdate = {}, {}, {}
+    for book_id, result in results.items():
+        if "series" in result:
+            series[book_id] = result["series"]
+        if "series_index" in result:
+            series_index[book_id] = float(result["series_index"])
+        if "pubdate" in result:
+            pubdate[book_id] = parse_date(result["pubdate"])
+
+    # series before series_index: setting a series resets the index
+    with cache.backend.conn:
+        for field, values in (("series", series), ("series_index", series_index), ("pubdate", pubdate)):
+            if values:
+                cache.set_field(field, values)
+    return len(set(series) | set(series_index) | set(pubdate))
+
+
+def fetch_for_book(cache, book_id: int, write: bool = True, library=None) -> dict:
+    """
+    Fill in missing series/pubdate for one book from Thunder.
+
+    Returns a dict with any of series, series_index, pubdate (what was
+    written), or skipped / error with a reason. `library(write=False)` is
+    a context manager yielding the cache to use; a long-lived caller can
+    lock and refresh the library in it. The reads and the write each get
+    their own block, and the Thunder search runs outside both.
+    """
+    library = library or (lambda write=False: contextlib.nullcontext(cache))
+    with library() as cache:
+        title = cache.field_for("title", book_id) or ""
+        raw_authors = cache.field_for("authors", book_id) or ()
+        author = raw_authors[0] if raw_authors else ""
+        current_series = cache.field_for("series", book_id) or ""
+        current_pubdate = cache.field_for("pubdate", book_id)
+
+    print(f"Book {book_id}: '{title}' by '{author}'", file=sys.stderr)
+    print(f"  Current series: '{current_series}' | pubdate: {current_pubdate}", file=sys.stderr)
+
+    # Decide what we need to fetch
+    need_series, need_pubdate = needs(current_series, current_pubdate)
+    if not need_series and not need_pubdate:
+        return {"skipped": "already complete"}
+
+    result = resolve(title, author, need_series, need_pubdate)
+    if write and "error" not in result:
+        with library(write=True) as cache:
+            apply_updates(cache, {book_id: result})
+    return result
+
+
+def incomplete_books(cache) -> list:
+    """(book_id, title, author, series, pubdate) for every book missing series or pubdate."""
+    book_ids = cache.all_book_ids()
+    titles = cache.all_field_for("title", book_ids)
+    authors = cache.all_field_for("authors", book_ids)
+    series = cache.all_field_for("series", book_ids)
+    pubdates = cache.all_field_for("pubdate", book_ids)
+
+    books = []
+    for book_id in sorted(book_ids):
+        if any(needs(series[book_id], pubdates[book_id])):
+            book_authors = authors[book_id] or ()
+            books.append((book_id, titles[book_id] or "", book_authors[0] if book_authors else "",
+                          series[book_id] or "", pubdates[book_id]))
+    return books
+
+
+def backfill(cache, workers: int = BACKFILL_WORKERS, dry_run: bool = False, limit: int = None):
+    """Resolve every incomplete book concurrently, print a diff, then write in one batch."""
+    books = incomplete_books(cache)
+    if limit:
+        books = books[:limit]
+    print(f"{len(books)} books missing series or pubdate; resolving with {workers} workers")
+
+    def job(book):
+        book_id, title, author, current_series, current_pubdate = book
+        return resolve(title, author, *needs(current_series, current_pubdate))
+
+    started = time.monotonic()
+    results, misses = {}, 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as pool:
+        for book, result in zip(books, pool.map(job, books)):
+            book_id, title, _, current_series, current_pubdate = book
+            if "error" in result or not result:
+                misses += 1
+                continue
+            results[book_id] = result
+            changes = []
+            if "series" in result:
+                index = f" #{result['series_index']}" if "series_index" in result else ""
+                changes.append(f"series '{current_series}' -> '{result['series']}'{index}")
+            if "pubdate" in result:
+                changes.append(f"pubdate {current_pubdate} -> {result['pubdate']}")
+            print(f"  {book_id:6d} {title[:50]:50s} {'; '.join(changes)}")
+    elapsed = time.monotonic() - started
+
+    print()
+    print(f"Resolved {len(results)} books, {misses} without a usable match, in {elapsed:.1f}s")
+    if dry_run:
+        print("Dry run: nothing written")
+        return
+    if results:
+        changed = apply_updates(cache, results)
+        print(f"Wrote {changed} books in one transaction")
+
+
+def output_lines(result: dict):
+    """Machine-readable lines for the watcher."""
+    if "skipped" in result:
+        yield f"METADATA_SKIPPED={result['skipped']}"
+    if "error" in result:
+        yield f"METADATA_ERROR={result['error']}"
+    if "series" in result:
+        yield f"METADATA_SERIES={result['series']}"
+    if "series_index" in result:
+        yield f"METADATA_SERIES_INDEX={result['series_index']}"
+    if "pubdate" in result:
+        yield f"METADATA_PUBDATE={result['pubdate']}"
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fill in series/pubdate from OverDrive Thunder")
+    parser.add_argument("book_id", nargs="?", type=int)
+    parser.add_argument("--all", action="store_true", help="Backfill every book missing series or pubdate")
+    parser.add_argument("--dry-run", action="store_true", help="With --all: print the diff, write nothing")
+    parser.add_argument("--no-write", action="store_true", help="With a book_id: print the values, write nothing")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="With --all: books in flight")
+    parser.add_argument("--limit", type=int, help="With --all: only the first N books")
+    args = parser.parse_args()
+
+    if args.book_id is None and not args.all:
+        parser.error("give a book_id or --all")
+
+    db_obj, cache = open_cache()
+    try:
+        if args.all:
+            backfill(cache, max(1, args.workers), args.dry_run, args.limit)
+        else:
+            for line in output_lines(fetch_for_book(cache, args.book_id, write=not args.no_write)):
+                print(line)
+    finally:
+        db_obj.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Fast title/author matching for Thunder results and larger catalogues.
+
+Normalization is compiled once and memoized, and similarity is the Dice
+coefficient over character trigrams, on the same 0-1 scale as difflib's
+ratio, so best_match() keeps fetch_metadata's thresholds. Trigrams punish
+a single typo in a short title hard, so pairs that land just under the
+title threshold are settled by difflib; that is the only place it runs.
+
+For big candidate sets (a catalogue dump, the whole library matched
+against an export) CandidateIndex keeps a trigram inverted index: a query
+only looks at titles sharing a trigram with it, and their Dice score falls
+straight out of the overlap counts, so the per-pair work is limited to the
+few titles that come close.
+
+bench_fuzzy_match.py compares speed and accuracy with the difflib scoring.
+"""
+
+import difflib
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+# Same thresholds and weights as the original difflib best_match()
+TITLE_MIN = 0.75
+SCORE_MIN = 0.70
+TITLE_WEIGHT = 0.65
+AUTHOR_WEIGHT = 0.35
+NO_AUTHOR_SCORE = 0.6
+# Trigram scores from here up to TITLE_MIN get a difflib second opinion
+PREFILTER_MIN = 0.5
+
+_PUNCT = re.compile(r"[^\w\s]")
+_ARTICLES = re.compile(r"\b(the|a|an)\b")
+_SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=65536)
+def normalize(s: str) -> str:
+    """Lowercase, drop punctuation and articles, collapse whitespace."""
+    s = _PUNCT.sub(" ", s.lower().strip())
+    s = _ARTICLES.sub(" ", s)
+    return _SPACES.sub(" ", s).strip()
+
+
+@lru_cache(maxsize=65536)
+def _trigrams(norm: str) -> frozenset:
+    padded = f" {norm} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _dice(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def _refine(dice: float, a_norm: str, b_norm: str) -> float:
+    if PREFILTER_MIN <= dice < TITLE_MIN:
+        return max(dice, difflib.SequenceMatcher(None, a_norm, b_norm).ratio())
+    return dice
+
+
+def similarity(a_norm: str, b_norm: str) -> float:
+    """0-1 similarity of two normalized strings."""
+    if a_norm == b_norm:
+        return 1.0 if a_norm else 0.0
+    return _refine(_dice(_trigrams(a_norm), _trigrams(b_norm)), a_norm, b_norm)
+
+
+def _score(t_ratio: float, a_norm: str, candidate_author: str) -> float:
+    a_ratio = similarity(a_norm, normalize(candidate_author)) if a_norm else NO_AUTHOR_SCORE
+    return t_ratio * TITLE_WEIGHT + a_ratio * AUTHOR_WEIGHT
+
+
+def best_match(items: list, title: str, author: str,
+               title_key: str = "title", author_key: str = "firstCreatorName"):
+    """Return the best-matching item, or None if confidence is too low."""
+    t_norm = normalize(title)
+    a_norm = normalize(author)
+    best, best_score = None, 0.0
+    for item in items:
+        t_ratio = similarity(t_norm, normalize(item.get(title_key, "")))
+        if t_ratio < TITLE_MIN:
+            continue
+        score = _score(t_ratio, a_norm, item.get(author_key, ""))
+        if score > best_score:
+            best_score, best = score, item
+    return best if best_score >= SCORE_MIN else None
+
+
+class CandidateIndex:
+    """Trigram inverted index over many candidates for repeated best_match() calls."""
+
+    def __init__(self, items, title_key: str = "title", author_key: str = "firstCreatorName"):
+        self.items = list(items)
+        self.author_key = author_key
+        self.titles = []
+        self.sizes = []
+        self.postings = defaultdict(list)
+        for n, item in enumerate(self.items):
+            norm = normalize(item.get(title_key, ""))
+            grams = _trigrams(norm)
+            self.titles.append(norm)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(n)
+
+    def candidates(self, title: str, min_similarity: float = TITLE_MIN) -> dict:
+        """{index: title similarity} for every candidate at or above min_similarity."""
+        t_norm = normalize(title)
+        grams = _trigrams(t_norm)
+        shared = defaultdict(int)
+        for gram in grams:
+            for n in self.postings.get(gram, ()):
+                shared[n] += 1
+        q = len(grams)
+        found = {}
+        for n, count in shared.items():
+            # Dice from the overlap count equals similarity() before refinement
+            dice = 2 * count / (q + self.sizes[n])
+            if dice < PREFILTER_MIN:
+                continue
+            score = _refine(dice, t_norm, self.titles[n]) if t_norm != self.titles[n] else 1.0
+            if score >= min_similarity:
+                found[n] = score
+        return found
+
+    def best_match(self, title: str, author: str):
+        """Same contract as best_match(), without scanning every candidate."""
+        a_norm = normalize(author)
+        best, best_score = None, 0.0
+        # In item order, so ties resolve like a linear scan
+        for n, t_ratio in sorted(self.candidates(title).items()):
+            score = _score(t_ratio, a_norm, self.items[n].get(self.author_key, ""))
+            if score > best_score:
+                best_score, best = score, self.items[n]
+        return best if best_score >= SCORE_MIN else None
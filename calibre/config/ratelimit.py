@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Shared adaptive rate limiter for every external API the scripts talk to.
+
+Each host gets a token bucket (HOST_LIMITS). A 429/503 reply halves that
+host's rate, blocks it for the server's Retry-After (or an exponential
+backoff with jitter when there is none), and every success creeps the
+rate back up towards the configured maximum. Blocks and reduced rates are
+saved to disk, so the next run does not walk straight back into a ban.
+
+Use urlopen() from here instead of urllib's for plain HTTP; SDK clients call
+acquire()/success()/throttled() on the limiter directly.
+
+This file lives in calibre/config/ because /config is the only path
+mounted into the Calibre container; youtube-downloader/ratelimit.py is a
+symlink to it for the host-side taggers.
+"""
+
+import atexit
+import email.utils
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.request
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+
+STATE_PATH = os.environ.get('RATELIMIT_STATE_PATH',
+                            os.path.expanduser('~/.cache/ratelimit-state.json'))
+
+# host: (requests per second, burst). None = no client-side limit, but
+# Retry-After and backoff still apply.
+HOST_LIMITS = {
+    'musicbrainz.org': (1.0, 1),                       # hard limit, 1 req/s
+    'coverartarchive.org': (5.0, 5),
+    'generativelanguage.googleapis.com': (15 / 60, 1),  # gemini-flash free tier, 15 RPM
+    'thunder.api.overdrive.com': (5.0, 5),
+    'localhost': (None, 1),                            # Ollama
+}
+DEFAULT_LIMIT = (10.0, 10)
+
+RETRY_STATUSES = (429, 503)
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0      # seconds, doubled per consecutive failure
+BACKOFF_MAX = 300.0
+MIN_RATE_FRACTION = 1 / 16   # never slow a host below this share of its limit
+RECOVERY_STEP = 0.1          # share of the limit regained per success
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (delta-seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def retry_after_from_error(error):
+    """Best-effort retry delay from an SDK exception message (e.g. Gemini's retry_delay)."""
+    # "Please retry in 23.4s" or "retry_delay { seconds: 23 }"
+    match = re.search(r'retry(?:_delay)?\D{0,30}?(\d+(?:\.\d+)?)', str(error), re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+
+class _Host:
+    __slots__ = ('max_rate', 'rate', 'capacity', 'tokens', 'updated', 'blocked_until', 'failures')
+
+    def __init__(self, rate, capacity):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0   # wall clock, so it survives restarts
+        self.failures = 0
+
+
+class RateLimiter:
+    """Thread-safe per-host token buckets with 429/Retry-After handling."""
+
+    def __init__(self, limits=None, state_path=STATE_PATH):
+        self.limits = dict(HOST_LIMITS if limits is None else limits)
+        self.state_path = state_path
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self._load()
+
+    def _host(self, host):
+        h = self.hosts.get(host)
+        if h is None:
+            h = self.hosts[host] = _Host(*self.limits.get(host, DEFAULT_LIMIT))
+        return h
+
+    def acquire(self, host):
+        """Block until a request to `host` is allowed."""
+        while True:
+            with self.lock:
+                h = self._host(host)
+                wait = h.blocked_until - time.time()
+                if wait <= 0 and h.rate is None:
+                    return
+                if wait <= 0:
+                    now = time.monotonic()
+                    h.tokens = min(h.capacity, h.tokens + (now - h.updated) * h.rate)
+                    h.updated = now
+                    if h.tokens >= 1:
+                        h.tokens -= 1
+                        return
+                    wait = (1 - h.tokens) / h.rate
+            time.sleep(wait)
+
+    def success(self, host):
+        """Record a successful request; the rate recovers towards its limit."""
+        with self.lock:
+            h = self._host(host)
+            if h.failures:
+                h.failures = 0
+                self.dirty = True
+            if h.rate is not None and h.rate < h.max_rate:
+                h.rate = min(h.max_rate, h.rate + h.max_rate * RECOVERY_STEP)
+                self.dirty = True
+
+    def throttled(self, host, retry_after=None):
+        """
+        Record a 429/503 from `host`. Halves its rate and blocks it for
+        `retry_after` seconds, or a jittered exponential backoff.
+        Returns the delay applied.
+        """
+        with self.lock:
+            h = self._host(host)
+            h.failures += 1
+            if h.rate is not None:
+                h.rate = max(h.max_rate * MIN_RATE_FRACTION, h.rate / 2)
+                h.tokens = 0
+            if retry_after is None:
+                ceiling = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** h.failures)
+                retry_after = random.uniform(ceiling / 2, ceiling)
+            h.blocked_until = max(h.blocked_until, time.time() + retry_after)
+            self.dirty = True
+        self.save()
+        return retry_after
+
+    def _load(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        for host, saved in state.items():
+            h = self._host(host)
+            h.blocked_until = saved.get('blocked_until', 0.0)
+            h.failures = saved.get('failures', 0)
+            if h.max_rate is not None and saved.get('rate'):
+                h.rate = min(h.max_rate, saved['rate'])
+
+    def save(self):
+        """Persist blocks and reduced rates for the next run."""
+        with self.lock:
+            if not self.dirty:
+                return
+            state = {
+                host: {'rate': h.rate, 'blocked_until': h.blocked_until, 'failures': h.failures}
+                for host, h in self.hosts.items()
+                if h.failures or h.blocked_until > time.time() or h.rate != h.max_rate
+            }
+            self.dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+            tmp = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            print(f"  ⚠️  Could not save rate-limit state: {e}", file=sys.stderr)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """Process-wide limiter, created on first use and saved at exit."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+            atexit.register(_limiter.save)
+    return _limiter
+
+
+def host_of(url):
+    return urlsplit(url).hostname or ''
+
+
+def urlopen(req, timeout=10, max_retries=MAX_RETRIES, limiter=None):
+    """
+    urllib.request.urlopen() behind the shared limiter.
+
+    Waits for the host's token bucket, retries 429/503 after Retry-After or
+    backoff, and re-raises anything else. The final 429/503 is recorded
+    with the limiter before it is re-raised.
+    """
+    limiter = limiter or get_limiter()
+    url = req.full_url if isinstance(req, urllib.request.Request) else req
+    host = host_of(url)
+
+    for attempt in range(max_retries + 1):
+        limiter.acquire(host)
+        try:
+            response = urllib.request.urlopen(req, timeout=timeout)
+        except HTTPError as e:
+            if e.code not in RETRY_STATUSES:
+                raise
+            delay = limiter.throttled(host, parse_retry_after(e.headers.get('Retry-After')))
+            if attempt == max_retries:
+                raise
+            print(f"  ⏳ {host} returned {e.code}, backing off {delay:.1f}s", file=sys.stderr)
+            continue
+        limiter.success(host)
+        return response
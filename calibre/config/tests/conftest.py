@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts are run from this directory, not installed as a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fetch_metadata
+import ratelimit
+import thunder_cache
+
+DUNE = {"title": "Dune", "firstCreatorName": "Frank Herbert", "publishDate": "1965-08-01",
+        "detailedSeries": {"seriesName": "Dune", "readingOrder": "1"}}
+
+
+class StubThunder(BaseHTTPRequestHandler):
+    """Thunder /media search: each library answers after its own delay."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        stub = self.server.stub
+        library = self.path.split("/")[1]
+        with stub["lock"]:
+            stub["requests"][library] = stub["requests"].get(library, 0) + 1
+            stub["connections"].add(self.client_address)
+            throttle = stub["throttle"] > 0
+            stub["throttle"] -= throttle
+        if throttle:
+            status, items, headers = 429, [], [("Retry-After", "0")]
+        else:
+            delay, items = stub["libraries"][library]
+            time.sleep(delay)
+            status, headers = 200, []
+        body = json.dumps({"items": items}).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            stub["aborted"] += 1
+
+
+@pytest.fixture
+def stub(monkeypatch, tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubThunder)
+    server.stub = {
+        # Per library: (delay seconds, items)
+        "libraries": {"ppld": (1.0, [DUNE]), "pueblolibrary": (0.2, []),
+                      "arapahoe": (0.05, [DUNE]), "jeffco": (0.2, [])},
+        "requests": {}, "connections": set(), "aborted": 0, "throttle": 0,
+        "lock": threading.Lock(),
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(fetch_metadata, "THUNDER_BASE", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(fetch_metadata, "_connections", fetch_metadata._ConnectionPool())
+    monkeypatch.setattr(ratelimit, "_limiter", ratelimit.RateLimiter(
+        {"127.0.0.1": (None, 1)}, state_path=str(tmp_path / "ratelimit.json")))
+    cache = thunder_cache.ThunderCache(str(tmp_path / "thunder.sqlite3"))
+    monkeypatch.setattr(thunder_cache, "_cache", cache)
+
+    yield server.stub
+
+    server.shutdown()
+    server.server_close()
+    cache.conn.close()
+
+
+def test_fastest_match_wins_and_the_rest_are_cancelled(stub):
+    started = time.monotonic()
+    match, lib = fetch_metadata.find_match("Dune", "Frank Herbert")
+    elapsed = time.monotonic() - started
+
+    assert lib == "arapahoe"
+    assert match["title"] == "Dune"
+    assert elapsed < 0.5, "find_match should not wait for the slow library"
+
+    # ppld is still sleeping; its reply goes to a socket that was shut down
+    time.sleep(1.5)
+    assert stub["aborted"] >= 1
+
+
+def test_repeat_search_is_answered_from_cache(stub):
+    fetch_metadata.find_match("Dune", "Frank Herbert")
+    started = time.monotonic()
+    _, lib = fetch_metadata.find_match("Dune", "Frank Herbert")
+
+    assert lib == "arapahoe"
+    assert stub["requests"]["arapahoe"] == 1
+    assert time.monotonic() - started < 0.05
+
+
+def test_keep_alive_connections_are_reused(stub):
+    # A miss everywhere lets every search finish and park its connection
+    fetch_metadata.find_match("Children of Dune", "Frank Herbert")
+    connections = len(stub["connections"])
+    fetch_metadata.find_match("God Emperor of Dune", "Frank Herbert")
+
+    assert sum(stub["requests"].values()) == 2 * len(fetch_metadata.SEARCH_LIBRARIES)
+    assert len(stub["connections"]) == connections
+
+
+def test_cancelled_search_closes_its_connection(stub):
+    url = f"{fetch_metadata.THUNDER_BASE}/jeffco/media?query=x"
+    fetch_metadata._get_json(url)
+    pooled = fetch_metadata._connections.idle[("http", url.split("/")[2])]
+    conn = pooled[-1]
+    assert conn.sock is not None
+
+    cancel = fetch_metadata._Cancel()
+    cancel.cancel()
+    with pytest.raises(fetch_metadata.SearchCancelled):
+        fetch_metadata._get_json(url, cancel)
+
+    assert conn.sock is None, "the checked-out connection must be closed"
+    assert conn not in pooled
+    assert not cancel.inflight
+
+
+def test_final_429_is_recorded(stub, monkeypatch):
+    monkeypatch.setattr(ratelimit, "MAX_RETRIES", 1)
+    stub["throttle"] = 2
+    with pytest.raises(OSError, match="429"):
+        fetch_metadata._get_json(f"{fetch_metadata.THUNDER_BASE}/jeffco/media?query=x")
+
+    assert stub["requests"]["jeffco"] == 2
+    assert ratelimit.get_limiter().hosts["127.0.0.1"].failures == 2
+
+
+def test_resolve_reports_missing_fields_only(stub):
+    result = fetch_metadata.resolve("Dune", "Frank Herbert", need_series=True, need_pubdate=False)
+    assert result == {"series": "Dune", "series_index": "1"}
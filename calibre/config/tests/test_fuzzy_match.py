@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+import fuzzy_match
+
+CATALOGUE = [
+    {"title": "Dune", "firstCreatorName": "Frank Herbert"},
+    {"title": "Dune Messiah", "firstCreatorName": "Frank Herbert"},
+    {"title": "Children of Dune", "firstCreatorName": "Frank Herbert"},
+    {"title": "The Left Hand of Darkness", "firstCreatorName": "Ursula K. Le Guin"},
+    {"title": "A Wizard of Earthsea", "firstCreatorName": "Ursula K. Le Guin"},
+    {"title": "The Book of Tea", "firstCreatorName": "Kakuzo Okakura"},
+    {"title": "Piranesi", "firstCreatorName": "Susanna Clarke"},
+    {"title": "Jonathan Strange & Mr Norrell", "firstCreatorName": "Susanna Clarke"},
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return fuzzy_match.CandidateIndex(CATALOGUE)
+
+
+@pytest.mark.parametrize("title, author, expected", [
+    ("Dune", "Frank Herbert", "Dune"),
+    ("DUNE - MESSIAH!", "Herbert, Frank", "Dune Messiah"),
+    ("Left Hand of Darknes", "Ursula Le Guin", "The Left Hand of Darkness"),
+    ("Jonathan Strange and Mr. Norrell", "Susanna Clarke", "Jonathan Strange & Mr Norrell"),
+    ("Piranesi", "", "Piranesi"),
+])
+def test_index_finds_the_right_title(index, title, author, expected):
+    assert index.best_match(title, author)["title"] == expected
+
+
+def test_index_rejects_absent_titles(index):
+    assert index.best_match("The Name of the Wind", "Patrick Rothfuss") is None
+    assert index.best_match("", "") is None
+
+
+def test_candidates_are_prefiltered(index):
+    found = index.candidates("Dune Messiah")
+    assert found[1] == 1.0
+    assert all(score >= fuzzy_match.TITLE_MIN for score in found.values())
+    # Titles sharing no trigram are never scored at all
+    assert 6 not in found
+
+
+def test_index_agrees_with_linear_scan():
+    rng = random.Random(7)
+    words = "shadow river night empire stone winter garden silent iron crown glass storm".split()
+    names = "Ann Herbert|Bob Atwood|Cara Okafor|Dev Tanaka".split("|")
+    items = [{"title": " ".join(rng.sample(words, rng.randint(2, 4))).title(),
+              "firstCreatorName": rng.choice(names)} for _ in range(300)]
+    index = fuzzy_match.CandidateIndex(items)
+
+    for _ in range(200):
+        item = rng.choice(items)
+        title = item["title"]
+        if rng.random() < 0.5:
+            i = rng.randrange(1, len(title) - 1)
+            title = title[:i] + title[i + 1:]
+        author = rng.choice(names)
+        assert index.best_match(title, author) is fuzzy_match.best_match(items, title, author)
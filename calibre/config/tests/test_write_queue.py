@@ -0,0 +1,62 @@
+import pytest
+
+import write_queue
+
+COMMANDS = [
+    ['set_custom', 'pages', '1', '249'],
+    ['set_custom', 'pages', '999999', '10'],
+    ['set_custom', 'words', '1', '95672'],
+    ['set_custom', 'words', '2', '80000'],
+]
+
+
+@pytest.fixture
+def offline(monkeypatch, tmp_path):
+    """Record what would run in a stop/apply/start cycle; everything succeeds there."""
+    monkeypatch.setattr(write_queue, 'STATS_PATH', str(tmp_path / 'stats.json'))
+    ran = []
+
+    def run_offline(commands):
+        ran.append(commands)
+        return [(0, '') for _ in commands], 12.0
+
+    monkeypatch.setattr(write_queue, '_run_offline', run_offline)
+    return ran
+
+
+def test_rejected_commands_are_not_retried_offline(monkeypatch, offline):
+    monkeypatch.setattr(write_queue, 'server_available', lambda: True)
+    monkeypatch.setattr(write_queue, '_run_via_server', lambda commands: [
+        (0, ''),
+        (1, 'No book with id: 999999 found'),
+        (1, 'urllib.error.HTTPError: HTTP Error 403: Forbidden'),
+        (None, ''),
+    ])
+
+    results, report = write_queue.apply(COMMANDS)
+
+    # The bad id stays failed without a GUI restart; the refused and unrun ones go offline
+    assert offline == [[COMMANDS[2], COMMANDS[3]]]
+    assert [rc for rc, _ in results] == [0, 1, 0, 0]
+    assert report['mode'] == 'server+offline'
+
+
+def test_only_rejections_means_no_cycle(monkeypatch, offline):
+    monkeypatch.setattr(write_queue, 'server_available', lambda: True)
+    monkeypatch.setattr(write_queue, '_run_via_server',
+                        lambda commands: [(1, 'No such column: #nope') for _ in commands])
+
+    results, report = write_queue.apply(COMMANDS)
+
+    assert offline == []
+    assert report['mode'] == 'server'
+    assert report['downtime_s'] == 0
+
+
+def test_server_down_runs_everything_offline(monkeypatch, offline):
+    monkeypatch.setattr(write_queue, 'server_available', lambda: False)
+
+    results, report = write_queue.apply(COMMANDS)
+
+    assert offline == [COMMANDS]
+    assert report['mode'] == 'offline'
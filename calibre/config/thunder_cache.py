@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of OverDrive Thunder search responses.
+
+Responses are stored per library under the normalized title+author query,
+so re-running fetch_metadata for a book (or a backfill over the whole
+library) does not repeat searches. Empty results expire sooner than hits
+because libraries add titles. Errors are never cached.
+
+Override the location with THUNDER_CACHE_PATH.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.environ.get('THUNDER_CACHE_PATH', '/config/thunder-cache.sqlite3')
+
+POSITIVE_TTL = 30 * 24 * 3600
+NEGATIVE_TTL = 3 * 24 * 3600
+
+
+class ThunderCache:
+    """(library, query key) -> list of Thunder media items, with a TTL."""
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS searches (
+                library TEXT NOT NULL,
+                key TEXT NOT NULL,
+                items TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (library, key)
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, library, key):
+        """Cached items, or None on a miss or expired entry."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT items, expires_at FROM searches WHERE library = ? AND key = ?",
+                (library, key),
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def put(self, library, key, items):
+        ttl = POSITIVE_TTL if items else NEGATIVE_TTL
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO searches (library, key, items, expires_at) VALUES (?, ?, ?, ?)",
+                (library, key, json.dumps(items), time.time() + ttl),
+            )
+            self.conn.commit()
+
+    def purge_expired(self):
+        with self.lock:
+            removed = self.conn.execute(
+                "DELETE FROM searches WHERE expires_at < ?", (time.time(),)).rowcount
+            self.conn.commit()
+        return removed
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache, or None if the file cannot be opened."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ThunderCache()
+            except sqlite3.Error:
+                return None
+    return _cache
+
+
+if __name__ == "__main__":
+    c = ThunderCache()
+    print(f"Removed {c.purge_expired()} expired entries")
+    total, empty = c.conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(items = '[]'), 0) FROM searches").fetchone()
+    print(f"{total} cached searches ({empty} empty)")
+    print(f"Cache file: {c.path}")
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Write coordinator for calibredb mutations from watch-acsm.sh.
+
+calibredb cannot write to the library while the GUI holds it, so the
+watcher used to stop the GUI container, run one calibredb in a one-shot
+container and start the GUI again for every single call, four to six
+times per book. Mutations are now queued and applied together:
+
+  * through the GUI's own content server (calibredb --with-library
+    http://...) when it is reachable: no downtime at all, and the GUI
+    shows the change straight away;
+  * otherwise in one stop/apply/start cycle for the whole queue.
+
+Queued mutations are coalesced first: repeated set_custom of the same
+column and book keeps the last value, and set_metadata fields for one
+book are merged into a single call.
+
+Runs on the host with plain python3:
+    python3 config/write_queue.py enqueue -- set_custom pages 42 249
+    python3 config/write_queue.py flush
+    python3 config/write_queue.py run -- add /incoming/book.acsm   # now, prints output
+    python3 config/write_queue.py status
+
+Content server settings (the server needs "allow local write", or a user
+with write access):
+    CALIBRE_SERVER_PROBE  host URL to check it is up (http://localhost:8083)
+    CALIBRE_SERVER_URL    library URL inside the container (http://localhost:8081/#library)
+    CALIBRE_SERVER_USER / CALIBRE_SERVER_PASSWORD
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+COMPOSE_DIR = os.path.dirname(CONFIG_DIR)
+QUEUE_DIR = os.environ.get('WRITE_QUEUE_DIR', CONFIG_DIR)
+QUEUE_PATH = os.path.join(QUEUE_DIR, 'write-queue.jsonl')
+STATS_PATH = os.path.join(QUEUE_DIR, 'write-queue-stats.json')
+LOCK_PATH = os.path.join(QUEUE_DIR, 'write-queue.lock')
+
+CALIBRE_IMAGE = os.environ.get('CALIBRE_IMAGE', 'lscr.io/linuxserver/calibre:latest')
+GUI_CONTAINER = 'calibre'
+LIBRARY = '/config/library'
+MOUNTS = (
+    (CONFIG_DIR, '/config'),
+    ('/mnt/boston/media/downloads/books', '/incoming'),
+    ('/mnt/boston/media/books_calibre_docker', '/nas-books'),
+)
+
+SERVER_PROBE = os.environ.get('CALIBRE_SERVER_PROBE', 'http://localhost:8083')
+SERVER_URL = os.environ.get('CALIBRE_SERVER_URL', 'http://localhost:8081/#library')
+SERVER_USER = os.environ.get('CALIBRE_SERVER_USER', '')
+SERVER_PASSWORD = os.environ.get('CALIBRE_SERVER_PASSWORD', '')
+PROBE_TIMEOUT = 3
+
+# Used for the savings estimate until one cycle has been measured
+DEFAULT_CYCLE_SECONDS = 20.0
+
+_RC_MARKER = '__WRITE_QUEUE_RC__'
+# calibredb output when the content server, not the command, was the problem:
+# it refused the write (read-only, bad login) or went away mid-flush
+_SERVER_REFUSED = re.compile(r'HTTP Error 40[13]|Forbidden|read[- ]only|local write|'
+                             r'Connection refused|URLError', re.IGNORECASE)
+
+
+# ---------------------------------------------------------------------------
+# Queue
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def _locked():
+    """Serialize queue access and GUI stop/start between watcher processes."""
+    os.makedirs(QUEUE_DIR, exist_ok=True)
+    with open(LOCK_PATH, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def enqueue(args):
+    with _locked(), open(QUEUE_PATH, 'a') as f:
+        f.write(json.dumps(list(args)) + '\n')
+
+
+def _read_queue():
+    try:
+        with open(QUEUE_PATH) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def coalesce(commands):
+    """
+    Merge queued calibredb commands without changing their effect.
+
+    set_custom COL ID VALUE keeps the last value per (COL, ID);
+    set_metadata ID --field F:V ... becomes one call per book with the
+    last value of each field. Everything else runs as queued, in order.
+    """
+    merged = {}   # key -> command, in first-seen order
+    for n, cmd in enumerate(commands):
+        if cmd[:1] == ['set_custom'] and len(cmd) == 4:
+            merged[('set_custom', cmd[1], cmd[2])] = cmd
+        elif (cmd[:1] == ['set_metadata'] and len(cmd) >= 4 and len(cmd) % 2 == 0
+              and all(flag == '--field' for flag in cmd[2::2])):
+            fields = merged.setdefault(('set_metadata', cmd[1]), {})
+            for value in cmd[3::2]:
+                fields[value.split(':', 1)[0]] = value
+        else:
+            merged[('raw', n)] = cmd
+    out = []
+    for key, value in merged.items():
+        if key[0] == 'set_metadata':
+            cmd = ['set_metadata', key[1]]
+            for field in value.values():
+                cmd += ['--field', field]
+            out.append(cmd)
+        else:
+            out.append(value)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Applying
+# ---------------------------------------------------------------------------
+
+def server_available():
+    """True if the GUI's content server answers (a login prompt counts with credentials)."""
+    try:
+        urllib.request.urlopen(f"{SERVER_PROBE}/ajax/library-info", timeout=PROBE_TIMEOUT).close()
+        return True
+    except urllib.error.HTTPError as e:
+        return e.code == 401 and bool(SERVER_USER)
+    except OSError:
+        return False
+
+
+def _script(commands, library_args):
+    """Bash script running each calibredb command and tagging its exit code."""
+    base = 'calibredb ' + ' '.join(shlex.quote(a) for a in library_args)
+    lines = []
+    for i, cmd in enumerate(commands):
+        lines.append(f"{base} {' '.join(shlex.quote(a) for a in cmd)} 2>&1")
+        lines.append(f"echo {_RC_MARKER} {i} $?")
+    return '\n'.join(lines)
+
+
+def _split_output(stdout, count):
+    """Per-command (rc, output) from the tagged script output; rc None if it never ran."""
+    results = [(None, '')] * count
+    buf = []
+    for line in stdout.splitlines():
+        if line.startswith(_RC_MARKER):
+            _, i, rc = line.split()
+            results[int(i)] = (int(rc), '\n'.join(buf))
+            buf = []
+        else:
+            buf.append(line)
+    return results
+
+
+def _run_via_server(commands):
+    library_args = ['--with-library', SERVER_URL]
+    if SERVER_USER:
+        library_args += ['--username', SERVER_USER, '--password', SERVER_PASSWORD]
+    proc = subprocess.run(
+        ['docker', 'exec', '-u', 'abc', GUI_CONTAINER, 'bash', '-c', _script(commands, library_args)],
+        capture_output=True, text=True)
+    return _split_output(proc.stdout, len(commands))
+
+
+def _compose(*args):
+    subprocess.run(['docker', 'compose', *args], cwd=COMPOSE_DIR, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def _run_offline(commands):
+    """One stop/apply/start cycle. Returns (results, seconds the GUI was down)."""
+    volumes = []
+    for host, container in MOUNTS:
+        volumes += ['-v', f'{host}:{container}']
+    stopped = time.monotonic()
+    _compose('stop', GUI_CONTAINER)
+    try:
+        proc = subprocess.run(
+            ['docker', 'run', '--rm', '--entrypoint', '/bin/bash', '-u', '1000:1000', *volumes,
+             CALIBRE_IMAGE, '-lc', _script(commands, ['--with-library', LIBRARY])],
+            capture_output=True, text=True)
+    finally:
+        _compose('up', '-d', GUI_CONTAINER)
+    return _split_output(proc.stdout, len(commands)), time.monotonic() - stopped
+
+
+def load_stats():
+    try:
+        with open(STATS_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'mutations': 0, 'calls': 0, 'cycles': 0, 'via_server': 0,
+                'downtime_s': 0.0, 'saved_s': 0.0, 'last_cycle_s': None}
+
+
+def _save_stats(stats):
+    tmp = STATS_PATH + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(stats, f, indent=2)
+    os.replace(tmp, STATS_PATH)
+
+
+def apply(commands, queued=None):
+    """
+    Apply calibredb commands with as little GUI downtime as possible.
+
+    Returns (results, report): results is a (rc, output) per command, report
+    a dict with the mode used, downtime and the downtime saved compared to
+    one stop/start cycle per queued call (queued defaults to len(commands)).
+    """
+    queued = len(commands) if queued is None else queued
+    stats = load_stats()
+    cycle = stats['last_cycle_s'] or DEFAULT_CYCLE_SECONDS
+    results, downtime, mode = [(None, '')] * len(commands), 0.0, 'none'
+
+    if commands and server_available():
+        mode = 'server'
+        results = _run_via_server(commands)
+        stats['via_server'] += sum(rc == 0 for rc, _ in results)
+
+    # Commands that never ran, or that the server refused to run, get one
+    # offline cycle; a command calibredb itself rejected would only fail again
+    retry = [i for i, (rc, output) in enumerate(results)
+             if rc is None or (mode == 'server' and rc != 0 and _SERVER_REFUSED.search(output))]
+    if retry:
+        mode = 'offline' if mode == 'none' else 'server+offline'
+        offline, downtime = _run_offline([commands[i] for i in retry])
+        for i, result in zip(retry, offline):
+            results[i] = result
+        stats['cycles'] += 1
+        stats['last_cycle_s'] = cycle = round(downtime, 2)
+
+    saved = max(0.0, queued * cycle - downtime)
+    stats['mutations'] += queued
+    stats['calls'] += len(commands)
+    stats['downtime_s'] = round(stats['downtime_s'] + downtime, 2)
+    stats['saved_s'] = round(stats['saved_s'] + saved, 2)
+    _save_stats(stats)
+    return results, {'mode': mode, 'queued': queued, 'calls': len(commands),
+                     'downtime_s': round(downtime, 1), 'saved_s': round(saved, 1)}
+
+
+def run(cmd):
+    """Apply one calibredb command now. Returns (rc, output, report); rc None if it never ran."""
+    with _locked():
+        [(rc, output)], report = apply([cmd])
+    return rc, output, report
+
+
+def flush():
+    """Apply everything queued. Returns (failed commands with output, report)."""
+    with _locked():
+        queued = _read_queue()
+        if not queued:
+            return [], None
+        commands = coalesce(queued)
+        results, report = apply(commands, queued=len(queued))
+        # Failed commands are reported, not re-queued: calibredb errors here are
+        # bad ids/columns that would fail again. Only a cycle that never ran is kept.
+        unrun = [cmd for cmd, (rc, _) in zip(commands, results) if rc is None]
+        with open(QUEUE_PATH, 'w') as f:
+            for cmd in unrun:
+                f.write(json.dumps(cmd) + '\n')
+    failed = [(cmd, out) for cmd, (rc, out) in zip(commands, results) if rc not in (0, None)]
+    return failed, report
+
+
+def report_line(report):
+    return (f"{report['queued']} mutation(s) as {report['calls']} calibredb call(s) via {report['mode']}: "
+            f"GUI down {report['downtime_s']}s, ~{report['saved_s']}s of downtime saved")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue and batch calibredb writes around the Calibre GUI')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('enqueue', help='Queue one calibredb command')
+    p.add_argument('args', nargs=argparse.REMAINDER)
+    sub.add_parser('flush', help='Apply all queued commands')
+    p = sub.add_parser('run', help='Apply one calibredb command now and print its output')
+    p.add_argument('args', nargs=argparse.REMAINDER)
+    sub.add_parser('status', help='Show the queue and downtime totals')
+    args = parser.parse_args()
+
+    if args.cmd in ('enqueue', 'run'):
+        cmd = args.args[1:] if args.args[:1] == ['--'] else args.args
+        if not cmd:
+            parser.error('missing calibredb command')
+        if args.cmd == 'enqueue':
+            enqueue(cmd)
+            return
+        rc, output, report = run(cmd)
+        print(output)
+        print(report_line(report), file=sys.stderr)
+        sys.exit(1 if rc is None else rc)
+
+    if args.cmd == 'flush':
+        failed, report = flush()
+        if report is None:
+            print("Write queue empty")
+            return
+        for cmd, output in failed:
+            print(f"❌ calibredb {' '.join(cmd)}\n{output}")
+        print(f"✅ {report_line(report)}" if not failed else f"⚠️  {report_line(report)}")
+        sys.exit(1 if failed else 0)
+
+    stats = load_stats()
+    print(f"Queued:   {len(_read_queue())} command(s) in {QUEUE_PATH}")
+    print(f"Applied:  {stats['mutations']} mutation(s) in {stats['calls']} call(s), "
+          f"{stats['via_server']} via the content server, {stats['cycles']} stop/start cycle(s)")
+    print(f"Downtime: {stats['downtime_s']:.0f}s, ~{stats['saved_s']:.0f}s saved "
+          f"(last cycle {stats['last_cycle_s'] or '-'}s)")
+
+
+if __name__ == "__main__":
+    main()
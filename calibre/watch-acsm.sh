@@ -7,7 +7,8 @@
 #   1. Adds it to the Calibre library (deACSM + DeDRM runs automatically)
 #   2. Runs Count Pages (saves page count to #pages, word count to #word_count)
 #
-# Run as a service: see calibre-acsm-watcher.service
+# Superseded by config/acsm_ingest.py (inotify + SQLite job table), which is
+# what calibre-acsm-watcher.service runs now. Kept for manual use.
 # =============================================================================
 
 WATCH_DIR="/mnt/boston/media/downloads/books"
@@ -16,32 +17,45 @@ LOG_FILE="/home/brandon/projects/docker/calibre/acsm-watcher.log"
 POLL_INTERVAL=30   # seconds between scans
 CALIBRE_COMPOSE_DIR="/home/brandon/projects/docker/calibre"
 CALIBRE_IMAGE="lscr.io/linuxserver/calibre:latest"
+WORKER_SOCKET="$CALIBRE_COMPOSE_DIR/config/calibre-worker.sock"
 
-# calibredb_gui: runs calibredb in a one-shot headless container while the
-# GUI container is briefly stopped. This avoids SQLite lock contention with
-# the running Calibre desktop process.
+# calibredb_gui: runs one calibredb command right away and prints its output.
+# config/write_queue.py goes through the GUI's content server when it allows
+# writes (no downtime), and otherwise stops the GUI for one short cycle.
+# Use it only for calls whose output is needed now (add, list); plain
+# mutations go through queue_write.
 calibredb_gui() {
-    local args_quoted=""
-    local arg
-    for arg in "$@"; do
-        args_quoted+=" $(printf '%q' "$arg")"
-    done
+    python3 "$CALIBRE_COMPOSE_DIR/config/write_queue.py" run -- "$@"
+}
+
+# queue_write: queues a calibredb mutation; flush_writes applies everything
+# queued in one batch (one GUI stop/start at most) after each scan.
+queue_write() {
+    python3 "$CALIBRE_COMPOSE_DIR/config/write_queue.py" enqueue -- "$@"
+}
 
-    local rc=0
-    (
-        set -e
-        cd "$CALIBRE_COMPOSE_DIR"
-        docker compose stop calibre >/dev/null
-        docker run --rm --entrypoint /bin/bash -u 1000:1000 \
-            -v /home/brandon/projects/docker/calibre/config:/config \
-            -v /mnt/boston/media/downloads/books:/incoming \
-            -v /mnt/boston/media/books_calibre_docker:/nas-books \
-            "$CALIBRE_IMAGE" \
-            -lc "calibredb --with-library /config/library${args_quoted}"
-    )
-    rc=$?
-    (cd "$CALIBRE_COMPOSE_DIR" && docker compose up -d calibre >/dev/null)
-    return $rc
+flush_writes() {
+    python3 "$CALIBRE_COMPOSE_DIR/config/write_queue.py" flush 2>&1 | while IFS= read -r line; do log "$line"; done
+}
+
+# calibre_job: runs a per-book job (count_pages / fetch_metadata) on the
+# long-lived calibre-worker container, which keeps the library loaded.
+# Falls back to a one-off calibre-debug in the GUI container when the worker
+# is not reachable (exit 3). Prints the script's KEY=VALUE lines on stdout.
+calibre_job() {
+    local op="$1" book_id="$2" script="$3"
+    python3 "$CALIBRE_COMPOSE_DIR/config/calibre_worker.py" --socket "$WORKER_SOCKET" --call "$op" "$book_id"
+    local rc=$?
+    if [ $rc -ne 3 ]; then
+        return $rc
+    fi
+    log "WARNING: calibre worker not reachable — running $script via calibre-debug" >/dev/null
+    docker exec -u abc -e DISPLAY=:1 calibre calibre-debug -e "/config/$script" "$book_id"
+}
+
+ensure_worker() {
+    (cd "$CALIBRE_COMPOSE_DIR" && docker compose up -d calibre-worker >/dev/null 2>&1) \
+        || log "WARNING: could not start calibre-worker — falling back to calibre-debug per book"
 }
 
 mkdir -p "$(dirname "$PROCESSED_FILE")"
@@ -121,7 +135,7 @@ process_acsm() {
 
     if is_raw_acsm_import "$formats_json"; then
         log "WARNING: Book $book_id imported only as raw ACSM; DeACSM fulfillment did not complete."
-        calibredb_gui remove --permanent "$book_id" >> "$LOG_FILE" 2>&1 || true
+        queue_write remove --permanent "$book_id"
 
         if echo "$result" | grep -q "E_ADEPT_REQUEST_EXPIRED"; then
             log "ACSM appears expired; removed raw import and marking as processed."
@@ -138,7 +152,7 @@ process_acsm() {
 
     # Compute page/word counts — prints BOOK_PAGES=N and BOOK_WORDS=N to stdout
     local counts
-    counts=$(docker exec -u abc -e DISPLAY=:1 calibre calibre-debug -e /config/count_pages_cli.py "$book_id" 2>>"$LOG_FILE")
+    counts=$(calibre_job count_pages "$book_id" count_pages_cli.py 2>>"$LOG_FILE")
     local rc=$?
 
     if [ $rc -ne 0 ]; then
@@ -149,18 +163,18 @@ process_acsm() {
         words=$(echo "$counts"  | grep "^BOOK_WORDS=" | cut -d= -f2)
 
         if [ -n "$pages" ]; then
-            calibredb_gui set_custom pages "$book_id" "$pages" >> "$LOG_FILE" 2>&1
-            log "Saved page count: $pages"
+            queue_write set_custom pages "$book_id" "$pages"
+            log "Queued page count: $pages"
         fi
         if [ -n "$words" ]; then
-            calibredb_gui set_custom word_count "$book_id" "$words" >> "$LOG_FILE" 2>&1
-            log "Saved word count: $words"
+            queue_write set_custom word_count "$book_id" "$words"
+            log "Queued word count: $words"
         fi
     fi
 
     log "Fetching metadata (series, publication date) for book $book_id..."
     local meta_out
-    meta_out=$(docker exec -u abc -e DISPLAY=:1 calibre calibre-debug -e /config/fetch_metadata.py "$book_id" 2>>"$LOG_FILE")
+    meta_out=$(calibre_job fetch_metadata "$book_id" fetch_metadata.py 2>>"$LOG_FILE")
     local meta_rc=$?
 
     if [ $meta_rc -ne 0 ]; then
@@ -178,26 +192,24 @@ process_acsm() {
         elif [ -n "$meta_err" ]; then
             log "Metadata fetch: $meta_err"
         else
-            # Apply series via calibredb (GUI-connected so the UI updates immediately)
+            # Queued per field; the write queue merges them into one set_metadata
             if [ -n "$meta_series" ]; then
-                calibredb_gui set_metadata "$book_id" --field "series:$meta_series" >> "$LOG_FILE" 2>&1
-                log "Saved series: $meta_series"
+                queue_write set_metadata "$book_id" --field "series:$meta_series"
+                log "Queued series: $meta_series"
             fi
             if [ -n "$meta_idx" ]; then
-                calibredb_gui set_metadata "$book_id" --field "series_index:$meta_idx" >> "$LOG_FILE" 2>&1
-                log "Saved series index: $meta_idx"
+                queue_write set_metadata "$book_id" --field "series_index:$meta_idx"
+                log "Queued series index: $meta_idx"
             fi
             if [ -n "$meta_date" ]; then
-                calibredb_gui set_metadata "$book_id" --field "pubdate:$meta_date" >> "$LOG_FILE" 2>&1
-                log "Saved publication date: $meta_date"
+                queue_write set_metadata "$book_id" --field "pubdate:$meta_date"
+                log "Queued publication date: $meta_date"
             fi
         fi
     fi
 
-    # Refresh Calibre so the content server immediately serves the new book
-    refresh_calibre
-
     # Mark as processed regardless of count pages result — book is in library
+    # (queued writes are applied by flush_writes after the scan)
     echo "$filename" >> "$PROCESSED_FILE"
     log "Finished processing: $filename (book ID: $book_id)"
     return 0
@@ -213,8 +225,10 @@ log "=========================================="
 
 # Ensure the #pages custom column exists before we start
 ensure_pages_column
+ensure_worker
 
 while true; do
+    imported=0
     shopt -s nullglob
     for acsm_file in "$WATCH_DIR"/*.acsm; do
         filename=$(basename "$acsm_file")
@@ -225,8 +239,16 @@ while true; do
         fi
 
         process_acsm "$acsm_file"
+        imported=$((imported + 1))
     done
     shopt -u nullglob
 
+    # Apply this scan's queued writes together, then refresh once so the
+    # content server serves the new books
+    if [ "$imported" -gt 0 ]; then
+        flush_writes
+        refresh_calibre
+    fi
+
     sleep "$POLL_INTERVAL"
 done
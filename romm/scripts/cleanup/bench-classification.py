@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Benchmark the single-scan classification (rom_catalog.py) against the old
+per-phase passes of comprehensive-cleanup.py on a synthetic roms table:
+
+    python3 bench-classification.py --rows 100000
+
+No database needed: the old path gets each phase's rows as dicts, the way
+cursor(dictionary=True).fetchall() returned them, and the new path gets
+tuples in FETCH_BATCH batches, the way scan() streams them. Both decide
+the same three delete phases plus the special-character report; the
+script checks they agree and prints wall time and tracemalloc peak.
+"""
+
+import argparse
+import random
+import re
+import time
+import tracemalloc
+from collections import defaultdict
+
+import rom_catalog
+
+COLUMNS = ('id', 'name', 'fs_name', 'fs_path', 'fs_extension', 'igdb_id')
+WORDS = """
+super mega dragon quest star fighter river city ninja turtle kart racer
+pinball galaxy castle knight soccer tennis golf puzzle blast metal zone
+""".split()
+REGIONS = ['(USA)', '(Europe)', '(USA, Europe)', '(Japan)', '(World)', '(U)', '(E)']
+EXTRAS = ['', '', '', '', ' (Beta)', ' [b1]', ' (Disc 2)', ' (Rev 1)', ' (Proto)']
+
+
+def make_table(rng, rows):
+    """(id, name, fs_name, fs_path, fs_extension, igdb_id) tuples."""
+    table, rom_id = [], 0
+    while len(table) < rows:
+        name = ' '.join(rng.sample(WORDS, rng.randint(2, 4))).title()
+        if rng.random() < 0.05:
+            name += rng.choice((' é', ' !', ': Remix', ' ~Deluxe~'))
+        if rng.random() < 0.01:
+            name = 'BIOS ' + name
+        for region in rng.sample(REGIONS, rng.randint(1, 3)):
+            rom_id += 1
+            fs_name = f"{name} {region}{rng.choice(EXTRAS)}.zip"
+            table.append((rom_id, name, fs_name, f"roms/{rom_id}", 'zip',
+                          rom_id if rng.random() < 0.7 else None))
+    return table[:rows]
+
+
+# --- The old per-phase code, for comparison --------------------------------
+
+def _legacy_base(name):
+    if not name:
+        return None
+    base = re.sub(r'\s*\([^)]*\)\s*', ' ', name)
+    base = re.sub(r'\s*\[[^\]]*\]\s*', ' ', base)
+    base = re.sub(r'\s+', ' ', base).strip()
+    return base.lower()
+
+
+def _legacy_region(fs_name):
+    if not fs_name:
+        return 999
+    fs_lower = fs_name.lower()
+    if re.search(r'\(usa?\)', fs_lower) or re.search(r'\(u\)', fs_lower):
+        return 1
+    if re.search(r'\(world\)', fs_lower):
+        return 2
+    if re.search(r'\(europe?\)', fs_lower) or re.search(r'\(eu\)', fs_lower):
+        return 3
+    if re.search(r'\(japan\)', fs_lower) or re.search(r'\(j\)', fs_lower):
+        return 4
+    return 5
+
+
+def _legacy_undesirable(fs_name):
+    if not fs_name:
+        return False
+    fs_lower = fs_name.lower()
+    patterns = [
+        r'\(beta\)', r'\(proto\)', r'\(demo\)', r'\(sample\)',
+        r'\(unl\)', r'\(pirate\)', r'\(hack\)', r'\(bad\)',
+        r'\[b\d*\]', r'\[h\d*\]', r'\[t\d*\]',
+    ]
+    return any(re.search(pattern, fs_lower) for pattern in patterns)
+
+
+def _legacy_non_playable(fs_name):
+    if not fs_name:
+        return False
+    fs_lower = fs_name.lower()
+    if re.search(r'\(disc [2-9]\)', fs_lower):
+        return True
+    if 'bios' in fs_lower or '[bios]' in fs_lower:
+        return True
+    return fs_lower.startswith('system') or fs_lower.startswith('[system]')
+
+
+def _legacy_special(fs_name):
+    if not fs_name:
+        return False
+    return len(re.findall(r'[^a-zA-Z0-9 ._\-(),&\']', fs_name)) > 0
+
+
+def _fetchall(table, gone, columns, where=None):
+    """What cursor(dictionary=True).fetchall() handed each phase."""
+    idx = [COLUMNS.index(c) for c in columns]
+    return [{c: row[i] for c, i in zip(columns, idx)} for row in table
+            if row[0] not in gone and (where is None or where(row))]
+
+
+def legacy(table):
+    gone = set()
+    phases = {}
+
+    roms = _fetchall(table, gone, ('id', 'name', 'fs_name'))
+    singles = defaultdict(list)
+    for rom in roms:
+        fs = (rom['fs_name'] or '').lower()
+        if rom['name'] is not None and '(usa, europe)' not in fs and ('(usa)' in fs or '(europe)' in fs):
+            singles[rom['name'].rstrip(' ').casefold()].append(rom['fs_name'])
+    phases['usa_europe'] = {rom['id'] for rom in roms if rom['name'] is not None
+                            and '(usa, europe)' in (rom['fs_name'] or '').lower()
+                            and rom['name'].rstrip(' ').casefold() in singles}
+    gone |= phases['usa_europe']
+
+    roms = sorted(_fetchall(table, gone, COLUMNS, lambda r: r[1]), key=lambda r: (r['name'], r['id']))
+    groups = defaultdict(list)
+    for rom in roms:
+        base = _legacy_base(rom['name'])
+        if base:
+            groups[base].append(rom)
+    phases['duplicates'] = set()
+    for group in groups.values():
+        if len(group) > 1:
+            group.sort(key=lambda x: (_legacy_region(x['fs_name']), _legacy_undesirable(x['fs_name']), x['id']))
+            phases['duplicates'].update(rom['id'] for rom in group[1:])
+    gone |= phases['duplicates']
+
+    roms = _fetchall(table, gone, ('id', 'fs_name', 'fs_extension', 'fs_path'))
+    phases['non_playable'] = {rom['id'] for rom in roms if _legacy_non_playable(rom['fs_name'])}
+    gone |= phases['non_playable']
+
+    roms = _fetchall(table, gone, ('id', 'fs_name', 'name', 'igdb_id'))
+    phases['special'] = {rom['id'] for rom in roms if _legacy_special(rom['fs_name'])}
+    return phases
+
+
+# --- The single scan ---------------------------------------------------------
+
+def single_scan(table):
+    records = []
+    for i in range(0, len(table), rom_catalog.FETCH_BATCH):
+        # fetchmany() batch of (id, name, fs_name, igdb_id)
+        batch = [(r[0], r[1], r[2], r[5]) for r in table[i:i + rom_catalog.FETCH_BATCH]]
+        records.extend(rom_catalog.RomRecord(*row) for row in batch)
+
+    phases = {}
+    for name, decide in (
+            ('usa_europe', lambda rs: [rom for rom, _ in rom_catalog.usa_europe_deletions(rs)]),
+            ('duplicates', lambda rs: [rom for rom, _ in rom_catalog.duplicate_deletions(rs)]),
+            ('non_playable', lambda rs: [rom for rom in rs if rom.non_playable])):
+        chosen = decide(rom_catalog.alive(records))
+        for rom in chosen:
+            rom.deleted = True
+        phases[name] = {rom.id for rom in chosen}
+    phases['special'] = {rom.id for rom in rom_catalog.alive(records) if rom.special}
+    return phases
+
+
+def measure(fn, table):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn(table)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark single-scan ROM classification')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    table = make_table(random.Random(args.seed), args.rows)
+    print(f"🧪 {len(table)} synthetic ROMs")
+    old, old_t, old_peak = measure(legacy, table)
+    new, new_t, new_peak = measure(single_scan, table)
+
+    print(f"   {'four passes (old)':24s} {old_t:7.2f}s  peak {old_peak / 2**20:7.1f} MiB")
+    print(f"   {'single scan':24s} {new_t:7.2f}s  peak {new_peak / 2**20:7.1f} MiB")
+    print(f"   ⚡ {old_t / new_t:.1f}x faster, {old_peak / new_peak:.1f}x less peak memory")
+    for phase in old:
+        mark = "✅" if old[phase] == new[phase] else "❌"
+        print(f"   {mark} {phase:12s} {len(old[phase]):6d} old  {len(new[phase]):6d} new")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,28 @@ Priority order:
 1. USA/US versions (keep these)
 2. Europe/EU versions (delete if USA exists)
 3. Other regions (delete if USA or Europe exists)
+
+Deleted ROMs' files are moved to a quarantine tree first (rom_quarantine.py);
+--keep-files deletes database rows only.
 """
 
+import argparse
 import mysql.connector
 import re
 import os
 
+import rom_deletes
+import rom_quarantine
+
+parser = argparse.ArgumentParser(description='Remove duplicate ROMs, keeping USA versions')
+parser.add_argument('--per-row', action='store_true',
+                    help='One DELETE per ROM (the old path), to compare timings')
+parser.add_argument('--keep-files', action='store_true',
+                    help='Delete database rows only and leave the ROM files in the library')
+args = parser.parse_args()
+
+quarantine = None if args.keep_files else rom_quarantine.Quarantine()
+
 # Database connection
 db = mysql.connector.connect(
     host="localhost",
@@ -97,7 +113,7 @@ for rom in roms:
 
 # Find duplicates
 duplicates_found = 0
-duplicates_deleted = 0
+delete_rows = []   # (id, fs_path, fs_name)
 
 print("\n🎮 Processing duplicates (keeping USA versions)...\n")
 
@@ -127,21 +143,34 @@ for base_name, group in name_groups.items():
         delete_tag = delete_region.group(0) if delete_region else "(no region)"
         
         print(f"   🗑️  Duplicate: {rom['name']} {delete_tag} (ID: {rom['id']}, keeping {keep_tag} ID: {keep['id']})")
-        
-        # Delete the ROM
-        try:
-            cursor.execute("DELETE FROM roms WHERE id = %s", (rom['id'],))
-            duplicates_deleted += 1
-        except Exception as e:
-            print(f"      ❌ Error deleting ROM {rom['id']}: {e}")
-
-# Commit changes
-db.commit()
+        delete_rows.append((rom['id'], rom['fs_path'], rom['fs_name']))
+
+# Delete them all in one transaction
+def delete(ids):
+    try:
+        result = rom_deletes.delete_ids(cursor, ids, per_row=args.per_row)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return result, [rom_id for rom_id, _ in result[1]]
+
+if quarantine is None:
+    result, _ = delete([rom_id for rom_id, _, _ in delete_rows])
+else:
+    # Move the files out first so the next scan doesn't add them back
+    result, moves_failed = rom_quarantine.move_then_delete(quarantine, delete_rows, delete)
+    quarantine.report_failed(moves_failed)
+duplicates_deleted, errors, seconds = result or (0, [], 0.0)
+rom_deletes.report(duplicates_deleted, errors, seconds, per_row=args.per_row)
 
 print(f"\n✅ Cleanup complete!")
 print(f"   Found {duplicates_found} duplicates")
 print(f"   Deleted {duplicates_deleted} ROMs")
 print(f"   Kept USA/US versions where available")
+if quarantine:
+    quarantine.close()
+    print(f"\n{quarantine.summary()}")
 
 cursor.close()
 db.close()
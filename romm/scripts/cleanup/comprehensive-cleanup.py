@@ -7,12 +7,28 @@ Handles:
 2. Duplicate region versions (USA vs Europe - keeps USA)
 3. Non-playable files (multi-disc games, BIOS files, etc.)
 4. Games that are just archives without proper ROM files
+
+Without options it asks for confirmation and deletes straight away. To
+keep the write window on the live database short, plan first (read-only,
+can point at a replica or restored backup) and apply the plan later:
+
+    ./comprehensive-cleanup.py --plan cleanup-plan.jsonl [--host replica]
+    ./comprehensive-cleanup.py --apply cleanup-plan.jsonl
+
+See rom_plan.py for the plan format and how apply resumes.
+
+Deleted ROMs' files are moved to a quarantine tree first, so RomM's next
+scan does not add them back (see rom_quarantine.py for the manifest and
+undo); --keep-files deletes database rows only, as before.
 """
 
 import mysql.connector
-import re
-import os
-import subprocess
+import time
+
+import rom_catalog
+import rom_deletes
+import rom_plan
+import rom_quarantine
 
 # Database connection
 DB_CONFIG = {
@@ -23,281 +39,211 @@ DB_CONFIG = {
     "port": 3306
 }
 
+# Where deleted ROMs' files go; None with --keep-files
+QUARANTINE = None
+
 def get_db_connection():
     """Get database connection."""
     return mysql.connector.connect(**DB_CONFIG)
 
-def extract_base_name(name):
-    """Extract base game name without region tags."""
-    if not name:
-        return None
-    # Remove common region tags and other metadata
-    base = re.sub(r'\s*\([^)]*\)\s*', ' ', name)  # Remove anything in parentheses
-    base = re.sub(r'\s*\[[^\]]*\]\s*', ' ', base)  # Remove anything in brackets
-    base = re.sub(r'\s+', ' ', base).strip()  # Normalize whitespace
-    return base.lower()
-
-def get_region_priority(fs_name):
+def count_roms():
+    db = get_db_connection()
+    cursor = db.cursor()
+    cursor.execute("SELECT COUNT(*) FROM roms")
+    count = cursor.fetchone()[0]
+    cursor.close()
+    db.close()
+    return count
+
+def apply(path):
+    """Apply a plan file to the live database (no prompt, resumable)."""
+    entries = rom_plan.read_plan(path)
+    progress = rom_plan.load_progress(path)
+    print(f"📋 Plan {path}: {len(entries)} ROMs "
+          f"({', '.join(f'{k} {v}' for k, v in rom_plan.summary(entries).items()) or 'empty'})")
+    if progress['applied']:
+        print(f"   ↪️  Resuming after {progress['applied']} already applied")
+
+    def on_chunk(progress, total):
+        print(f"   ⏳ {progress['applied']}/{total} applied, {progress['deleted']} deleted")
+
+    db = get_db_connection()
+    started = time.monotonic()
+    try:
+        progress = rom_plan.apply_plan(db, path, on_chunk=on_chunk, quarantine=QUARANTINE)
+    finally:
+        db.close()
+    print(f"\n✅ Plan applied in {time.monotonic() - started:.1f}s: {progress['deleted']} deleted, "
+          f"{progress['gone']} already gone or changed since planning")
+    if progress['files_failed']:
+        print(f"   ⚠️  {progress['files_failed']} kept because their files could not be moved")
+
+def delete_phase(db, records, per_row=False):
     """
-    Return priority score for region (lower is better).
-    USA = 1 (highest priority)
-    World = 2
-    Europe = 3
-    Japan = 4
-    Other = 5
+    Delete one phase's records in a single transaction and mark them
+    deleted. Their files are quarantined first, and ROMs whose file could
+    not be moved are not deleted.
     """
-    if not fs_name:
-        return 999
-    
-    fs_lower = fs_name.lower()
-    
-    # USA/US gets highest priority
-    if re.search(r'\(usa?\)', fs_lower) or re.search(r'\(u\)', fs_lower):
-        return 1
-    
-    # World or multi-region with USA
-    if re.search(r'\(world\)', fs_lower):
-        return 2
-    
-    # Europe
-    if re.search(r'\(europe?\)', fs_lower) or re.search(r'\(eu\)', fs_lower):
-        return 3
-    
-    # Japan
-    if re.search(r'\(japan\)', fs_lower) or re.search(r'\(j\)', fs_lower):
-        return 4
-    
-    # Everything else
-    return 5
-
-def is_undesirable(fs_name):
-    """Check if this is a beta, prototype, demo, or other undesirable version."""
-    if not fs_name:
-        return False
-    fs_lower = fs_name.lower()
-    patterns = [
-        r'\(beta\)', r'\(proto\)', r'\(demo\)', r'\(sample\)',
-        r'\(unl\)', r'\(pirate\)', r'\(hack\)', r'\(bad\)',
-        r'\[b\d*\]', r'\[h\d*\]', r'\[t\d*\]',  # Bad dumps, hacks, trainers
-    ]
-    return any(re.search(pattern, fs_lower) for pattern in patterns)
-
-def is_non_playable(fs_name, fs_extension):
-    """Check if this is a non-playable file."""
-    if not fs_name:
-        return False
-    
-    fs_lower = fs_name.lower()
-    
-    # Multi-disc games (Disc 2, 3, etc.) - keep Disc 1 only
-    if re.search(r'\(disc [2-9]\)', fs_lower):
-        return True
-    
-    # BIOS files
-    if 'bios' in fs_lower or '[bios]' in fs_lower:
-        return True
-    
-    # System files
-    if fs_lower.startswith('system') or fs_lower.startswith('[system]'):
-        return True
-    
-    return False
-
-def has_special_characters(fs_name):
-    """Check if filename has problematic special characters."""
-    if not fs_name:
-        return False
-    
-    # Allow: letters, numbers, spaces, dots, hyphens, underscores, parentheses, commas
-    # Flag anything else as problematic
-    problematic_chars = re.findall(r'[^a-zA-Z0-9 ._\-(),&\']', fs_name)
-    return len(problematic_chars) > 0
+    def delete(ids):
+        cursor = db.cursor()
+        try:
+            result = rom_deletes.delete_ids(cursor, ids, per_row=per_row)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+        return result, [rom_id for rom_id, _ in result[1]]
+
+    if QUARANTINE is None:
+        result, _ = delete([r.id for r in records])
+        moves_failed = []
+    else:
+        result, moves_failed = rom_quarantine.move_then_delete(
+            QUARANTINE, [(r.id, r.fs_path, r.fs_name) for r in records], delete)
+        QUARANTINE.report_failed(moves_failed)
+    deleted, errors, seconds = result or (0, [], 0.0)
+    failed = {rom_id for rom_id, _ in errors} | {m['id'] for m in moves_failed}
+    for r in records:
+        r.deleted = r.id not in failed
+    rom_deletes.report(deleted, errors, seconds, per_row=per_row)
+    return deleted
 
-def cleanup_duplicates():
+def run_phase(db, phase, chosen, per_row=False, plan=None):
+    """
+    Delete a phase's (rom, reason, kept rom) choices. With a plan list,
+    only record them there and leave the database alone.
+    """
+    if plan is not None:
+        for rom, reason, kept in chosen:
+            plan.append(rom_plan.entry(rom, phase, reason, kept))
+            rom.deleted = True
+        return len(chosen)
+    return delete_phase(db, [rom for rom, _, _ in chosen], per_row)
+
+def cleanup_duplicates(db, records, per_row=False, plan=None):
     """Remove duplicate games, keeping USA versions."""
     print("\n🎮 Removing duplicate region versions (keeping USA)...")
     
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    
-    # Get all ROMs
-    cursor.execute("""
-        SELECT id, name, fs_name, fs_path, fs_extension, igdb_id
-        FROM roms
-        WHERE name IS NOT NULL AND name != ''
-        ORDER BY name, id
-    """)
-    
-    roms = cursor.fetchall()
-    
-    # Group by base name
-    from collections import defaultdict
-    name_groups = defaultdict(list)
-    
-    for rom in roms:
-        base_name = extract_base_name(rom['name'])
-        if base_name:
-            name_groups[base_name].append(rom)
-    
-    deleted = 0
+    chosen = []
+    for rom, keep in rom_catalog.duplicate_deletions(rom_catalog.alive(records)):
+        print(f"   🗑️  {rom.fs_name} (keeping {keep.fs_name})")
+        chosen.append((rom, 'duplicate region version', keep))
     
-    for base_name, group in name_groups.items():
-        if len(group) <= 1:
-            continue
-        
-        # Sort by priority
-        group.sort(key=lambda x: (
-            get_region_priority(x['fs_name']),
-            is_undesirable(x['fs_name']),
-            x['id']
-        ))
-        
-        # Keep the first one, delete the rest
-        keep = group[0]
-        to_delete = group[1:]
-        
-        for rom in to_delete:
-            print(f"   🗑️  {rom['fs_name']} (keeping {keep['fs_name']})")
-            cursor.execute("DELETE FROM roms WHERE id = %s", (rom['id'],))
-            deleted += 1
-    
-    db.commit()
-    cursor.close()
-    db.close()
-    
-    print(f"   ✅ Deleted {deleted} duplicate games")
+    deleted = run_phase(db, 'duplicates', chosen, per_row, plan)
+    print(f"   ✅ {'Planned' if plan is not None else 'Deleted'} {deleted} duplicate games")
     return deleted
 
-def cleanup_non_playable():
+def cleanup_non_playable(db, records, per_row=False, plan=None):
     """Remove non-playable files."""
     print("\n🚫 Removing non-playable files...")
     
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    
-    cursor.execute("""
-        SELECT id, fs_name, fs_extension, fs_path
-        FROM roms
-    """)
-    
-    roms = cursor.fetchall()
-    deleted = 0
-    
-    for rom in roms:
-        if is_non_playable(rom['fs_name'], rom['fs_extension']):
-            print(f"   🗑️  {rom['fs_name']}")
-            cursor.execute("DELETE FROM roms WHERE id = %s", (rom['id'],))
-            deleted += 1
-
-    db.commit()
-    cursor.close()
-    db.close()
-
-    print(f"   ✅ Deleted {deleted} non-playable files")
+    chosen = []
+    for rom in rom_catalog.alive(records):
+        if rom.non_playable:
+            print(f"   🗑️  {rom.fs_name}")
+            chosen.append((rom, 'non-playable (Disc 2+, BIOS, system file)', None))
+
+    deleted = run_phase(db, 'non_playable', chosen, per_row, plan)
+    print(f"   ✅ {'Planned' if plan is not None else 'Deleted'} {deleted} non-playable files")
     return deleted
 
-def report_special_characters():
+def report_special_characters(records):
     """Report games with special characters that might prevent metadata matching."""
     print("\n⚠️  Games with special characters (may prevent metadata matching)...")
 
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-
-    cursor.execute("""
-        SELECT id, fs_name, name, igdb_id
-        FROM roms
-        ORDER BY fs_name
-    """)
-
-    roms = cursor.fetchall()
-    problematic = []
-
-    for rom in roms:
-        if has_special_characters(rom['fs_name']):
-            problematic.append(rom)
+    problematic = sorted((rom for rom in rom_catalog.alive(records) if rom.special),
+                         key=lambda r: r.fs_name.casefold())
 
     if problematic:
         print(f"   Found {len(problematic)} games with special characters:")
         for rom in problematic[:20]:  # Show first 20
-            has_metadata = "✓" if rom['igdb_id'] else "✗"
-            print(f"   {has_metadata} {rom['fs_name']}")
+            has_metadata = "✓" if rom.has_metadata else "✗"
+            print(f"   {has_metadata} {rom.fs_name}")
 
         if len(problematic) > 20:
             print(f"   ... and {len(problematic) - 20} more")
     else:
         print("   ✅ No problematic characters found")
 
-    cursor.close()
-    db.close()
-
     return len(problematic)
 
-def cleanup_usa_europe_duplicates():
+def cleanup_usa_europe_duplicates(db, records, per_row=False, plan=None):
     """Remove (USA, Europe) duplicates when we have separate USA or Europe versions."""
     print("\n🌍 Removing (USA, Europe) duplicates...")
 
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-
-    # Find games with (USA, Europe) in the name
-    cursor.execute("""
-        SELECT id, name, fs_name, fs_path
-        FROM roms
-        WHERE fs_name LIKE '%(USA, Europe)%'
-    """)
-
-    usa_europe_games = cursor.fetchall()
-    deleted = 0
-
-    for game in usa_europe_games:
-        base_name = extract_base_name(game['name'])
-
-        # Check if we have a USA-only or Europe-only version
-        cursor.execute("""
-            SELECT id, fs_name
-            FROM roms
-            WHERE name = %s
-            AND id != %s
-            AND (fs_name LIKE '%(USA)%' OR fs_name LIKE '%(Europe)%')
-            AND fs_name NOT LIKE '%(USA, Europe)%'
-        """, (game['name'], game['id']))
-
-        alternatives = cursor.fetchall()
-
-        if alternatives:
-            print(f"   🗑️  {game['fs_name']} (have separate regional versions)")
-            cursor.execute("DELETE FROM roms WHERE id = %s", (game['id'],))
-            deleted += 1
-
-    db.commit()
-    cursor.close()
-    db.close()
+    by_fs_name = {rom.fs_name: rom for rom in rom_catalog.alive(records) if rom.single_region}
+    chosen = []
+    for game, alternatives in rom_catalog.usa_europe_deletions(rom_catalog.alive(records)):
+        print(f"   🗑️  {game.fs_name} (have {', '.join(alternatives[:2])})")
+        chosen.append((game, 'separate USA/Europe versions exist', by_fs_name.get(alternatives[0])))
 
-    print(f"   ✅ Deleted {deleted} (USA, Europe) duplicates")
+    deleted = run_phase(db, 'usa_europe', chosen, per_row, plan)
+    print(f"   ✅ {'Planned' if plan is not None else 'Deleted'} {deleted} (USA, Europe) duplicates")
     return deleted
 
 def main():
     """Run all cleanup operations."""
+    import argparse
     import sys
 
+    parser = argparse.ArgumentParser(description='Comprehensive ROMM library cleanup')
+    parser.add_argument('--per-row', action='store_true',
+                        help='One DELETE per ROM (the old path), to compare timings')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--plan', metavar='FILE',
+                      help='Only write what would be deleted to a JSONL plan file (read-only)')
+    mode.add_argument('--apply', metavar='FILE', help='Delete the ROMs in a plan file (resumable)')
+    parser.add_argument('--host', default=DB_CONFIG['host'], help='e.g. a read replica for --plan')
+    parser.add_argument('--port', type=int, default=DB_CONFIG['port'])
+    parser.add_argument('--keep-files', action='store_true',
+                        help='Delete database rows only and leave the ROM files in the library')
+    args = parser.parse_args()
+    DB_CONFIG.update(host=args.host, port=args.port)
+    global QUARANTINE
+    if not args.plan and not args.keep_files:
+        QUARANTINE = rom_quarantine.Quarantine()
+
     print("🧹 ROMM Comprehensive Cleanup")
     print("=" * 50)
 
-    # Get initial count
-    db = get_db_connection()
-    cursor = db.cursor()
-    cursor.execute("SELECT COUNT(*) FROM roms")
-    initial_count = cursor.fetchone()[0]
-    cursor.close()
-    db.close()
+    if args.apply:
+        apply(args.apply)
+        if QUARANTINE:
+            QUARANTINE.close()
+            print(QUARANTINE.summary())
+        print("\n⚠️  IMPORTANT: Run a full rescan in ROMM to update metadata!")
+        return
 
+    initial_count = count_roms()
     print(f"\n📊 Initial game count: {initial_count}")
+
+    if args.plan:
+        db = get_db_connection()
+        try:
+            records = rom_catalog.scan(db)
+        finally:
+            db.close()
+        plan = []
+        cleanup_usa_europe_duplicates(None, records, plan=plan)
+        cleanup_duplicates(None, records, plan=plan)
+        cleanup_non_playable(None, records, plan=plan)
+        report_special_characters(records)
+        rom_plan.write_plan(args.plan, plan)
+        print("\n" + "=" * 50)
+        print(f"📋 Wrote {len(plan)} planned deletions to {args.plan} (nothing deleted)")
+        print(f"   Apply with: {sys.argv[0]} --apply {args.plan}")
+        return
+
     print("\nThis script will:")
     print("  1. Remove (USA, Europe) duplicates when separate versions exist")
     print("  2. Remove regional duplicates (keeping USA versions)")
     print("  3. Remove non-playable files (Disc 2+, BIOS, etc.)")
     print("  4. Report games with special characters")
     print("\n⚠️  WARNING: This will DELETE games from your library!")
+    if QUARANTINE:
+        print(f"   Their files will be moved to {QUARANTINE.run_dir}")
     print("⚠️  Make sure you have a backup if needed.")
 
     # Ask for confirmation
@@ -306,19 +252,22 @@ def main():
         print("❌ Cleanup cancelled.")
         sys.exit(0)
 
+    # Classify every ROM once; each phase works on the same records
+    db = get_db_connection()
+    started = time.monotonic()
+    records = rom_catalog.scan(db)
+    print(f"\n🔍 Classified {len(records)} ROMs in {time.monotonic() - started:.1f}s")
+
     # Run cleanup operations
-    deleted_usa_europe = cleanup_usa_europe_duplicates()
-    deleted_duplicates = cleanup_duplicates()
-    deleted_non_playable = cleanup_non_playable()
-    special_char_count = report_special_characters()
+    try:
+        deleted_usa_europe = cleanup_usa_europe_duplicates(db, records, args.per_row)
+        deleted_duplicates = cleanup_duplicates(db, records, args.per_row)
+        deleted_non_playable = cleanup_non_playable(db, records, args.per_row)
+        special_char_count = report_special_characters(records)
+    finally:
+        db.close()
 
-    # Get final count
-    db = get_db_connection()
-    cursor = db.cursor()
-    cursor.execute("SELECT COUNT(*) FROM roms")
-    final_count = cursor.fetchone()[0]
-    cursor.close()
-    db.close()
+    final_count = count_roms()
 
     print("\n" + "=" * 50)
     print("✅ Cleanup Complete!")
@@ -330,6 +279,9 @@ def main():
     print(f"   - Regional duplicates: {deleted_duplicates}")
     print(f"   - Non-playable files: {deleted_non_playable}")
     print(f"   - Games with special chars: {special_char_count} (not deleted)")
+    if QUARANTINE:
+        QUARANTINE.close()
+        print(f"\n{QUARANTINE.summary()}")
     print("\n⚠️  IMPORTANT: Run a full rescan in ROMM to update metadata!")
     print("\nTo rescan:")
     print("  1. Go to http://localhost:8080")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+One-pass ROM classification shared by the cleanup phases.
+
+comprehensive-cleanup.py used to select the whole roms table once per
+phase and re-run the name/region checks with uncompiled regexes on every
+row each time. scan() streams the table once through an unbuffered
+(server-side) cursor in FETCH_BATCH-row batches and classifies each row a
+single time into a RomRecord (__slots__, no per-row dict). Every phase
+then works on the same list and marks what it deletes, so later phases
+skip those rows the way a fresh SELECT would have.
+
+bench-classification.py compares time and peak memory with the old
+per-phase passes on a synthetic table.
+"""
+
+import re
+from collections import defaultdict
+
+FETCH_BATCH = 5000
+
+_PARENS = re.compile(r'\s*\([^)]*\)\s*')
+_BRACKETS = re.compile(r'\s*\[[^\]]*\]\s*')
+_SPACES = re.compile(r'\s+')
+
+# Checked in priority order (lower is better); anything else is 5
+_REGIONS = (
+    (1, re.compile(r'\(usa?\)|\(u\)')),
+    (2, re.compile(r'\(world\)')),
+    (3, re.compile(r'\(europe?\)|\(eu\)')),
+    (4, re.compile(r'\(japan\)|\(j\)')),
+)
+_UNDESIRABLE = re.compile(
+    r'\(beta\)|\(proto\)|\(demo\)|\(sample\)|\(unl\)|\(pirate\)|\(hack\)|\(bad\)'
+    r'|\[b\d*\]|\[h\d*\]|\[t\d*\]')   # bad dumps, hacks, trainers
+_LATER_DISC = re.compile(r'\(disc [2-9]\)')
+# Allowed: letters, numbers, spaces, dots, hyphens, underscores, parentheses, commas, & and '
+_SPECIAL = re.compile(r"[^a-zA-Z0-9 ._\-(),&']")
+
+
+def extract_base_name(name):
+    """Base game name without region tags, lowercased."""
+    if not name:
+        return None
+    base = _PARENS.sub(' ', name)
+    base = _BRACKETS.sub(' ', base)
+    return _SPACES.sub(' ', base).strip().lower()
+
+
+def region_priority(fs_lower):
+    """USA 1, World 2, Europe 3, Japan 4, other 5 (lower is better)."""
+    for priority, pattern in _REGIONS:
+        if pattern.search(fs_lower):
+            return priority
+    return 5
+
+
+def is_non_playable(fs_lower):
+    """Disc 2+ of multi-disc games, BIOS and system files."""
+    return bool(_LATER_DISC.search(fs_lower) or 'bios' in fs_lower
+                or fs_lower.startswith(('system', '[system]')))
+
+
+def name_key(name):
+    """Name as MySQL's default collation compares it (case- and trailing-space-insensitive)."""
+    return name.rstrip(' ').casefold()
+
+
+class RomRecord:
+    """One classified row of roms."""
+
+    __slots__ = ('id', 'name', 'fs_name', 'fs_path', 'has_metadata', 'base', 'region', 'undesirable',
+                 'non_playable', 'special', 'usa_europe', 'single_region', 'deleted')
+
+    def __init__(self, rom_id, name, fs_name, igdb_id, fs_path=None):
+        self.id = rom_id
+        self.name = name
+        self.fs_name = fs_name
+        self.fs_path = fs_path
+        self.has_metadata = bool(igdb_id)
+        self.deleted = False
+        if not fs_name:
+            self.region, self.undesirable, self.non_playable, self.special = 999, False, False, False
+            self.usa_europe = self.single_region = False
+        else:
+            fs_lower = fs_name.lower()
+            self.region = region_priority(fs_lower)
+            self.undesirable = _UNDESIRABLE.search(fs_lower) is not None
+            self.non_playable = is_non_playable(fs_lower)
+            self.special = _SPECIAL.search(fs_name) is not None
+            self.usa_europe = '(usa, europe)' in fs_lower
+            self.single_region = not self.usa_europe and ('(usa)' in fs_lower or '(europe)' in fs_lower)
+        self.base = extract_base_name(name)
+
+
+def classify(rows):
+    """RomRecords for (id, name, fs_name, igdb_id[, fs_path]) tuples."""
+    return [RomRecord(*row) for row in rows]
+
+
+def scan(db, batch=FETCH_BATCH):
+    """Stream the roms table once and classify every row."""
+    # Unbuffered: rows come from the server batch by batch instead of all at once
+    cursor = db.cursor(buffered=False)
+    cursor.execute("SELECT id, name, fs_name, igdb_id, fs_path FROM roms ORDER BY id")
+    records = []
+    while True:
+        rows = cursor.fetchmany(batch)
+        if not rows:
+            break
+        records.extend(RomRecord(*row) for row in rows)
+    cursor.close()
+    return records
+
+
+def alive(records):
+    """Records no earlier phase has deleted."""
+    return [r for r in records if not r.deleted]
+
+
+def duplicate_deletions(records):
+    """
+    (rom, kept rom) for every ROM that shares a base name with a better
+    version: USA over World over Europe over Japan, releases over
+    betas/hacks, then the lowest id.
+    """
+    groups = defaultdict(list)
+    for rom in sorted(records, key=lambda r: (r.name or '', r.id)):
+        if rom.base:
+            groups[rom.base].append(rom)
+    pairs = []
+    for group in groups.values():
+        if len(group) > 1:
+            group.sort(key=lambda r: (r.region, r.undesirable, r.id))
+            pairs.extend((rom, group[0]) for rom in group[1:])
+    return pairs
+
+
+def usa_europe_deletions(records):
+    """
+    (USA, Europe) ROMs that also exist as a separate USA or Europe version
+    under the same name, as (rom, alternative fs_names) pairs.
+    """
+    single_region = defaultdict(list)   # name key -> single-region fs_names
+    for rom in records:
+        if rom.single_region and rom.name is not None:
+            single_region[name_key(rom.name)].append(rom.fs_name)
+    return [(rom, single_region[name_key(rom.name)]) for rom in records
+            if rom.usa_europe and rom.name is not None and name_key(rom.name) in single_region]
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Set-based ROM deletes shared by the cleanup scripts.
+
+The scripts used to run DELETE FROM roms WHERE id = %s once per ROM, one
+round trip each. delete_ids() takes the whole ID set of a phase and
+deletes it in chunks of DELETE_CHUNK with WHERE id IN (...), inside the
+caller's transaction (commit once per phase). If a chunk is rejected
+for its data (a foreign key, a bad value), that chunk is retried row by
+row so the offending IDs are still reported and the rest are still
+deleted. Anything else (deadlock, lost connection) is raised, so the
+caller rolls the phase back and restores its files.
+
+per_row=True keeps the old one-statement-per-ROM path for comparison.
+Both paths print the time taken, and
+
+    python3 rom_deletes.py --bench 5000
+
+times them against each other on a temporary table, without touching roms.
+"""
+
+import sys
+import time
+
+from mysql.connector import errors
+
+DELETE_CHUNK = 1000
+# Errors that belong to particular rows; the rest of the chunk can still go
+ROW_ERRORS = (errors.IntegrityError, errors.DataError)
+
+
+def _progress(done, total):
+    if sys.stdout.isatty():
+        print(f"\r   ⏳ {done}/{total} deleted", end='', flush=True)
+
+
+def delete_ids(cursor, ids, table='roms', chunk=DELETE_CHUNK, per_row=False):
+    """
+    Delete every row of `table` whose id is in `ids`.
+
+    Returns (deleted, errors, seconds); errors is a list of (id, exception)
+    for rows that could not be deleted. Other database errors are raised.
+    Does not commit.
+    """
+    ids = sorted(set(ids))
+    started = time.monotonic()
+    deleted, failed = 0, []
+
+    def one_by_one(part):
+        nonlocal deleted
+        for rom_id in part:
+            try:
+                cursor.execute(f"DELETE FROM {table} WHERE id = %s", (rom_id,))
+                deleted += cursor.rowcount
+            except ROW_ERRORS as e:
+                failed.append((rom_id, e))
+
+    step = 1 if per_row else chunk
+    for i in range(0, len(ids), step):
+        part = ids[i:i + step]
+        if per_row:
+            one_by_one(part)
+        else:
+            try:
+                cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(part))})",
+                               part)
+                deleted += cursor.rowcount
+            except ROW_ERRORS:
+                one_by_one(part)
+        _progress(min(i + step, len(ids)), len(ids))
+    if ids and sys.stdout.isatty():
+        print()
+    return deleted, failed, time.monotonic() - started
+
+
+def report(deleted, errors, seconds, per_row=False, chunk=DELETE_CHUNK):
+    """Print the outcome of one delete_ids() call."""
+    for rom_id, e in errors:
+        print(f"      ❌ Error deleting ROM {rom_id}: {e}")
+    mode = "one DELETE per ROM" if per_row else f"chunks of {chunk}"
+    print(f"   ⏱️  Deleted {deleted} rows in {seconds:.2f}s ({mode})")
+
+
+def bench(db, rows):
+    """Time per-row vs chunked deletes of `rows` ids on a temporary table."""
+    cursor = db.cursor()
+    results = {}
+    for per_row in (True, False):
+        cursor.execute("DROP TEMPORARY TABLE IF EXISTS rom_delete_bench")
+        cursor.execute("CREATE TEMPORARY TABLE rom_delete_bench (id INT PRIMARY KEY, fs_name VARCHAR(255))")
+        cursor.executemany("INSERT INTO rom_delete_bench (id, fs_name) VALUES (%s, %s)",
+                           [(i, f"Game {i} (USA).zip") for i in range(1, rows + 1)])
+        db.commit()
+        deleted, errors, seconds = delete_ids(cursor, range(1, rows + 1), table='rom_delete_bench',
+                                              per_row=per_row)
+        db.commit()
+        results[per_row] = seconds
+        label = "one DELETE per row" if per_row else f"DELETE ... IN, chunks of {DELETE_CHUNK}"
+        print(f"   {label:32s} {deleted:6d} rows  {seconds:7.2f}s")
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS rom_delete_bench")
+    cursor.close()
+    if results[False] > 0:
+        print(f"   ⚡ {results[True] / results[False]:.1f}x faster")
+
+
+def main():
+    import argparse
+    import mysql.connector
+
+    parser = argparse.ArgumentParser(description='Benchmark per-row vs chunked ROM deletes')
+    parser.add_argument('--bench', type=int, default=5000, metavar='ROWS')
+    args = parser.parse_args()
+
+    db = mysql.connector.connect(host="localhost", user="romm-user", password="romm-password",
+                                 database="romm", port=3306)
+    print(f"⏱️  Deleting {args.bench} rows from a temporary table, both ways:")
+    try:
+        bench(db, args.bench)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
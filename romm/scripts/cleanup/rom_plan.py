@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Cleanup plan files: decide deletions once, apply them later in bulk.
+
+A plan is JSONL, one ROM to delete per line:
+
+    {"id": 812, "fs_path": "roms/snes", "fs_name": "Zelda (Europe).sfc",
+     "phase": "duplicates", "reason": "duplicate region version",
+     "kept_id": 811, "kept_fs_name": "Zelda (USA).sfc"}
+
+comprehensive-cleanup.py --plan writes one (it can read from a replica or
+a restored backup via --host/--port), and --apply runs it against the live
+database without any prompt:
+
+  * rows are deleted by (id, fs_path), so a row that changed since the
+    plan was made is left alone and counted as gone/changed;
+  * chunks of APPLY_CHUNK rows are committed one at a time and the number
+    of plan lines done is recorded in PLAN.progress, so an interrupted
+    apply resumes where it stopped;
+  * re-running a finished plan does nothing, and re-running it without
+    the progress file deletes nothing that is already gone;
+  * with a Quarantine (rom_quarantine.py), each chunk's still-matching rows
+    are locked, their files moved out of the library and only then
+    deleted, so a ROM whose file could not be moved keeps its row.
+"""
+
+import json
+import os
+import time
+
+import rom_quarantine
+
+APPLY_CHUNK = 1000
+
+
+def entry(rom, phase, reason, kept=None):
+    """One plan line for a RomRecord (and the RomRecord kept instead, if any)."""
+    return {
+        'id': rom.id, 'fs_path': rom.fs_path, 'fs_name': rom.fs_name,
+        'phase': phase, 'reason': reason,
+        'kept_id': kept.id if kept else None,
+        'kept_fs_name': kept.fs_name if kept else None,
+    }
+
+
+def write_plan(path, entries):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        for e in entries:
+            f.write(json.dumps(e, ensure_ascii=False) + '\n')
+    os.replace(tmp, path)
+    # A new plan starts from the top
+    if os.path.exists(path + '.progress'):
+        os.unlink(path + '.progress')
+
+
+def read_plan(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_progress(path):
+    try:
+        with open(path + '.progress') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'applied': 0, 'deleted': 0, 'gone': 0, 'files_failed': 0}
+
+
+def _save_progress(path, progress):
+    tmp = path + '.progress.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(progress, f)
+    os.replace(tmp, path + '.progress')
+
+
+def _matching(rows):
+    """WHERE clause and params selecting plan rows still matching their (id, fs_path)."""
+    ids = ', '.join(['%s'] * len(rows))
+    pairs = ', '.join(['(%s, %s)'] * len(rows))
+    params = [r['id'] for r in rows]
+    for r in rows:
+        params += [r['id'], r['fs_path']]
+    # id IN (...) uses the primary key; the pair check rejects rows that changed
+    return f"id IN ({ids}) AND (id, fs_path) IN ({pairs})", params
+
+
+def _delete_chunk(cursor, rows):
+    """Delete plan rows still matching their (id, fs_path). Returns rows deleted."""
+    where, params = _matching(rows)
+    cursor.execute(f"DELETE FROM roms WHERE {where}", params)
+    return cursor.rowcount
+
+
+def _quarantine_chunk(db, cursor, rows, quarantine):
+    """
+    Move the files of the plan rows that still match, then delete those
+    rows and commit. Returns (rows deleted, files that could not be moved).
+    """
+    where, params = _matching(rows)
+    # Lock the matching rows so they cannot change between the move and the delete
+    cursor.execute(f"SELECT id, fs_name FROM roms WHERE {where} FOR UPDATE", params)
+    current = dict(cursor.fetchall())
+    # A renamed row points at a different file: leave it alone, like a changed fs_path
+    live = [r for r in rows if r['id'] in current and current[r['id']] == r['fs_name']]
+
+    def delete(ids):
+        ids = set(ids)
+        deleted = _delete_chunk(cursor, [r for r in live if r['id'] in ids])
+        db.commit()
+        return deleted, ()
+
+    deleted, failed = rom_quarantine.move_then_delete(
+        quarantine, [(r['id'], r['fs_path'], r['fs_name']) for r in live], delete)
+    if deleted is None:
+        db.commit()   # nothing to delete; release the locks
+    quarantine.report_failed(failed)
+    return deleted or 0, len(failed)
+
+
+def apply_plan(db, path, chunk=APPLY_CHUNK, on_chunk=None, quarantine=None):
+    """
+    Apply a plan file, resuming from its progress file. Returns the
+    progress dict: plan lines applied, rows deleted, rows already gone or
+    changed since planning, and ROMs kept because their file could not be
+    quarantined.
+    """
+    plan = read_plan(path)
+    progress = load_progress(path)
+    progress.setdefault('files_failed', 0)
+    cursor = db.cursor()
+    try:
+        for start in range(progress['applied'], len(plan), chunk):
+            rows = plan[start:start + chunk]
+            if quarantine is None:
+                deleted, files_failed = _delete_chunk(cursor, rows), 0
+                db.commit()
+            else:
+                deleted, files_failed = _quarantine_chunk(db, cursor, rows, quarantine)
+            progress['applied'] = start + len(rows)
+            progress['deleted'] += deleted
+            progress['files_failed'] += files_failed
+            progress['gone'] += len(rows) - deleted - files_failed
+            _save_progress(path, progress)
+            if on_chunk:
+                on_chunk(progress, len(plan))
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+    progress['finished_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    _save_progress(path, progress)
+    return progress
+
+
+def summary(entries):
+    """{phase: count} of a plan."""
+    counts = {}
+    for e in entries:
+        counts[e['phase']] = counts.get(e['phase'], 0) + 1
+    return counts
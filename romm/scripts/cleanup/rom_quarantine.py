@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Move the files of cleaned-up ROMs out of the library, with an undo manifest.
+
+Deleting rows from roms alone does not stick: the files are still under
+the games directory and RomM's next scan adds them straight back. The
+cleanup scripts now move each deleted ROM (GAMES_DIR/fs_path/fs_name, a
+file or a multi-file folder) to the same relative path under a per-run
+quarantine directory, then delete the rows:
+
+  * files are moved first, on MOVE_WORKERS threads since each move is a
+    few NAS round trips; a plain rename when the quarantine is on the same
+    filesystem, copy-and-delete otherwise;
+  * only ROMs whose file was moved (or was already gone) are deleted, so a
+    failed move leaves file and row in place;
+  * if the database delete fails, the moved files are put back.
+
+Every move is appended to QUARANTINE_DIR/<run>/manifest.jsonl, and
+
+    python3 rom_quarantine.py --undo /mnt/boston/media/games-quarantine/<run>/manifest.jsonl
+
+moves everything back (rescan RomM afterwards to re-add the rows).
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+GAMES_DIR = os.environ.get('ROMM_GAMES_DIR', '/mnt/boston/media/games')
+QUARANTINE_DIR = os.environ.get('ROMM_QUARANTINE_DIR', '/mnt/boston/media/games-quarantine')
+MOVE_WORKERS = int(os.environ.get('ROMM_MOVE_WORKERS', '16'))
+
+
+def _relative(fs_path, fs_name):
+    """fs_path/fs_name, refusing anything that would leave the library."""
+    rel = os.path.normpath(os.path.join(fs_path or '', fs_name or ''))
+    if not fs_name or os.path.isabs(rel) or rel.split(os.sep)[0] == '..':
+        raise ValueError(f"unsafe ROM path {fs_path!r}/{fs_name!r}")
+    return rel
+
+
+def _move(src, dst, same_fs):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        raise FileExistsError(f"{dst} already exists")
+    if same_fs:
+        os.rename(src, dst)
+    else:
+        shutil.move(src, dst)
+
+
+class Quarantine:
+    """One cleanup run's quarantine directory and manifest."""
+
+    def __init__(self, games_dir=GAMES_DIR, root=QUARANTINE_DIR, workers=MOVE_WORKERS):
+        if not os.path.isdir(games_dir):
+            raise FileNotFoundError(f"games directory {games_dir} not found "
+                                    f"(set ROMM_GAMES_DIR, or --keep-files to leave files alone)")
+        self.games_dir = games_dir
+        os.makedirs(root, exist_ok=True)
+        # Created on the first move, so a cancelled run leaves nothing behind
+        self.run_dir = os.path.join(root, time.strftime('%Y%m%d-%H%M%S'))
+        self.manifest_path = os.path.join(self.run_dir, 'manifest.jsonl')
+        self.same_fs = os.stat(games_dir).st_dev == os.stat(root).st_dev
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.manifest = None
+        self.moved = self.missing = self.failed = 0
+
+    def _log(self, record):
+        record['at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            if self.manifest is None:
+                os.makedirs(self.run_dir, exist_ok=True)
+                # Line-buffered: each record reaches the OS as soon as it is written
+                self.manifest = open(self.manifest_path, 'a', buffering=1)
+            self.manifest.write(line)
+
+    def sync(self):
+        """Flush the manifest to disk, so the undo survives a crash once rows are deleted."""
+        with self.lock:
+            if self.manifest is not None:
+                self.manifest.flush()
+                os.fsync(self.manifest.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.manifest is not None:
+                self.manifest.close()
+                self.manifest = None
+
+    def _move_one(self, row):
+        rom_id, fs_path, fs_name = row
+        record = {'id': rom_id, 'fs_path': fs_path, 'fs_name': fs_name}
+        try:
+            rel = _relative(fs_path, fs_name)
+            src = os.path.join(self.games_dir, rel)
+            dst = os.path.join(self.run_dir, rel)
+            record.update(src=src, dst=dst)
+            if not os.path.lexists(src):
+                record['status'] = 'missing'
+            else:
+                _move(src, dst, self.same_fs)
+                record['status'] = 'moved'
+        except Exception as e:
+            record.update(status='error', error=f"{type(e).__name__}: {e}")
+        self._log(record)
+        return record
+
+    def move(self, rows):
+        """Move (id, fs_path, fs_name) rows in parallel. Returns one manifest record per row."""
+        with ThreadPoolExecutor(self.workers) as pool:
+            records = list(pool.map(self._move_one, rows))
+        for r in records:
+            if r['status'] == 'moved':
+                self.moved += 1
+            elif r['status'] == 'missing':
+                self.missing += 1
+            else:
+                self.failed += 1
+        return records
+
+    def restore(self, records):
+        """Put back the files of moved records (after a failed delete)."""
+        moved = [r for r in records if r['status'] == 'moved']
+        with ThreadPoolExecutor(self.workers) as pool:
+            self.moved -= sum(pool.map(self._restore_one, moved))
+
+    def _restore_one(self, record):
+        try:
+            _move(record['dst'], record['src'], self.same_fs)
+            self._log(dict(record, status='restored'))
+            return True
+        except Exception as e:
+            self._log(dict(record, status='restore-error', error=f"{type(e).__name__}: {e}"))
+            return False
+
+    def report_failed(self, failed):
+        for record in failed:
+            print(f"      ❌ Could not quarantine {record['fs_name']}: {record['error']} (not deleted)")
+
+    def summary(self):
+        mode = "rename" if self.same_fs else "copy+delete"
+        return (f"🗄️  Files: {self.moved} moved to quarantine ({mode}), {self.missing} already missing, "
+                f"{self.failed} failed (kept in library and database)\n"
+                f"   Manifest: {self.manifest_path}\n"
+                f"   Undo:     python3 {os.path.abspath(__file__)} --undo {self.manifest_path}")
+
+
+def move_then_delete(quarantine, rows, delete):
+    """
+    Quarantine the files of (id, fs_path, fs_name) rows, then call
+    delete(ids) for the ROMs whose file was moved or already missing.
+
+    delete() must commit and return (result, ids it could not delete);
+    the files of those ids are put back, and so are all moved files if
+    delete() raises. Returns (result, manifest records of failed moves).
+    """
+    records = quarantine.move(rows)
+    ok_ids = [r['id'] for r in records if r['status'] in ('moved', 'missing')]
+    failed = [r for r in records if r['status'] == 'error']
+    # The manifest is the only record of where the files went once the rows are gone
+    quarantine.sync()
+    try:
+        result, not_deleted = delete(ok_ids) if ok_ids else (None, ())
+    except Exception:
+        quarantine.restore(records)
+        raise
+    not_deleted = set(not_deleted)
+    if not_deleted:
+        quarantine.restore([r for r in records if r['id'] in not_deleted])
+    return result, failed
+
+
+def undo(manifest_path, workers=MOVE_WORKERS):
+    """Move every file still quarantined by a manifest back to where it was."""
+    state = {}
+    with open(manifest_path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                state[(record['id'], record.get('src'))] = record   # last line per ROM wins
+    moved = [r for r in state.values() if r['status'] in ('moved', 'restore-error')]
+    errors = []
+
+    def back(record):
+        try:
+            _move(record['dst'], record['src'], same_fs=False)
+        except Exception as e:
+            errors.append((record, e))
+
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(back, moved))
+    for record, e in errors:
+        print(f"   ❌ {record['dst']}: {e}")
+    print(f"↩️  Restored {len(moved) - len(errors)} of {len(moved)} quarantined ROMs")
+    print("⚠️  Rescan the library in RomM to add them back to the database")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Undo a cleanup quarantine')
+    parser.add_argument('--undo', metavar='MANIFEST', required=True)
+    parser.add_argument('--workers', type=int, default=MOVE_WORKERS)
+    args = parser.parse_args()
+    undo(args.undo, args.workers)
+
+
+if __name__ == "__main__":
+    main()
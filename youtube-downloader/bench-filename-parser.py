@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Accuracy regression and throughput benchmark for filename_parser.
+
+Scores filename_parser.parse() against the labelled filename-corpus.tsv
+(exact artist + title match, case-insensitive), lists the misses, and
+compares it with the old per-call-regex clean_filename() the taggers used
+to copy. The labels come from the MusicBrainz recordings, not from either
+parser, so a few rows (a soundtrack credited to its composer, a band credit
+the recording doesn't carry) can't be reached from the filename at all.
+Exits non-zero if accuracy drops below --min-accuracy.
+"""
+
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+import filename_parser
+
+CORPUS = Path(__file__).with_name('filename-corpus.tsv')
+
+
+def legacy_clean_filename(filename):
+    """The clean_filename() previously duplicated across the taggers."""
+    name = Path(filename).stem
+    name = re.sub(r'\s*\(.*?(Official|Lyric|Music|Audio|Video|HD|4K|Live|Visualizer).*?\)', '', name, flags=re.IGNORECASE)
+    name = re.sub(r'\s*\[.*?(Official|Lyric|Music|Audio|Video|HD|4K|Live|Visualizer).*?\]', '', name, flags=re.IGNORECASE)
+    name = re.sub(r'^\d+\.?\s*', '', name)
+    match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', name)
+    if match:
+        return match.group(1).strip(), match.group(2).strip()
+    match = re.search(r'^(.+?)\s+by\s+(.+)$', name, re.IGNORECASE)
+    if match:
+        return match.group(2).strip(), match.group(1).strip()
+    match = re.match(r'^(.+?)\s*:\s*(.+)$', name)
+    if match:
+        return match.group(1).strip(), match.group(2).strip()
+    return "Unknown Artist", name.strip()
+
+
+def load_corpus(path):
+    rows = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            filename, artist, title = line.rstrip('\n').split('\t')
+            rows.append((filename, artist, title))
+    return rows
+
+
+def accuracy(rows, parse_fn, show_misses=False):
+    correct = 0
+    for filename, artist, title in rows:
+        got_artist, got_title = parse_fn(filename)
+        if (got_artist.casefold(), got_title.casefold()) == (artist.casefold(), title.casefold()):
+            correct += 1
+        elif show_misses:
+            print(f"  ✗ {filename}")
+            print(f"      expected: {artist} | {title}")
+            print(f"      got:      {got_artist} | {got_title}")
+    return correct / len(rows)
+
+
+def throughput(rows, parse_fn, loops):
+    names = [row[0] for row in rows]
+    start = time.perf_counter()
+    for _ in range(loops):
+        for name in names:
+            parse_fn(name)
+    return loops * len(names) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Filename parser accuracy and speed')
+    parser.add_argument('--corpus', default=str(CORPUS))
+    parser.add_argument('--loops', type=int, default=500, help='Passes over the corpus when timing')
+    parser.add_argument('--min-accuracy', type=float, default=0.9)
+    args = parser.parse_args()
+
+    rows = load_corpus(args.corpus)
+    print(f"🧪 {len(rows)} labelled filenames from {args.corpus}")
+    print()
+
+    new_acc = accuracy(rows, filename_parser.clean_filename, show_misses=True)
+    old_acc = accuracy(rows, legacy_clean_filename)
+    new_rate = throughput(rows, filename_parser.clean_filename, args.loops)
+    old_rate = throughput(rows, legacy_clean_filename, args.loops)
+
+    confident = sum(filename_parser.parse(r[0]).confidence >= filename_parser.HIGH_CONFIDENCE
+                    for r in rows)
+
+    print()
+    print(f"  filename_parser   accuracy {new_acc:6.1%}   {new_rate:10,.0f} parses/s")
+    print(f"  legacy            accuracy {old_acc:6.1%}   {old_rate:10,.0f} parses/s")
+    print(f"  high-confidence parses: {confident}/{len(rows)}")
+
+    if new_acc < args.min_accuracy:
+        print(f"\n❌ Accuracy {new_acc:.1%} is below {args.min_accuracy:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
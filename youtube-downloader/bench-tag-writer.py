@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark serial vs pooled tag writing on synthetic opus files.
+
+Generates N small but valid Ogg Opus files (silent packets, no encoder
+needed) in a scratch directory, then tags them once one at a time and once
+through TagWriterPool, both via atomic_update(). Point --dir at a folder on
+the NAS mount to measure the latency the pool is meant to hide.
+"""
+
+import argparse
+import os
+import shutil
+import struct
+import tempfile
+import time
+from pathlib import Path
+
+from mutagen.ogg import OggPage
+from mutagen.oggopus import OggOpus
+
+from tag_writer import DEFAULT_WORKERS, TagWriterPool, atomic_update
+
+SERIAL = 0x5EED
+# One 20 ms Opus frame (TOC byte for CELT fullband 20 ms + silence)
+SILENT_PACKET = b'\xfc\xff\xfe'
+
+
+def make_opus(path, seconds=30, padding=0):
+    """Write a minimal valid Ogg Opus stream of `seconds` of silence."""
+    head = b'OpusHead' + struct.pack('<BBHIhB', 1, 2, 312, 48000, 0, 0)
+    vendor = b'bench-tag-writer'
+    tags = b'OpusTags' + struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', 0)
+
+    pages = []
+    for seq, packet in enumerate((head, tags)):
+        page = OggPage()
+        page.serial = SERIAL
+        page.sequence = seq
+        page.position = 0
+        page.first = seq == 0
+        page.packets = [packet]
+        pages.append(page)
+
+    frames = seconds * 50
+    per_page = 50
+    for n, start in enumerate(range(0, frames, per_page)):
+        count = min(per_page, frames - start)
+        page = OggPage()
+        page.serial = SERIAL
+        page.sequence = n + 2
+        page.position = (start + count) * 960 + 312
+        page.packets = [SILENT_PACKET + b'\x00' * padding] * count
+        pages.append(page)
+    pages[-1].last = True
+
+    with open(path, 'wb') as f:
+        for page in pages:
+            f.write(page.write())
+
+
+def tag_one(path, n):
+    def apply(tmp):
+        audio = OggOpus(tmp)
+        audio['artist'] = f'Bench Artist {n}'
+        audio['title'] = f'Bench Title {n}'
+        audio['album'] = 'YouTube Downloads'
+        audio.save()
+
+    atomic_update(path, apply)
+    return True
+
+
+def run_serial(files):
+    start = time.perf_counter()
+    for n, path in enumerate(files):
+        tag_one(path, n)
+    return time.perf_counter() - start
+
+
+def run_pooled(files, workers):
+    start = time.perf_counter()
+    with TagWriterPool(workers) as pool:
+        futures = [pool.submit(tag_one, path, n) for n, path in enumerate(files)]
+        for future in futures:
+            future.result()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark serial vs pooled tag writes')
+    parser.add_argument('--files', type=int, default=200, help='Number of synthetic files')
+    parser.add_argument('--seconds', type=int, default=30, help='Length of each synthetic track')
+    parser.add_argument('--padding', type=int, default=100,
+                        help='Extra bytes per packet to make files closer to real size')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--dir', help='Scratch directory (default: a local temp dir)')
+    args = parser.parse_args()
+
+    scratch = Path(tempfile.mkdtemp(prefix='tagbench-', dir=args.dir))
+    try:
+        files = [scratch / f'track-{n:04d}.opus' for n in range(args.files)]
+        for path in files:
+            make_opus(path, args.seconds, args.padding)
+        size = os.path.getsize(files[0])
+        print(f"🧪 {args.files} synthetic opus files ({size // 1024} KiB each) in {scratch}")
+        print()
+
+        serial = run_serial(files)
+        pooled = run_pooled(files, args.workers)
+
+        print(f"  serial          {serial:7.2f}s  {args.files / serial:8.1f} files/s")
+        print(f"  pool ({args.workers:2d} thr)  {pooled:7.2f}s  {args.files / pooled:8.1f} files/s")
+        print(f"  speedup         {serial / pooled:7.2f}x")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
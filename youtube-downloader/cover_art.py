@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cover-art store shared across tracks of the same release.
+
+Art is fetched from the Cover Art Archive once per release MBID, scaled to
+at most MAX_DIMENSION pixels (CAA thumbnails first, then Pillow if it is
+installed) and kept on disk under its SHA-256, so twenty tracks of one
+album cost one download and embed the same small JPEG. Releases without a
+front cover are remembered for NEGATIVE_TTL. The store is capped at
+MAX_BYTES and evicts least-recently-used releases.
+
+Override the location with YT_TAGGER_STATE_DIR, the size with
+COVER_ART_MAX_DIM (0 = keep originals) and the cap with COVER_ART_MAX_MB.
+"""
+
+import hashlib
+import io
+import os
+import sqlite3
+import time
+from urllib.error import HTTPError
+from urllib.request import Request
+
+from ratelimit import urlopen
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+STATE_DIR = os.environ.get('YT_TAGGER_STATE_DIR', os.path.expanduser('~/.cache/youtube-tagger'))
+ART_DIR = os.path.join(STATE_DIR, 'cover-art')
+
+MAX_DIMENSION = int(os.environ.get('COVER_ART_MAX_DIM', '500'))
+MAX_BYTES = int(os.environ.get('COVER_ART_MAX_MB', '512')) * 1024 * 1024
+JPEG_QUALITY = 85
+NEGATIVE_TTL = 14 * 24 * 3600
+
+CAA_URL = "https://coverartarchive.org/release/{mbid}/{name}"
+# Pre-scaled sizes the Cover Art Archive serves as front-<size>
+CAA_THUMBNAILS = (250, 500, 1200)
+
+
+def mime_type(data):
+    """MIME type of image bytes from their magic number."""
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    return 'image/jpeg'
+
+
+def _front_name(max_dim):
+    """Smallest CAA thumbnail that is still at least max_dim, else the original."""
+    if max_dim:
+        for size in CAA_THUMBNAILS:
+            if size >= max_dim:
+                return f"front-{size}"
+    return "front"
+
+
+def shrink(data, max_dim, quality=JPEG_QUALITY):
+    """Downscale and recompress to a JPEG no larger than max_dim (needs Pillow)."""
+    if not max_dim or Image is None:
+        return data
+    try:
+        img = Image.open(io.BytesIO(data))
+        original_size = img.size
+        if max(original_size) <= max_dim and img.format == 'JPEG':
+            return data
+        img.thumbnail((max_dim, max_dim))
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=quality, optimize=True)
+        small = out.getvalue()
+    except Exception:
+        return data
+    # A small PNG may already beat its JPEG re-encode
+    if max(original_size) <= max_dim and len(small) >= len(data):
+        return data
+    return small
+
+
+class CoverArtStore:
+    """On-disk cover art keyed by (release MBID, size), blobs named by SHA-256."""
+
+    def __init__(self, root=ART_DIR, max_bytes=MAX_BYTES, max_dim=MAX_DIMENSION):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_dim = max_dim
+        os.makedirs(root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, 'index.sqlite3'))
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS art (
+                release_mbid TEXT NOT NULL,
+                max_dim INTEGER NOT NULL,
+                sha256 TEXT,
+                size INTEGER NOT NULL DEFAULT 0,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (release_mbid, max_dim)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS art_last_used ON art (last_used)")
+        self.conn.commit()
+        self.hits = 0
+        self.downloads = 0
+        self.bytes_downloaded = 0
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest + '.img')
+
+    def get(self, release_mbid, user_agent):
+        """Return embed-ready art for a release, or None if it has no front cover."""
+        if not release_mbid:
+            return None
+        now = time.time()
+        row = self.conn.execute(
+            "SELECT sha256, fetched_at FROM art WHERE release_mbid = ? AND max_dim = ?",
+            (release_mbid, self.max_dim),
+        ).fetchone()
+
+        if row is not None:
+            digest, fetched_at = row
+            if digest is None and now - fetched_at < NEGATIVE_TTL:
+                return None
+            if digest is not None:
+                try:
+                    with open(self._blob_path(digest), 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    data = None
+                if data is not None:
+                    self.conn.execute(
+                        "UPDATE art SET last_used = ? WHERE release_mbid = ? AND max_dim = ?",
+                        (now, release_mbid, self.max_dim))
+                    self.conn.commit()
+                    self.hits += 1
+                    return data
+
+        data = self._download(release_mbid, user_agent)
+        if data is None:
+            return None
+        self._put(release_mbid, data)
+        return data
+
+    def _download(self, release_mbid, user_agent):
+        url = CAA_URL.format(mbid=release_mbid, name=_front_name(self.max_dim))
+        try:
+            req = Request(url, headers={'User-Agent': user_agent})
+            with urlopen(req, timeout=10) as response:
+                data = response.read()
+        except HTTPError as e:
+            if e.code == 404:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO art (release_mbid, max_dim, sha256, size, fetched_at, last_used) "
+                    "VALUES (?, ?, NULL, 0, ?, ?)",
+                    (release_mbid, self.max_dim, time.time(), time.time()))
+                self.conn.commit()
+            print(f"  ⚠️  Cover art download failed: {e}")
+            return None
+        except Exception as e:
+            print(f"  ⚠️  Cover art download failed: {e}")
+            return None
+        self.downloads += 1
+        self.bytes_downloaded += len(data)
+        return shrink(data, self.max_dim)
+
+    def _put(self, release_mbid, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO art (release_mbid, max_dim, sha256, size, fetched_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (release_mbid, self.max_dim, digest, len(data), now, now))
+        self.conn.commit()
+        self.evict()
+
+    def total_bytes(self):
+        """Size of distinct blobs currently referenced."""
+        row = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM "
+            "(SELECT sha256, MAX(size) AS size FROM art WHERE sha256 IS NOT NULL GROUP BY sha256)"
+        ).fetchone()
+        return row[0]
+
+    def evict(self):
+        """Drop least-recently-used releases until the store fits in max_bytes."""
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return 0
+        evicted = 0
+        rows = self.conn.execute(
+            "SELECT release_mbid, max_dim, sha256 FROM art "
+            "WHERE sha256 IS NOT NULL ORDER BY last_used").fetchall()
+        for release_mbid, max_dim, digest in rows:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM art WHERE release_mbid = ? AND max_dim = ?",
+                              (release_mbid, max_dim))
+            still_used = self.conn.execute(
+                "SELECT 1 FROM art WHERE sha256 = ? LIMIT 1", (digest,)).fetchone()
+            if not still_used:
+                path = self._blob_path(digest)
+                try:
+                    total -= os.path.getsize(path)
+                    os.unlink(path)
+                except OSError:
+                    pass
+            evicted += 1
+        self.conn.commit()
+        return evicted
+
+    def close(self):
+        self.conn.close()
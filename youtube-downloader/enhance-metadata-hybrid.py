@@ -4,14 +4,18 @@ Hybrid metadata tagger: MusicBrainz API first, then Ollama LLM fallback.
 Best of both worlds - accurate mainstream data + smart parsing for everything else.
 """
 
+import asyncio
 import os
-import re
 import sys
 import time
-import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from urllib.request import Request, urlopen
-from urllib.parse import quote
+
+import filename_parser
+import mb_cache
+import ollama_client
+from tag_state import TagManifest
+from tag_writer import atomic_update
 
 try:
     from mutagen.oggopus import OggOpus
@@ -26,134 +30,80 @@ except ImportError:
 
 MUSIC_DIR = "/mnt/boston/media/music/YouTube-Downloads"
 USER_AGENT = "YouTubeMetadataEnhancer/1.0 (brandon@example.com)"
+TOOL = "enhance-metadata-hybrid"
 
-# Rate limiting for MusicBrainz
-last_request_time = 0
-
-def rate_limit():
-    """Ensure we don't exceed 1 request per second for MusicBrainz."""
-    global last_request_time
-    current_time = time.time()
-    time_since_last = current_time - last_request_time
-    if time_since_last < 1.0:
-        time.sleep(1.0 - time_since_last)
-    last_request_time = time.time()
-
-def clean_filename(filename):
-    """Extract artist and title from YouTube filename."""
-    # Remove file extension
-    name = filename.replace('.opus', '')
-
-    # Remove common YouTube suffixes
-    suffixes = [
-        r'\s*\(Official.*?\)',
-        r'\s*\(Lyric.*?\)',
-        r'\s*\(Music Video\)',
-        r'\s*\(Audio\)',
-        r'\s*\(HD\)',
-        r'\s*\(4K\)',
-        r'\s*\(Live\)',
-        r'\s*\[Official.*?\]',
-        r'\s*\[Lyric.*?\]',
-    ]
-    for suffix in suffixes:
-        name = re.sub(suffix, '', name, flags=re.IGNORECASE)
-
-    # Try to extract artist and title
-    patterns = [
-        r'^(.+?)\s*[-–—]\s*(.+)$',  # "Artist - Title"
-        r'^(.+?)\s+by\s+(.+)$',      # "Title by Artist"
-        r'^(.+?)\s*:\s*(.+)$',       # "Artist: Title"
-    ]
-
-    for pattern in patterns:
-        match = re.match(pattern, name)
-        if match:
-            return match.group(1).strip(), match.group(2).strip()
-
-    return None, name.strip()
+OLLAMA_CONCURRENCY = 2    # generate calls in flight against the local Ollama
+OLLAMA_BATCH = ollama_client.BATCH_SIZE   # filenames per Ollama prompt
+WRITER_THREADS = 4        # concurrent mutagen saves on the NAS mount
 
-def search_musicbrainz(artist, title):
-    """Search MusicBrainz for recording metadata."""
-    if not artist or artist == "Unknown Artist":
-        return None
+# A lookup that errored, as opposed to one that found nothing
+LOOKUP_FAILED = object()
 
-    rate_limit()
+def search_musicbrainz(artist, title):
+    """
+    Search MusicBrainz for recording metadata (cached on disk, see mb_cache.py).
 
-    query = f'artist:"{artist}" AND recording:"{title}"'
-    url = f"https://musicbrainz.org/ws/2/recording/?query={quote(query)}&fmt=json&limit=1"
+    Returns None when there is no match and LOOKUP_FAILED when the search errored.
+    """
+    if not artist or artist == filename_parser.UNKNOWN_ARTIST:
+        return None
 
     try:
-        req = Request(url, headers={'User-Agent': USER_AGENT})
-        with urlopen(req, timeout=10) as response:
-            data = json.loads(response.read().decode())
-
-            if data.get('recordings'):
-                recording = data['recordings'][0]
-
-                metadata = {
-                    'artist': recording.get('artist-credit', [{}])[0].get('name', artist),
-                    'title': recording.get('title', title),
-                    'album': None,
-                    'year': None,
-                    'genre': None,
-                }
-
-                if recording.get('releases'):
-                    release = recording['releases'][0]
-                    metadata['album'] = release.get('title')
-                    if release.get('date'):
-                        metadata['year'] = release['date'][:4]
-
-                return metadata
+        recordings = mb_cache.search_recordings(artist, title, USER_AGENT)
     except Exception as e:
-        pass
+        print(f"  ⚠️  MusicBrainz error: {e}")
+        return LOOKUP_FAILED
 
-    return None
-
-def extract_with_ollama(filename):
-    """Use local Ollama to extract metadata from filename."""
-    try:
-        import requests
+    if recordings:
+        recording = recordings[0]
 
-        prompt = f"""Extract music metadata from this YouTube video filename. Return ONLY valid JSON with these fields:
-- artist: The actual artist/composer name (or null if unknown)
-- title: The song/track title
-- album: The album name (or null)
-- year: Release year (or null)
-- genre: Music genre (or null)
+        metadata = {
+            'artist': recording.get('artist-credit', [{}])[0].get('name', artist),
+            'title': recording.get('title', title),
+            'album': None,
+            'year': None,
+            'genre': None,
+        }
 
-Filename: {filename}
+        if recording.get('releases'):
+            release = recording['releases'][0]
+            metadata['album'] = release.get('title')
+            if release.get('date'):
+                metadata['year'] = release['date'][:4]
 
-Return ONLY the JSON object, no other text."""
+        return metadata
 
-        response = requests.post('http://localhost:11434/api/generate',
-                                json={
-                                    'model': 'llama3.2',
-                                    'prompt': prompt,
-                                    'stream': False
-                                },
-                                timeout=60)
-
-        if response.status_code == 200:
-            result = response.json()
-            text = result.get('response', '').strip()
+    return None
 
-            # Remove markdown code blocks if present
-            text = re.sub(r'^```json\s*', '', text)
-            text = re.sub(r'\s*```$', '', text)
+def extract_with_ollama(filenames):
+    """
+    Use local Ollama to extract metadata from several filenames in one prompt.
 
-            metadata = json.loads(text)
-            return metadata
+    Returns a list aligned with `filenames`: None where nothing was found,
+    LOOKUP_FAILED where Ollama errored. Entries the batch answer missed are
+    retried one at a time.
+    """
+    client = ollama_client.get_client()
+    try:
+        results = client.extract_batch(filenames)
     except Exception as e:
         print(f"  ⚠️  Ollama error: {e}")
-
-    return None
+        results = [LOOKUP_FAILED] * len(filenames)
+
+    if len(filenames) > 1:
+        for i, name in enumerate(filenames):
+            if results[i] is None or results[i] is LOOKUP_FAILED:
+                try:
+                    results[i] = client.extract(name)
+                except Exception as e:
+                    print(f"  ⚠️  Ollama error: {e}")
+                    results[i] = LOOKUP_FAILED
+    return results
 
 def tag_opus_file(filepath, metadata):
     """Add metadata to OPUS file."""
-    try:
-        audio = OggOpus(filepath)
+    def apply(path):
+        audio = OggOpus(path)
 
         if metadata.get('artist'):
             audio['artist'] = metadata['artist']
@@ -173,17 +123,197 @@ def tag_opus_file(filepath, metadata):
             audio['genre'] = metadata['genre']
 
         audio.save()
+
+    try:
+        atomic_update(filepath, apply)
         return True
     except Exception as e:
-        print(f"  ❌ Error tagging: {e}")
+        print(f"  ❌ Error tagging {Path(filepath).name}: {e}")
         return False
 
+class StageStats:
+    """Per-stage counters for the end-of-run report."""
+
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self.first = None
+        self.last = None
+
+    def queued(self, queue):
+        self.max_depth = max(self.max_depth, queue.qsize())
+
+    def done(self, started, count=1):
+        now = time.monotonic()
+        self.processed += count
+        self.busy += now - started
+        self.first = started if self.first is None else self.first
+        self.last = now
+
+    def report(self):
+        elapsed = (self.last - self.first) if self.processed else 0.0
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        return (f"  {self.name:12s} {self.processed:5d} items  {self.busy:7.1f}s busy  "
+                f"max queue {self.max_depth:4d}  {rate:6.2f} items/s")
+
+def filename_metadata(item):
+    """Tags straight from a confident filename parse."""
+    return {'artist': item['artist'], 'title': item['title']}
+
+async def run_pipeline(files, manifest, trust_parser=False, ollama_batch=OLLAMA_BATCH):
+    """
+    Tag `files` through four overlapping stages:
+    filename parsing -> MusicBrainz (shared token bucket, 1 req/s) -> Ollama fallback
+    (OLLAMA_CONCURRENCY prompts in flight, up to `ollama_batch` filenames each)
+    -> tag writer (WRITER_THREADS threads).
+    MusicBrainz keeps moving while Ollama is busy on earlier misses.
+
+    High-confidence parses that MusicBrainz misses are tagged from the
+    filename instead of asking Ollama; with `trust_parser` they skip
+    MusicBrainz as well and never touch the network.
+    """
+    loop = asyncio.get_running_loop()
+    mb_q, ollama_q, write_q = asyncio.Queue(), asyncio.Queue(), asyncio.Queue()
+    stats = {name: StageStats(name) for name in ('parse', 'musicbrainz', 'ollama', 'write')}
+    counts = {'musicbrainz': 0, 'ollama': 0, 'filename': 0, 'failed': 0}
+    total = len(files)
+
+    # One thread: blocking on the MusicBrainz bucket never stalls the event loop
+    mb_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='musicbrainz')
+    write_executor = ThreadPoolExecutor(max_workers=WRITER_THREADS, thread_name_prefix='tag-writer')
+
+    async def put(queue, stage, item):
+        await queue.put(item)
+        stats[stage].queued(queue)
+
+    async def parse_stage():
+        for i, filepath in enumerate(files, 1):
+            started = time.monotonic()
+            parsed = filename_parser.parse(filepath.name)
+            item = {'n': i, 'path': filepath, 'artist': parsed.artist, 'title': parsed.title,
+                    'confident': parsed.confidence >= filename_parser.HIGH_CONFIDENCE}
+            stats['parse'].done(started)
+            if item['confident'] and trust_parser:
+                item.update(metadata=filename_metadata(item), source='filename')
+                await put(write_q, 'write', item)
+            elif parsed.artist != filename_parser.UNKNOWN_ARTIST:
+                await put(mb_q, 'musicbrainz', item)
+            else:
+                await put(ollama_q, 'ollama', item)
+
+    async def musicbrainz_stage():
+        while (item := await mb_q.get()) is not None:
+            started = time.monotonic()
+            metadata = await loop.run_in_executor(
+                mb_executor, search_musicbrainz, item['artist'], item['title'])
+            stats['musicbrainz'].done(started)
+            if metadata is LOOKUP_FAILED:
+                # Whatever the fallbacks find is written but not recorded
+                item['lookup_failed'] = True
+                metadata = None
+            if metadata:
+                print(f"[{item['n']}/{total}] 🔍 MusicBrainz: {metadata['artist']} - {metadata['title']}")
+                item.update(metadata=metadata, source='musicbrainz')
+                await put(write_q, 'write', item)
+            elif item['confident']:
+                print(f"[{item['n']}/{total}] 📋 Filename: {item['artist']} - {item['title']}")
+                item.update(metadata=filename_metadata(item), source='filename')
+                await put(write_q, 'write', item)
+            else:
+                await put(ollama_q, 'ollama', item)
+
+    async def ollama_stage():
+        while (item := await ollama_q.get()) is not None:
+            # Take whatever misses are already waiting, up to one prompt's worth
+            batch = [item]
+            while len(batch) < ollama_batch and not ollama_q.empty():
+                queued = ollama_q.get_nowait()
+                if queued is None:
+                    ollama_q.put_nowait(None)
+                    break
+                batch.append(queued)
+
+            started = time.monotonic()
+            results = await asyncio.to_thread(extract_with_ollama, [b['path'].name for b in batch])
+            stats['ollama'].done(started, len(batch))
+            for item, metadata in zip(batch, results):
+                if metadata is LOOKUP_FAILED:
+                    item['lookup_failed'] = True
+                    metadata = None
+                if metadata:
+                    print(f"[{item['n']}/{total}] 🤖 Ollama: "
+                          f"{metadata.get('artist', 'N/A')} - {metadata.get('title', 'N/A')}")
+                    item.update(metadata=metadata, source='ollama')
+                    await put(write_q, 'write', item)
+                elif item.get('lookup_failed'):
+                    print(f"[{item['n']}/{total}] ⚠️  Lookup failed, retrying next run: {item['path'].name}")
+                    counts['failed'] += 1
+                else:
+                    print(f"[{item['n']}/{total}] ❌ No metadata found: {item['path'].name}")
+                    # Don't ask Ollama again every night; a better source still retries it
+                    await loop.run_in_executor(write_executor, manifest.record, item['path'], 'none', TOOL)
+                    counts['failed'] += 1
+
+    def tag_and_record(item):
+        # Runs on a tag-writer thread: the manifest's SQLite commit stays off the event loop
+        if not tag_opus_file(str(item['path']), item['metadata']):
+            return False
+        # After an errored lookup, leave the file pending so the next run asks again
+        if not item.get('lookup_failed'):
+            manifest.record(item['path'], item['source'], TOOL)
+        return True
+
+    async def write_stage():
+        while (item := await write_q.get()) is not None:
+            started = time.monotonic()
+            ok = await loop.run_in_executor(write_executor, tag_and_record, item)
+            stats['write'].done(started)
+            if ok:
+                counts[item['source']] += 1
+            else:
+                counts['failed'] += 1
+
+    mb_task = asyncio.create_task(musicbrainz_stage())
+    ollama_tasks = [asyncio.create_task(ollama_stage()) for _ in range(OLLAMA_CONCURRENCY)]
+    write_tasks = [asyncio.create_task(write_stage()) for _ in range(WRITER_THREADS)]
+
+    # Shut stages down in order: each one may still feed the next until it exits
+    await parse_stage()
+    await mb_q.put(None)
+    await mb_task
+    for _ in ollama_tasks:
+        await ollama_q.put(None)
+    await asyncio.gather(*ollama_tasks)
+    for _ in write_tasks:
+        await write_q.put(None)
+    await asyncio.gather(*write_tasks)
+
+    mb_executor.shutdown()
+    write_executor.shutdown()
+
+    print()
+    print("Stage throughput:")
+    for stage in stats.values():
+        print(stage.report())
+    if stats['ollama'].processed:
+        print(ollama_client.get_client().stats.report())
+    print()
+
+    return counts
+
 def main():
     import argparse
 
     parser = argparse.ArgumentParser(description='Hybrid metadata tagger (MusicBrainz + Ollama)')
     parser.add_argument('--limit', type=int, help='Only process first N files')
     parser.add_argument('--only-unknown', action='store_true', help='Only process files with "Unknown Artist"')
+    parser.add_argument('--trust-parser', action='store_true',
+                        help='Tag high-confidence filename parses directly, skipping MusicBrainz')
+    parser.add_argument('--force', action='store_true', help='Reprocess files even if unchanged since the last run')
+    parser.add_argument('--ollama-batch', type=int, default=OLLAMA_BATCH,
+                        help=f'Filenames per Ollama prompt (default {OLLAMA_BATCH}, 1 = one per call)')
     args = parser.parse_args()
 
     print("🎵 Hybrid Metadata Tagger (MusicBrainz + Ollama)")
@@ -200,6 +330,12 @@ def main():
         print(f"❌ No OPUS files found in {MUSIC_DIR}")
         return
 
+    manifest = TagManifest()
+    if not args.force:
+        total = len(files)
+        files = manifest.pending(files, TOOL, ('musicbrainz', 'ollama', 'filename'))
+        print(f"Skipping {total - len(files)} unchanged files already tagged (use --force to redo)")
+
     # Filter files if needed
     if args.only_unknown:
         filtered = []
@@ -221,68 +357,13 @@ def main():
 
     print()
 
-    musicbrainz_success = 0
-    ollama_success = 0
-    failed = 0
-
-    for i, filepath in enumerate(files, 1):
-        print(f"[{i}/{len(files)}] 📝 {filepath.name}")
-
-        # Step 1: Try to parse filename
-        artist, title = clean_filename(filepath.name)
-        if artist:
-            print(f"  📋 Parsed: {artist} - {title}")
-        else:
-            print(f"  📋 Parsed: {title}")
-
-        metadata = None
-
-        # Step 2: Try MusicBrainz first
-        if artist and artist != "Unknown Artist":
-            print(f"  🔍 Searching MusicBrainz...")
-            metadata = search_musicbrainz(artist, title)
-
-            if metadata:
-                print(f"  ✅ MusicBrainz found: {metadata['artist']} - {metadata['title']}")
-                if metadata.get('album'):
-                    print(f"     Album: {metadata['album']}")
-                if metadata.get('year'):
-                    print(f"     Year: {metadata['year']}")
-                musicbrainz_success += 1
-
-        # Step 3: If MusicBrainz failed, try Ollama
-        if not metadata:
-            print(f"  🤖 Trying Ollama LLM...")
-            metadata = extract_with_ollama(filepath.name)
-
-            if metadata:
-                print(f"  ✅ Ollama extracted:")
-                print(f"     Artist: {metadata.get('artist', 'N/A')}")
-                print(f"     Title: {metadata.get('title', 'N/A')}")
-                if metadata.get('album'):
-                    print(f"     Album: {metadata['album']}")
-                if metadata.get('year'):
-                    print(f"     Year: {metadata['year']}")
-                if metadata.get('genre'):
-                    print(f"     Genre: {metadata['genre']}")
-                ollama_success += 1
-
-        # Step 4: Tag the file
-        if metadata:
-            if tag_opus_file(str(filepath), metadata):
-                print(f"  ✅ Tagged!")
-            else:
-                failed += 1
-        else:
-            print(f"  ❌ No metadata found")
-            failed += 1
-
-        print()
+    counts = asyncio.run(run_pipeline(files, manifest, args.trust_parser, max(1, args.ollama_batch)))
 
     print("=" * 60)
-    print(f"✅ MusicBrainz: {musicbrainz_success}")
-    print(f"🤖 Ollama: {ollama_success}")
-    print(f"❌ Failed: {failed}")
+    print(f"✅ MusicBrainz: {counts['musicbrainz']}")
+    print(f"🤖 Ollama: {counts['ollama']}")
+    print(f"📋 Filename only: {counts['filename']}")
+    print(f"❌ Failed: {counts['failed']}")
     print()
     print("Navidrome will pick up changes within 5 minutes!")
 
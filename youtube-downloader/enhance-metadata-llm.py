@@ -7,7 +7,6 @@ Intelligently extracts artist, album, year from YouTube filenames.
 import os
 import re
 import sys
-import time
 import json
 from pathlib import Path
 
@@ -29,7 +28,17 @@ except ImportError:
     os.system("pip3 install google-generativeai --break-system-packages")
     import google.generativeai as genai
 
+import ratelimit
+from tag_state import TagManifest
+from tag_writer import DEFAULT_WORKERS, TagWriterPool, atomic_update
+
 MUSIC_DIR = "/mnt/boston/media/music/YouTube-Downloads"
+TOOL = "enhance-metadata-llm"
+
+# Requests are paced by ratelimit.HOST_LIMITS (15 RPM for gemini-flash-latest)
+GEMINI_HOST = 'generativelanguage.googleapis.com'
+BATCH_SIZE = 20           # filenames per prompt in batch mode
+MAX_BATCH_ATTEMPTS = 3    # rounds of retrying only the items a batch missed
 
 # Gemini API setup
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
@@ -58,6 +67,26 @@ Output: {"artist": "Dan Gibson's Solitudes", "title": "Wandering Piper", "album"
 
 Return ONLY valid JSON, no other text."""
 
+BATCH_PROMPT = """You are a music metadata expert. You will be given a numbered list of YouTube video filenames.
+
+Return ONLY a JSON array with one object per filename, in the same order. Each object has:
+- index: The number of the filename in the list
+- artist: The actual artist/composer name (not "Unknown Artist")
+- title: The song/track title
+- album: The album name (if it's a soundtrack, use the game/movie name + "OST" or "Soundtrack")
+- year: Release year if you can infer it (or null)
+- genre: Music genre if obvious (or null)
+
+Example:
+Input:
+1. Morgan Wallen - Last Night (Lyric Video).opus
+2. 16 Baldur's Gate 3 Original Soundtrack - Last Light.opus
+Output:
+[{"index": 1, "artist": "Morgan Wallen", "title": "Last Night", "album": null, "year": "2023", "genre": "Country"},
+ {"index": 2, "artist": "Borislav Slavov", "title": "Last Light", "album": "Baldur's Gate 3 Original Soundtrack", "year": "2023", "genre": "Video Game Music"}]
+
+Return ONLY valid JSON, no other text."""
+
 def setup_gemini():
     """Initialize Gemini API."""
     if not GEMINI_API_KEY:
@@ -73,15 +102,16 @@ def setup_gemini():
     # Use gemini-flash-latest which has better rate limits (15 RPM instead of 5 RPM)
     return genai.GenerativeModel('gemini-flash-latest')
 
-def extract_metadata_with_llm(model, filename):
-    """Use Gemini to extract metadata from filename."""
-    max_retries = 3
-    retry_delay = 70  # seconds - wait longer than 1 minute for rate limit reset
+def generate_json(model, prompt):
+    """Send one prompt to Gemini and parse the JSON reply (None on failure)."""
+    limiter = ratelimit.get_limiter()
+    max_retries = ratelimit.MAX_RETRIES
 
     for attempt in range(max_retries):
         try:
-            prompt = f"{SYSTEM_PROMPT}\n\nFilename: {filename}"
+            limiter.acquire(GEMINI_HOST)
             response = model.generate_content(prompt)
+            limiter.success(GEMINI_HOST)
 
             # Parse JSON response
             text = response.text.strip()
@@ -89,14 +119,13 @@ def extract_metadata_with_llm(model, filename):
             text = re.sub(r'^```json\s*', '', text)
             text = re.sub(r'\s*```$', '', text)
 
-            metadata = json.loads(text)
-            return metadata
+            return json.loads(text)
         except Exception as e:
             error_str = str(e)
             if '429' in error_str or 'quota' in error_str.lower():
+                delay = limiter.throttled(GEMINI_HOST, ratelimit.retry_after_from_error(e))
                 if attempt < max_retries - 1:
-                    print(f"  ⏳ Rate limit hit, waiting {retry_delay} seconds...")
-                    time.sleep(retry_delay)
+                    print(f"  ⏳ Rate limit hit, backing off {delay:.0f} seconds...")
                     continue
                 else:
                     print(f"  ⚠️  Rate limit exceeded after {max_retries} retries")
@@ -107,10 +136,53 @@ def extract_metadata_with_llm(model, filename):
 
     return None
 
+def extract_metadata_with_llm(model, filename):
+    """Use Gemini to extract metadata from filename."""
+    metadata = generate_json(model, f"{SYSTEM_PROMPT}\n\nFilename: {filename}")
+    return metadata if isinstance(metadata, dict) else None
+
+def extract_metadata_batch(model, filenames):
+    """
+    Extract metadata for several filenames with one prompt per round.
+
+    Returns {filename: metadata} for every item the model answered properly.
+    Items that are missing or malformed in a reply are retried on their own
+    in the next round, up to MAX_BATCH_ATTEMPTS rounds.
+    """
+    results = {}
+    pending = list(filenames)
+
+    for attempt in range(MAX_BATCH_ATTEMPTS):
+        if not pending:
+            break
+        if attempt:
+            print(f"  🔁 Retrying {len(pending)} item(s) missing from the last reply...")
+
+        listing = "\n".join(f"{i}. {name}" for i, name in enumerate(pending, 1))
+        reply = generate_json(model, f"{BATCH_PROMPT}\n\nInput:\n{listing}")
+        if isinstance(reply, dict):
+            reply = [reply]
+        if not isinstance(reply, list):
+            continue
+
+        for entry in reply:
+            if not isinstance(entry, dict) or not entry.get('title'):
+                continue
+            try:
+                index = int(entry.pop('index'))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if 1 <= index <= len(pending):
+                results.setdefault(pending[index - 1], entry)
+
+        pending = [name for name in pending if name not in results]
+
+    return results
+
 def tag_opus_file(filepath, metadata):
     """Add metadata to OPUS file."""
-    try:
-        audio = OggOpus(filepath)
+    def apply(path):
+        audio = OggOpus(path)
 
         if metadata.get('artist'):
             audio['artist'] = metadata['artist']
@@ -130,9 +202,12 @@ def tag_opus_file(filepath, metadata):
             audio['genre'] = metadata['genre']
 
         audio.save()
+
+    try:
+        atomic_update(filepath, apply)
         return True
     except Exception as e:
-        print(f"  ❌ Error tagging: {e}")
+        print(f"  ❌ Error tagging {Path(filepath).name}: {e}")
         return False
 
 def main():
@@ -141,7 +216,11 @@ def main():
     parser = argparse.ArgumentParser(description='LLM-enhanced metadata tagger')
     parser.add_argument('--limit', type=int, help='Only process first N files (for testing)')
     parser.add_argument('--only-unknown', action='store_true', help='Only process files with "Unknown Artist"')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f'Filenames per Gemini request (default {BATCH_SIZE}, 1 = one request per file)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent tag writes')
     parser.add_argument('--dry-run', action='store_true', help='Show what would be done without tagging')
+    parser.add_argument('--force', action='store_true', help='Reprocess files even if unchanged since the last run')
     args = parser.parse_args()
 
     print("🤖 LLM-Enhanced YouTube Metadata Tagger (Google Gemini)")
@@ -163,6 +242,12 @@ def main():
         print(f"❌ No OPUS files found in {MUSIC_DIR}")
         return
 
+    manifest = TagManifest()
+    if not args.force:
+        total = len(files)
+        files = manifest.pending(files, TOOL, ('gemini',))
+        print(f"Skipping {total - len(files)} unchanged files already tagged (use --force to redo)")
+
     # Filter files if needed
     if args.only_unknown:
         filtered = []
@@ -187,43 +272,61 @@ def main():
     enhanced = 0
     failed = 0
 
-    for i, filepath in enumerate(files, 1):
-        print(f"[{i}/{len(files)}] 📝 {filepath.name}")
+    batch_size = max(1, args.batch_size)
+    pool = TagWriterPool(args.workers)
+    i = 0
 
-        # Rate limiting: 15 requests per minute for gemini-flash-latest
-        # After every 10 requests, wait 60 seconds to be safe
-        if i > 1 and (i - 1) % 10 == 0:
-            print(f"  ⏸️  Processed 10 requests, waiting 60 seconds for rate limit reset...")
-            time.sleep(60)
+    for start in range(0, len(files), batch_size):
+        batch = files[start:start + batch_size]
 
         # Use LLM to extract metadata
-        metadata = extract_metadata_with_llm(model, filepath.name)
-
-        if metadata:
-            print(f"  🤖 LLM extracted:")
-            print(f"     Artist: {metadata.get('artist', 'N/A')}")
-            print(f"     Title: {metadata.get('title', 'N/A')}")
-            if metadata.get('album'):
-                print(f"     Album: {metadata['album']}")
-            if metadata.get('year'):
-                print(f"     Year: {metadata['year']}")
-            if metadata.get('genre'):
-                print(f"     Genre: {metadata['genre']}")
-
-            if not args.dry_run:
-                if tag_opus_file(str(filepath), metadata):
-                    print(f"  ✅ Tagged!")
-                    enhanced += 1
+        if batch_size == 1:
+            results = {batch[0].name: extract_metadata_with_llm(model, batch[0].name)}
+        else:
+            print(f"🤖 Asking Gemini about files {start + 1}-{start + len(batch)}...")
+            results = extract_metadata_batch(model, [f.name for f in batch])
+            print()
+
+        # Write the whole batch concurrently, then report in order
+        writes = {}
+        if not args.dry_run:
+            for filepath in batch:
+                if results.get(filepath.name):
+                    writes[filepath] = pool.submit_recorded(manifest, filepath, 'gemini', TOOL,
+                                                            tag_opus_file, str(filepath), results[filepath.name])
+
+        for filepath in batch:
+            i += 1
+            print(f"[{i}/{len(files)}] 📝 {filepath.name}")
+            metadata = results.get(filepath.name)
+
+            if metadata:
+                print(f"  🤖 LLM extracted:")
+                print(f"     Artist: {metadata.get('artist', 'N/A')}")
+                print(f"     Title: {metadata.get('title', 'N/A')}")
+                if metadata.get('album'):
+                    print(f"     Album: {metadata['album']}")
+                if metadata.get('year'):
+                    print(f"     Year: {metadata['year']}")
+                if metadata.get('genre'):
+                    print(f"     Genre: {metadata['genre']}")
+
+                if not args.dry_run:
+                    if writes[filepath].result():
+                        print(f"  ✅ Tagged!")
+                        enhanced += 1
+                    else:
+                        failed += 1
                 else:
-                    failed += 1
+                    print(f"  ⏭️  Dry run - not tagging")
+                    enhanced += 1
             else:
-                print(f"  ⏭️  Dry run - not tagging")
-                enhanced += 1
-        else:
-            print(f"  ❌ Failed to extract metadata")
-            failed += 1
+                print(f"  ❌ Failed to extract metadata")
+                failed += 1
+
+            print()
 
-        print()
+    pool.shutdown()
 
     print("=" * 60)
     print(f"✅ Enhanced: {enhanced}")
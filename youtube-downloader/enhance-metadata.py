@@ -5,14 +5,13 @@ Uses MusicBrainz API to fetch proper artist, album, year, genre, and album art.
 """
 
 import os
-import re
-import sys
-import time
-import json
 from pathlib import Path
-from urllib.request import urlopen, Request
-from urllib.parse import quote
-import subprocess
+
+import mb_cache
+from filename_parser import clean_filename
+from cover_art import MAX_DIMENSION, CoverArtStore, mime_type
+from tag_state import TagManifest
+from tag_writer import DEFAULT_WORKERS, TagWriterPool, atomic_update
 
 try:
     from mutagen.oggopus import OggOpus
@@ -26,113 +25,48 @@ except ImportError:
     from mutagen.id3 import ID3, TIT2, TPE1, TALB, TDRC, TCON, APIC
 
 MUSIC_DIR = "/mnt/boston/media/music/YouTube-Downloads"
-CACHE_DIR = "/tmp/musicbrainz_cache"
 USER_AGENT = "YouTubeMetadataEnhancer/1.0 (https://github.com/bmbell23/docker)"
-
-# Rate limiting for MusicBrainz (1 request per second)
-LAST_REQUEST_TIME = 0
-
-def rate_limit():
-    """Ensure we don't exceed MusicBrainz rate limits."""
-    global LAST_REQUEST_TIME
-    now = time.time()
-    elapsed = now - LAST_REQUEST_TIME
-    if elapsed < 1.0:
-        time.sleep(1.0 - elapsed)
-    LAST_REQUEST_TIME = time.time()
-
-def clean_filename(filename):
-    """Extract clean artist and title from YouTube filename."""
-    name = Path(filename).stem
-
-    # Remove common YouTube suffixes
-    name = re.sub(r'\s*\(.*?(Official|Lyric|Music|Audio|Video|HD|4K|Live|Visualizer).*?\)', '', name, flags=re.IGNORECASE)
-    name = re.sub(r'\s*\[.*?(Official|Lyric|Music|Audio|Video|HD|4K|Live|Visualizer).*?\]', '', name, flags=re.IGNORECASE)
-
-    # Remove track numbers at the start
-    name = re.sub(r'^\d+\.?\s*', '', name)
-
-    # Pattern 1: "Artist - Title"
-    match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', name)
-    if match:
-        return match.group(1).strip(), match.group(2).strip()
-
-    # Pattern 2: "Title by Artist"
-    match = re.search(r'^(.+?)\s+by\s+(.+)$', name, re.IGNORECASE)
-    if match:
-        return match.group(2).strip(), match.group(1).strip()
-
-    # Pattern 3: "Artist: Title"
-    match = re.match(r'^(.+?)\s*:\s*(.+)$', name)
-    if match:
-        return match.group(1).strip(), match.group(2).strip()
-
-    return "Unknown Artist", name.strip()
+TOOL = "enhance-metadata"
 
 def search_musicbrainz(artist, title):
-    """Search MusicBrainz for recording metadata."""
-    rate_limit()
-
-    # Build search query
-    query = f'artist:"{artist}" AND recording:"{title}"'
-    url = f"https://musicbrainz.org/ws/2/recording/?query={quote(query)}&fmt=json&limit=1"
-
-    try:
-        req = Request(url, headers={'User-Agent': USER_AGENT})
-        with urlopen(req, timeout=10) as response:
-            data = json.loads(response.read().decode())
-
-            if data.get('recordings'):
-                recording = data['recordings'][0]
-
-                # Extract metadata
-                metadata = {
-                    'artist': recording.get('artist-credit', [{}])[0].get('name', artist),
-                    'title': recording.get('title', title),
-                    'album': None,
-                    'year': None,
-                    'genre': None,
-                    'mbid': recording.get('id')
-                }
-
-                # Get album info if available
-                if recording.get('releases'):
-                    release = recording['releases'][0]
-                    metadata['album'] = release.get('title')
-                    if release.get('date'):
-                        metadata['year'] = release['date'][:4]
-
-                    # Get release MBID for cover art
-                    metadata['release_mbid'] = release.get('id')
-
-                return metadata
-    except Exception as e:
-        print(f"  ⚠️  MusicBrainz search failed: {e}")
-
-    return None
-
-def download_cover_art(release_mbid):
-    """Download cover art from Cover Art Archive."""
-    if not release_mbid:
-        return None
-
-    rate_limit()
-
-    url = f"https://coverartarchive.org/release/{release_mbid}/front"
-
-    try:
-        req = Request(url, headers={'User-Agent': USER_AGENT})
-        with urlopen(req, timeout=10) as response:
-            return response.read()
-    except Exception as e:
-        print(f"  ⚠️  Cover art download failed: {e}")
+    """
+    Search MusicBrainz for recording metadata (cached on disk, see mb_cache.py).
+
+    Returns None when MusicBrainz has no match; network errors propagate.
+    """
+    recordings = mb_cache.search_recordings(artist, title, USER_AGENT)
+
+    if recordings:
+        recording = recordings[0]
+
+        # Extract metadata
+        metadata = {
+            'artist': recording.get('artist-credit', [{}])[0].get('name', artist),
+            'title': recording.get('title', title),
+            'album': None,
+            'year': None,
+            'genre': None,
+            'mbid': recording.get('id')
+        }
+
+        # Get album info if available
+        if recording.get('releases'):
+            release = recording['releases'][0]
+            metadata['album'] = release.get('title')
+            if release.get('date'):
+                metadata['year'] = release['date'][:4]
+
+            # Get release MBID for cover art
+            metadata['release_mbid'] = release.get('id')
+
+        return metadata
 
     return None
 
 def tag_opus_file(filepath, metadata, cover_art=None):
     """Add enhanced metadata to OPUS file."""
-    try:
-        audio = OggOpus(filepath)
+    def apply(path):
+        audio = OggOpus(path)
         audio['artist'] = metadata['artist']
         audio['title'] = metadata['title']
 
@@ -154,15 +88,18 @@ def tag_opus_file(filepath, metadata, cover_art=None):
 
             picture = Picture()
             picture.type = 3  # Cover (front)
-            picture.mime = 'image/jpeg'
+            picture.mime = mime_type(cover_art)
             picture.data = cover_art
 
             audio['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
 
         audio.save()
+
+    try:
+        atomic_update(filepath, apply)
         return True
     except Exception as e:
-        print(f"  ❌ Error tagging: {e}")
+        print(f"  ❌ Error tagging {Path(filepath).name}: {e}")
         return False
 
 def main():
@@ -171,7 +108,11 @@ def main():
     parser = argparse.ArgumentParser(description='Enhanced YouTube metadata tagger')
     parser.add_argument('--limit', type=int, help='Only process first N files (for testing)')
     parser.add_argument('--skip-art', action='store_true', help='Skip downloading cover art')
+    parser.add_argument('--art-max-dim', type=int, default=MAX_DIMENSION,
+                        help=f'Scale embedded cover art to at most this many pixels (default {MAX_DIMENSION}, 0 = original)')
     parser.add_argument('--only-unknown', action='store_true', help='Only process files with "Unknown Artist"')
+    parser.add_argument('--force', action='store_true', help='Reprocess files even if unchanged since the last run')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent tag writes')
     parser.add_argument('--auto', action='store_true', help='Run without confirmation prompt')
     args = parser.parse_args()
 
@@ -189,6 +130,12 @@ def main():
         print(f"❌ No OPUS files found in {MUSIC_DIR}")
         return
 
+    manifest = TagManifest()
+    if not args.force:
+        total = len(files)
+        files = manifest.pending(files, TOOL, ('musicbrainz',))
+        print(f"Skipping {total - len(files)} unchanged files already tagged (use --force to redo)")
+
     # Filter files if needed
     if args.only_unknown:
         filtered = []
@@ -222,6 +169,11 @@ def main():
     failed = 0
     skipped = 0
 
+    # Tag writes overlap with the next lookups and are recorded as each one lands
+    pool = TagWriterPool(args.workers)
+    writes = []
+    art_store = CoverArtStore(max_dim=args.art_max_dim)
+
     for i, filepath in enumerate(files, 1):
         print(f"[{i}/{len(files)}] 📝 {filepath.name}")
 
@@ -231,12 +183,20 @@ def main():
         # Skip if it's a cover, remix, or soundtrack (MusicBrainz won't have these)
         if any(keyword in filepath.name.lower() for keyword in ['cover', 'remix', 'ost', 'soundtrack', 'piano version']):
             print(f"  ⚠️  Detected cover/remix/soundtrack - keeping basic metadata")
+            manifest.record(filepath, 'none', TOOL)
             skipped += 1
             print()
             continue
 
         # Search MusicBrainz
-        metadata = search_musicbrainz(artist, title)
+        try:
+            metadata = search_musicbrainz(artist, title)
+        except Exception as e:
+            # Not recorded, so the next run tries this file again
+            print(f"  ⚠️  MusicBrainz search failed: {e}")
+            failed += 1
+            print()
+            continue
 
         if metadata:
             print(f"  ✅ Found: {metadata['artist']} - {metadata['title']}")
@@ -248,26 +208,34 @@ def main():
             # Download cover art
             cover_art = None
             if not args.skip_art and metadata.get('release_mbid'):
-                print(f"  🖼️  Downloading cover art...")
-                cover_art = download_cover_art(metadata['release_mbid'])
+                cover_art = art_store.get(metadata['release_mbid'], USER_AGENT)
                 if cover_art:
-                    print(f"  ✅ Cover art downloaded ({len(cover_art)} bytes)")
+                    print(f"  🖼️  Cover art ready ({len(cover_art)} bytes)")
 
             # Tag file
-            if tag_opus_file(str(filepath), metadata, cover_art):
-                enhanced += 1
-            else:
-                failed += 1
+            writes.append(pool.submit_recorded(manifest, filepath, 'musicbrainz', TOOL,
+                                               tag_opus_file, str(filepath), metadata, cover_art))
         else:
             print(f"  ⚠️  No match found, keeping basic metadata")
+            manifest.record(filepath, 'none', TOOL)
             failed += 1
 
         print()
 
+    for future in writes:
+        if future.result():
+            enhanced += 1
+        else:
+            failed += 1
+    pool.shutdown()
+
     print("=" * 60)
     print(f"✅ Enhanced: {enhanced}")
     print(f"⚠️  Failed/Not Found: {failed}")
     print(f"⏭️  Skipped (covers/remixes): {skipped}")
+    if not args.skip_art:
+        print(f"🖼️  Cover art: {art_store.downloads} downloaded "
+              f"({art_store.bytes_downloaded // 1024} KiB), {art_store.hits} reused from cache")
     print()
     print("Navidrome will pick up changes within 5 minutes!")
 
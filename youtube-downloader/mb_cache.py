@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Persistent MusicBrainz response cache shared by the YouTube taggers.
+
+Entries are stored by (kind, key) in one SQLite file with a TTL each;
+recording searches are keyed by the normalized (artist, title) query.
+"No match" answers are cached too (with a shorter TTL) so re-runs over an
+unchanged library make zero network calls. Network errors are never cached.
+
+Override the location with YT_TAGGER_STATE_DIR.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from urllib.parse import quote
+from urllib.request import Request
+
+from ratelimit import urlopen
+
+STATE_DIR = os.environ.get('YT_TAGGER_STATE_DIR', os.path.expanduser('~/.cache/youtube-tagger'))
+CACHE_PATH = os.path.join(STATE_DIR, 'musicbrainz.sqlite3')
+
+POSITIVE_TTL = 90 * 24 * 3600   # MusicBrainz data rarely changes
+NEGATIVE_TTL = 14 * 24 * 3600   # retry misses now and then, new releases get added
+
+# Always fetch this many candidates so every caller can share one cache entry
+SEARCH_LIMIT = 3
+
+MB_SEARCH_URL = "https://musicbrainz.org/ws/2/recording/?query={query}&fmt=json&limit={limit}"
+
+# Returned by MusicBrainzCache.get() when there is no live entry
+MISS = object()
+
+
+def normalize(s):
+    """Normalize a query component: casefold, strip accents/punctuation, squash spaces."""
+    if not s:
+        return ''
+    s = unicodedata.normalize('NFKD', s)
+    s = ''.join(c for c in s if not unicodedata.combining(c))
+    s = re.sub(r'[^\w\s]', ' ', s.casefold())
+    return re.sub(r'\s+', ' ', s).strip()
+
+
+def recording_key(artist, title):
+    """Cache key for a recording search."""
+    return f"{normalize(artist)}\x1f{normalize(title)}"
+
+
+class MusicBrainzCache:
+    """SQLite-backed TTL cache. Values are JSON; None is a cached negative result."""
+
+    def __init__(self, path=CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        # The hybrid tagger queries from a dedicated MusicBrainz thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT,
+                fetched_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            )
+        """)
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, key):
+        """Return the cached value, None for a cached negative, or MISS."""
+        row = self.conn.execute(
+            "SELECT payload, expires_at FROM responses WHERE kind = ? AND key = ?",
+            (kind, key),
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            self.misses += 1
+            return MISS
+        self.hits += 1
+        return None if row[0] is None else json.loads(row[0])
+
+    def put(self, kind, key, value, ttl=None):
+        """Store a value (None = negative result)."""
+        if ttl is None:
+            ttl = NEGATIVE_TTL if value is None else POSITIVE_TTL
+        now = time.time()
+        payload = None if value is None else json.dumps(value)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (kind, key, payload, fetched_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (kind, key, payload, now, now + ttl),
+        )
+        self.conn.commit()
+
+    def purge_expired(self):
+        """Drop expired entries; returns the number removed."""
+        cur = self.conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        self.conn.commit()
+        return cur.rowcount
+
+    def close(self):
+        self.conn.close()
+
+
+_default_cache = None
+
+
+def get_cache():
+    """Process-wide cache instance, opened on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = MusicBrainzCache()
+    return _default_cache
+
+
+def search_recordings(artist, title, user_agent, cache=None):
+    """
+    Search MusicBrainz recordings for artist/title, consulting the cache first.
+
+    Returns the list of recording dicts (empty if MusicBrainz has no match).
+    A local dump index (mb_index.py) answers next if one has been imported.
+    Network errors propagate to the caller and are not cached. Only misses
+    in both go through the shared rate limiter.
+    """
+    cache = cache or get_cache()
+    key = recording_key(artist, title)
+
+    cached = cache.get('recording', key)
+    if cached is not MISS:
+        return cached or []
+
+    # Imported lazily: mb_index imports this module
+    from mb_index import get_index
+    index = get_index()
+    if index is not None:
+        local = index.lookup(artist, title, limit=SEARCH_LIMIT)
+        if local:
+            return local
+
+    query = f'artist:"{artist}" AND recording:"{title}"'
+    url = MB_SEARCH_URL.format(query=quote(query), limit=SEARCH_LIMIT)
+    req = Request(url, headers={'User-Agent': user_agent})
+    with urlopen(req, timeout=10) as response:
+        data = json.loads(response.read().decode())
+
+    recordings = data.get('recordings') or []
+    cache.put('recording', key, recordings or None)
+    return recordings
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Inspect or prune the MusicBrainz cache')
+    parser.add_argument('--purge', action='store_true', help='Remove expired entries')
+    args = parser.parse_args()
+
+    c = get_cache()
+    if args.purge:
+        print(f"Removed {c.purge_expired()} expired entries")
+    for kind, total, negative in c.conn.execute(
+            "SELECT kind, COUNT(*), SUM(payload IS NULL) FROM responses GROUP BY kind"):
+        print(f"{kind}: {total} entries ({negative} negative)")
+    print(f"Cache file: {c.path}")
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Local MusicBrainz recording index for offline lookups.
+
+Streams a MusicBrainz JSON data dump (recording.tar.xz from
+https://data.metabrainz.org/pub/musicbrainz/data/json-dumps/, or any
+JSON-lines subset of it, optionally .gz/.xz/.bz2) or a simple TSV subset
+into a compact SQLite file with an FTS5 index over normalized artist and
+recording names. mb_cache.search_recordings() consults it before going to
+the network, so only misses cost a rate-limited request.
+
+TSV subset columns: mbid, artist, title, release title, release mbid, date.
+
+Re-importing the same or an overlapping dump updates recordings in place
+(one row per recording MBID) rather than adding duplicates.
+
+Usage:
+    ./mb_index.py import recording.tar.xz
+    ./mb_index.py import mb-dump-sample.jsonl --index /tmp/mb.sqlite3
+    ./mb_index.py lookup "Aerosmith" "Dream On"
+
+Override the location with MB_INDEX_PATH.
+"""
+
+import bz2
+import difflib
+import gzip
+import io
+import json
+import lzma
+import os
+import sqlite3
+import sys
+import tarfile
+import time
+
+from mb_cache import STATE_DIR, normalize, recording_key
+
+INDEX_PATH = os.environ.get('MB_INDEX_PATH', os.path.join(STATE_DIR, 'musicbrainz-index.sqlite3'))
+
+BATCH_ROWS = 10000
+# Combined artist/title similarity an FTS candidate needs to count as a match
+MIN_SIMILARITY = 0.85
+FTS_CANDIDATES = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    mbid TEXT NOT NULL UNIQUE,
+    artist TEXT NOT NULL,
+    title TEXT NOT NULL,
+    album TEXT,
+    release_mbid TEXT,
+    date TEXT,
+    key TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS recordings_fts USING fts5(
+    artist, title, content='', tokenize='unicode61 remove_diacritics 2'
+);
+"""
+# Bound on host parameters per IN (...) lookup
+LOOKUP_CHUNK = 500
+
+
+def _open_text(path):
+    """Open a possibly compressed text file."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def _json_lines(path):
+    """Yield JSON lines from a dump tarball's mbdump/recording member or a plain file."""
+    if '.tar' in os.path.basename(path):
+        with tarfile.open(path, 'r|*') as tar:
+            for member in tar:
+                if member.isfile() and member.name.endswith('mbdump/recording'):
+                    stream = io.TextIOWrapper(tar.extractfile(member), encoding='utf-8')
+                    yield from stream
+                    return
+        raise ValueError(f"No mbdump/recording member in {path}")
+    with _open_text(path) as f:
+        yield from f
+
+
+def _from_json(line):
+    rec = json.loads(line)
+    credits = rec.get('artist-credit') or []
+    artist = ''.join(c.get('name', '') + c.get('joinphrase', '') for c in credits).strip()
+    releases = rec.get('releases') or []
+    release = releases[0] if releases else {}
+    date = release.get('date') or rec.get('first-release-date') or ''
+    return (rec['id'], artist, rec.get('title', ''), release.get('title'),
+            release.get('id'), date)
+
+
+def _from_tsv(line):
+    fields = line.rstrip('\n').split('\t')
+    fields += [''] * (6 - len(fields))
+    mbid, artist, title, album, release_mbid, date = fields[:6]
+    return (mbid, artist, title, album or None, release_mbid or None, date)
+
+
+def _records(path):
+    if path.endswith(('.tsv', '.tsv.gz', '.tsv.xz', '.tsv.bz2')):
+        with _open_text(path) as f:
+            for line in f:
+                if line.strip() and not line.startswith('#') and not line.startswith('mbid\t'):
+                    yield _from_tsv(line)
+    else:
+        for line in _json_lines(path):
+            if line.strip():
+                yield _from_json(line)
+
+
+def _fts_delete(conn, rows):
+    """Drop (rowid, artist, title) entries from the contentless FTS table."""
+    # A contentless table needs the exact values that were indexed
+    conn.executemany(
+        "INSERT INTO recordings_fts (recordings_fts, rowid, artist, title) VALUES ('delete', ?, ?, ?)",
+        [(rowid, normalize(artist), normalize(title)) for rowid, artist, title in rows])
+
+
+def _existing(conn, mbids):
+    """{mbid: (rowid, artist, title)} for MBIDs already in the index."""
+    found = {}
+    for i in range(0, len(mbids), LOOKUP_CHUNK):
+        chunk = mbids[i:i + LOOKUP_CHUNK]
+        for mbid, rowid, artist, title in conn.execute(
+                f"SELECT mbid, id, artist, title FROM recordings "
+                f"WHERE mbid IN ({', '.join('?' * len(chunk))})", chunk):
+            found[mbid] = (rowid, artist, title)
+    return found
+
+
+def import_dump(path, index_path=INDEX_PATH, progress=True):
+    """
+    Stream `path` into the index. Recordings already present (by MBID) are
+    replaced in place. Returns (recordings added, recordings updated).
+    """
+    os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(index_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(SCHEMA)
+    next_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM recordings").fetchone()[0]
+
+    started = time.time()
+    added = updated = 0
+    batch = {}   # mbid -> record; a repeated MBID within a batch keeps the last one
+
+    def flush():
+        nonlocal next_id, added, updated
+        existing = _existing(conn, list(batch))
+        _fts_delete(conn, existing.values())
+        rows, fts_rows = [], []
+        for mbid, (artist, title, album, release_mbid, date) in batch.items():
+            if mbid in existing:
+                rowid = existing[mbid][0]
+                updated += 1
+            else:
+                rowid = next_id
+                next_id += 1
+                added += 1
+            rows.append((rowid, mbid, artist, title, album, release_mbid, date,
+                         recording_key(artist, title)))
+            fts_rows.append((rowid, normalize(artist), normalize(title)))
+        conn.executemany("INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT INTO recordings_fts (rowid, artist, title) VALUES (?, ?, ?)", fts_rows)
+        conn.commit()
+        batch.clear()
+
+    for mbid, artist, title, album, release_mbid, date in _records(path):
+        if not artist or not title:
+            continue
+        batch[mbid] = (artist, title, album, release_mbid, date)
+        if len(batch) >= BATCH_ROWS:
+            flush()
+            if progress:
+                done = added + updated
+                rate = done / max(time.time() - started, 1e-6)
+                print(f"\r  {done:,} recordings ({rate:,.0f}/s)", end='', file=sys.stderr)
+    flush()
+
+    conn.execute("CREATE INDEX IF NOT EXISTS recordings_key ON recordings (key)")
+    conn.execute("INSERT INTO recordings_fts (recordings_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+    if progress:
+        print(f"\r  {added + updated:,} recordings in {time.time() - started:.1f}s", file=sys.stderr)
+    return added, updated
+
+
+def _fts_query(artist_norm, title_norm):
+    """Every artist word (as a prefix) and any title word; similarity decides the rest."""
+    def terms(text, joiner):
+        return joiner.join('"' + t.replace('"', '') + '"*' for t in text.split())
+    return f"artist : ({terms(artist_norm, ' ')}) AND title : ({terms(title_norm, ' OR ')})"
+
+
+class RecordingIndex:
+    """Read-only lookups against an imported index."""
+
+    def __init__(self, path=INDEX_PATH):
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def _as_recording(self, row):
+        """Shape a row like a /ws/2/recording search hit."""
+        mbid, artist, title, album, release_mbid, date = row
+        recording = {'id': mbid, 'title': title, 'score': 100,
+                     'artist-credit': [{'name': artist}]}
+        if album:
+            recording['releases'] = [{'id': release_mbid, 'title': album, 'date': date or None}]
+        return recording
+
+    def lookup(self, artist, title, limit=3):
+        """Best local matches for artist/title, best first (empty list if none)."""
+        columns = "mbid, artist, title, album, release_mbid, date"
+        rows = self.conn.execute(
+            f"SELECT {columns} FROM recordings WHERE key = ? "
+            "ORDER BY album IS NULL, date = '', date LIMIT ?",
+            (recording_key(artist, title), limit),
+        ).fetchall()
+        if rows:
+            return [self._as_recording(r) for r in rows]
+
+        artist_norm, title_norm = normalize(artist), normalize(title)
+        if not artist_norm or not title_norm:
+            return []
+        try:
+            candidates = self.conn.execute(
+                f"SELECT {columns} FROM recordings WHERE id IN ("
+                "  SELECT rowid FROM recordings_fts WHERE recordings_fts MATCH ? "
+                "  ORDER BY rank LIMIT ?)",
+                (_fts_query(artist_norm, title_norm), FTS_CANDIDATES),
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return []
+
+        scored = []
+        for row in candidates:
+            a = difflib.SequenceMatcher(None, artist_norm, normalize(row[1])).ratio()
+            t = difflib.SequenceMatcher(None, title_norm, normalize(row[2])).ratio()
+            score = 0.4 * a + 0.6 * t
+            if score >= MIN_SIMILARITY:
+                scored.append((score, row))
+        scored.sort(key=lambda s: (-s[0], s[1][3] is None))
+        return [self._as_recording(row) for _, row in scored[:limit]]
+
+    def close(self):
+        self.conn.close()
+
+
+_index = None
+
+
+def get_index():
+    """Shared index if one has been imported, else None."""
+    global _index
+    if _index is None and os.path.exists(INDEX_PATH):
+        _index = RecordingIndex(INDEX_PATH)
+    return _index
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local MusicBrainz recording index')
+    parser.add_argument('--index', default=INDEX_PATH, help=f'Index file (default {INDEX_PATH})')
+    sub = parser.add_subparsers(dest='command', required=True)
+    imp = sub.add_parser('import', help='Import a JSON dump, JSON-lines or TSV subset')
+    imp.add_argument('dump')
+    look = sub.add_parser('lookup', help='Look up a recording')
+    look.add_argument('artist')
+    look.add_argument('title')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        print(f"📥 Importing {args.dump} into {args.index}")
+        added, updated = import_dump(args.dump, args.index)
+        print(f"✅ Added {added:,} recordings, updated {updated:,}")
+    else:
+        index = RecordingIndex(args.index)
+        started = time.perf_counter()
+        results = index.lookup(args.artist, args.title)
+        elapsed = (time.perf_counter() - started) * 1000
+        if not results:
+            print(f"❌ No local match ({elapsed:.1f} ms)")
+            sys.exit(1)
+        for rec in results:
+            release = (rec.get('releases') or [{}])[0]
+            print(f"✅ {rec['artist-credit'][0]['name']} - {rec['title']}"
+                  f"  [{release.get('title') or 'no release'} {release.get('date') or ''}]  {rec['id']}")
+        print(f"   ({elapsed:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Persistent Ollama client for the hybrid tagger.
+
+One pooled requests.Session is reused for every call, and each request
+pins the model in memory with keep_alive so it is not unloaded while the
+pipeline waits on slow MusicBrainz misses. extract_batch() sends several
+filenames per prompt using Ollama's JSON `format` mode. Token counts and
+timings from every response are accumulated in OllamaStats.
+
+Override the server with OLLAMA_URL, the model with OLLAMA_MODEL and the
+residency with OLLAMA_KEEP_ALIVE.
+
+tests/test_ollama_client.py exercises the client against a local stub
+server (no Ollama needed).
+"""
+
+import json
+import os
+import re
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import ratelimit
+
+OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://localhost:11434')
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3.2')
+KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '30m')
+TIMEOUT = 120
+BATCH_SIZE = 8
+POOL_SIZE = 4
+
+FIELDS = """- artist: The actual artist/composer name (or null if unknown)
+- title: The song/track title
+- album: The album name (or null)
+- year: Release year (or null)
+- genre: Music genre (or null)"""
+
+PROMPT = f"""Extract music metadata from this YouTube video filename. Return ONLY valid JSON with these fields:
+{FIELDS}
+
+Filename: {{filename}}
+
+Return ONLY the JSON object, no other text."""
+
+BATCH_PROMPT = f"""Extract music metadata from each of these numbered YouTube video filenames.
+Return ONLY a JSON object {{{{"tracks": [...]}}}} with one entry per filename, each having:
+- index: The filename's number from the list
+{FIELDS}
+
+Filenames:
+{{filenames}}
+
+Return ONLY the JSON object, no other text."""
+
+_FENCE_START = re.compile(r'^```(?:json)?\s*')
+_FENCE_END = re.compile(r'\s*```$')
+
+
+class OllamaStats:
+    """Running totals of the timings Ollama reports (durations are in ns)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.prompt_ns = 0
+        self.eval_tokens = 0
+        self.eval_ns = 0
+        self.load_ns = 0
+        self.total_ns = 0
+
+    def add(self, result):
+        with self.lock:
+            self.calls += 1
+            self.prompt_tokens += result.get('prompt_eval_count', 0)
+            self.prompt_ns += result.get('prompt_eval_duration', 0)
+            self.eval_tokens += result.get('eval_count', 0)
+            self.eval_ns += result.get('eval_duration', 0)
+            self.load_ns += result.get('load_duration', 0)
+            self.total_ns += result.get('total_duration', 0)
+
+    def report(self):
+        def rate(tokens, ns):
+            return tokens / (ns / 1e9) if ns else 0.0
+        return (f"  ollama       {self.calls:5d} calls  "
+                f"prompt {self.prompt_tokens:6d} tok @ {rate(self.prompt_tokens, self.prompt_ns):7.1f} tok/s  "
+                f"eval {self.eval_tokens:6d} tok @ {rate(self.eval_tokens, self.eval_ns):6.1f} tok/s  "
+                f"load {self.load_ns / 1e9:5.1f}s  total {self.total_ns / 1e9:6.1f}s")
+
+
+def _loads(text):
+    text = _FENCE_END.sub('', _FENCE_START.sub('', text.strip()))
+    return json.loads(text)
+
+
+class OllamaClient:
+    """Thread-safe Ollama /api/generate client with a pooled, keep-alive session."""
+
+    def __init__(self, base_url=OLLAMA_URL, model=OLLAMA_MODEL, keep_alive=KEEP_ALIVE,
+                 timeout=TIMEOUT, pool_size=POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.host = ratelimit.host_of(self.base_url)
+        self.limiter = ratelimit.get_limiter()
+        self.stats = OllamaStats()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def generate(self, prompt, format=None):
+        """POST /api/generate and return the decoded response body."""
+        body = {'model': self.model, 'prompt': prompt, 'stream': False,
+                'keep_alive': self.keep_alive}
+        if format is not None:
+            body['format'] = format
+
+        for attempt in range(ratelimit.MAX_RETRIES + 1):
+            self.limiter.acquire(self.host)
+            response = self.session.post(f"{self.base_url}/api/generate", json=body,
+                                         timeout=self.timeout)
+            if response.status_code in ratelimit.RETRY_STATUSES:
+                # Recorded even on the last attempt so the next caller backs off too
+                self.limiter.throttled(self.host,
+                                       ratelimit.parse_retry_after(response.headers.get('Retry-After')))
+                if attempt < ratelimit.MAX_RETRIES:
+                    continue
+            response.raise_for_status()
+            self.limiter.success(self.host)
+            result = response.json()
+            self.stats.add(result)
+            return result
+
+    def warm(self):
+        """Load the model ahead of the first real prompt (an empty prompt only loads it)."""
+        self.generate('')
+
+    def extract(self, filename):
+        """Metadata dict for one filename, or None."""
+        result = self.generate(PROMPT.format(filename=filename), format='json')
+        metadata = _loads(result.get('response', ''))
+        return metadata if isinstance(metadata, dict) else None
+
+    def extract_batch(self, filenames):
+        """
+        Metadata for several filenames from one prompt.
+
+        Returns a list aligned with `filenames`; entries the model skipped or
+        mangled are None so the caller can retry them on their own.
+        """
+        if len(filenames) == 1:
+            return [self.extract(filenames[0])]
+        listing = '\n'.join(f"{i}. {name}" for i, name in enumerate(filenames))
+        result = self.generate(BATCH_PROMPT.format(filenames=listing), format='json')
+        data = _loads(result.get('response', ''))
+
+        tracks = data.get('tracks') if isinstance(data, dict) else data
+        results = [None] * len(filenames)
+        for track in tracks or []:
+            if not isinstance(track, dict):
+                continue
+            try:
+                index = int(track.pop('index'))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if 0 <= index < len(filenames) and track.get('title'):
+                results[index] = track
+        return results
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide client so every caller shares one connection pool."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OllamaClient()
+    return _client
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ollama client utilities')
+    parser.add_argument('filenames', nargs='*', help='Filenames to extract metadata for')
+    args = parser.parse_args()
+
+    client = get_client()
+    for name, metadata in zip(args.filenames, client.extract_batch(args.filenames)):
+        print(f"{name}: {metadata}")
+    print(client.stats.report())
@@ -8,7 +8,6 @@ Handles patterns like:
 """
 
 import os
-import re
 from pathlib import Path
 
 try:
@@ -22,43 +21,24 @@ except ImportError:
     from mutagen.mp3 import MP3
     from mutagen.id3 import ID3, TIT2, TPE1, TALB
 
-MUSIC_DIR = "/mnt/boston/media/music/YouTube-Downloads"
+from filename_parser import clean_filename
+from tag_state import TagManifest
+from tag_writer import DEFAULT_WORKERS, TagWriterPool, atomic_update
 
-def parse_filename(filename):
-    """Extract artist and title from YouTube filename."""
-    # Remove extension
-    name = Path(filename).stem
-    
-    # Remove common YouTube suffixes
-    name = re.sub(r'\s*\(.*?(Official|Lyric|Music|Audio|Video|HD|4K|Live).*?\)', '', name, flags=re.IGNORECASE)
-    name = re.sub(r'\s*\[.*?(Official|Lyric|Music|Audio|Video|HD|4K|Live).*?\]', '', name, flags=re.IGNORECASE)
-    
-    # Pattern 1: "Artist - Title"
-    match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', name)
-    if match:
-        return match.group(1).strip(), match.group(2).strip()
-    
-    # Pattern 2: "Title by Artist"
-    match = re.search(r'^(.+?)\s+by\s+(.+)$', name, re.IGNORECASE)
-    if match:
-        return match.group(2).strip(), match.group(1).strip()
-    
-    # Pattern 3: "Artist: Title"
-    match = re.match(r'^(.+?)\s*:\s*(.+)$', name)
-    if match:
-        return match.group(1).strip(), match.group(2).strip()
-    
-    # No pattern matched - use filename as title, "Unknown Artist"
-    return "Unknown Artist", name.strip()
+MUSIC_DIR = "/mnt/boston/media/music/YouTube-Downloads"
+TOOL = "parse-and-tag"
 
 def tag_opus_file(filepath, artist, title):
     """Add metadata to OPUS file."""
-    try:
-        audio = OggOpus(filepath)
+    def apply(path):
+        audio = OggOpus(path)
         audio['artist'] = artist
         audio['title'] = title
         audio['album'] = 'YouTube Downloads'
         audio.save()
+
+    try:
+        atomic_update(filepath, apply)
         return True
     except Exception as e:
         print(f"  ❌ Error tagging {filepath}: {e}")
@@ -66,23 +46,33 @@ def tag_opus_file(filepath, artist, title):
 
 def tag_mp3_file(filepath, artist, title):
     """Add metadata to MP3 file."""
-    try:
-        audio = MP3(filepath, ID3=ID3)
+    def apply(path):
+        audio = MP3(path, ID3=ID3)
         try:
             audio.add_tags()
         except:
             pass
-        
+
         audio.tags['TIT2'] = TIT2(encoding=3, text=title)
         audio.tags['TPE1'] = TPE1(encoding=3, text=artist)
         audio.tags['TALB'] = TALB(encoding=3, text='YouTube Downloads')
         audio.save()
+
+    try:
+        atomic_update(filepath, apply)
         return True
     except Exception as e:
         print(f"  ❌ Error tagging {filepath}: {e}")
         return False
 
 def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Tag YouTube downloads from their filenames')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent tag writes')
+    parser.add_argument('--force', action='store_true', help='Reprocess files even if unchanged since the last run')
+    args = parser.parse_args()
+
     print("🎵 YouTube Filename Parser & Tagger")
     print("=" * 60)
     print()
@@ -97,35 +87,49 @@ def main():
         print(f"❌ No audio files found in {MUSIC_DIR}")
         return
     
-    print(f"Found {len(files)} files to process")
+    print(f"Found {len(files)} files")
+
+    manifest = TagManifest()
+    if not args.force:
+        total = len(files)
+        files = manifest.pending(files, TOOL, ('filename',))
+        print(f"Skipping {total - len(files)} unchanged files already tagged (use --force to redo)")
     print()
     
     tagged = 0
     failed = 0
     
-    for filepath in files:
-        artist, title = parse_filename(filepath.name)
-        
-        print(f"📝 {filepath.name}")
-        print(f"   Artist: {artist}")
-        print(f"   Title:  {title}")
-        
-        if filepath.suffix == '.opus':
-            success = tag_opus_file(str(filepath), artist, title)
-        elif filepath.suffix == '.mp3':
-            success = tag_mp3_file(str(filepath), artist, title)
-        else:
-            print(f"   ⚠️  Unsupported format")
-            continue
-        
-        if success:
-            print(f"   ✅ Tagged!")
-            tagged += 1
-        else:
-            failed += 1
-        
-        print()
-    
+    # Writes go to the pool; results are reported in the original order
+    with TagWriterPool(args.workers) as pool:
+        jobs = []
+        for filepath in files:
+            artist, title = clean_filename(filepath.name)
+
+            if filepath.suffix == '.opus':
+                future = pool.submit_recorded(manifest, filepath, 'filename', TOOL,
+                                              tag_opus_file, str(filepath), artist, title)
+            elif filepath.suffix == '.mp3':
+                future = pool.submit_recorded(manifest, filepath, 'filename', TOOL,
+                                              tag_mp3_file, str(filepath), artist, title)
+            else:
+                future = None
+            jobs.append((filepath, artist, title, future))
+
+        for filepath, artist, title, future in jobs:
+            print(f"📝 {filepath.name}")
+            print(f"   Artist: {artist}")
+            print(f"   Title:  {title}")
+
+            if future is None:
+                print(f"   ⚠️  Unsupported format")
+            elif future.result():
+                print(f"   ✅ Tagged!")
+                tagged += 1
+            else:
+                failed += 1
+
+            print()
+
     print("=" * 60)
     print(f"✅ Successfully tagged: {tagged}")
     print(f"❌ Failed: {failed}")
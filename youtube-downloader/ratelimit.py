@@ -0,0 +1 @@
+../calibre/config/ratelimit.py
\ No newline at end of file
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Incremental tagging manifest shared by the YouTube taggers.
+
+Records, per file: path, size, mtime, a content fingerprint, where the tags
+came from (musicbrainz/ollama/gemini/filename/none) and which tool wrote them.
+A tagger skips a file when it is unchanged since it was last tagged and the
+recorded tags are at least as good as anything that tagger could produce, so
+a nightly run only touches new or modified files.
+
+Override the location with YT_TAGGER_STATE_DIR.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+STATE_DIR = os.environ.get('YT_TAGGER_STATE_DIR', os.path.expanduser('~/.cache/youtube-tagger'))
+MANIFEST_PATH = os.path.join(STATE_DIR, 'tag-manifest.sqlite3')
+
+# Higher is better; 'none' means a tagger ran but found nothing
+SOURCE_RANK = {
+    'none': -1,
+    'filename': 0,
+    'ollama': 1,
+    'gemini': 1,
+    'musicbrainz': 2,
+}
+
+# Opus/MP3 tags live at the start of the file, so head + tail + size catches
+# both retags and re-encodes without reading whole files off the NAS
+FINGERPRINT_CHUNK = 64 * 1024
+
+
+def fingerprint(filepath):
+    """Cheap content fingerprint: hash of size, first and last 64 KiB."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        h.update(str(size).encode())
+        f.seek(0)
+        h.update(f.read(FINGERPRINT_CHUNK))
+        if size > FINGERPRINT_CHUNK:
+            f.seek(max(FINGERPRINT_CHUNK, size - FINGERPRINT_CHUNK))
+            h.update(f.read(FINGERPRINT_CHUNK))
+    return h.hexdigest()
+
+
+class TagManifest:
+    """SQLite record of what each file was last tagged with."""
+
+    def __init__(self, path=MANIFEST_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Taggers record from their tag-writer threads; the lock serialises that
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                source TEXT NOT NULL,
+                tool TEXT NOT NULL,
+                tagged_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def _unchanged(self, filepath, row):
+        """True if the file still matches the recorded state."""
+        size, mtime_ns, fp = row
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return False
+        if st.st_size == size and st.st_mtime_ns == mtime_ns:
+            return True
+        if st.st_size != size:
+            return False
+        # Touched but maybe not modified (e.g. copied back from backup)
+        if fingerprint(filepath) != fp:
+            return False
+        with self.lock:
+            self.conn.execute("UPDATE files SET mtime_ns = ? WHERE path = ?",
+                              (st.st_mtime_ns, str(filepath)))
+            self.conn.commit()
+        return True
+
+    def is_current(self, filepath, tool, provides):
+        """
+        Return True if `tool` can skip this file.
+
+        `provides` lists the sources the tool can produce, e.g.
+        ('musicbrainz', 'ollama'). A file is skipped when it is unchanged and
+        was either handled by this tool already or tagged from a source at
+        least as good as the best one the tool offers.
+        """
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, fingerprint, source, tool FROM files WHERE path = ?",
+            (str(filepath),),
+        ).fetchone()
+        if row is None or not self._unchanged(filepath, row[:3]):
+            return False
+        source, last_tool = row[3], row[4]
+        if last_tool == tool:
+            return True
+        best = max(SOURCE_RANK[p] for p in provides)
+        return SOURCE_RANK.get(source, -1) >= best
+
+    def pending(self, files, tool, provides):
+        """Filter `files` down to the ones `tool` still needs to process."""
+        return [f for f in files if not self.is_current(f, tool, provides)]
+
+    def record(self, filepath, source, tool):
+        """Record the file's current state after `tool` tagged it from `source`."""
+        st = os.stat(filepath)
+        digest = fingerprint(filepath)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files "
+                "(path, size, mtime_ns, fingerprint, source, tool, tagged_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(filepath), st.st_size, st.st_mtime_ns, digest,
+                 source, tool, time.time()),
+            )
+            self.conn.commit()
+
+    def forget_missing(self):
+        """Drop entries for files that no longer exist; returns the count."""
+        gone = [p for (p,) in self.conn.execute("SELECT path FROM files")
+                if not os.path.exists(p)]
+        self.conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in gone])
+        self.conn.commit()
+        return len(gone)
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Inspect or prune the tagging manifest')
+    parser.add_argument('--prune', action='store_true', help='Forget files that no longer exist')
+    args = parser.parse_args()
+
+    m = TagManifest()
+    if args.prune:
+        print(f"Forgot {m.forget_missing()} missing files")
+    for source, tool, count in m.conn.execute(
+            "SELECT source, tool, COUNT(*) FROM files GROUP BY source, tool ORDER BY source"):
+        print(f"{source:12s} {tool:18s} {count}")
+    print(f"Manifest: {MANIFEST_PATH}")
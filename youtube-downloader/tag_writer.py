@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Crash-safe, concurrent tag writing for the YouTube taggers.
+
+atomic_update() applies tag changes to a temporary copy next to the file,
+fsyncs it and renames it over the original, so a crash or a dropped NAS
+mount never leaves a half-written opus file behind. TagWriterPool runs
+those updates on a bounded thread pool; the loop is dominated by network
+filesystem latency on /mnt/boston, so several writes in flight hide most
+of it.
+"""
+
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# Enough to overlap NAS round trips without thrashing the share
+DEFAULT_WORKERS = 8
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # some network filesystems refuse directory fsync
+    finally:
+        os.close(fd)
+
+
+def atomic_update(filepath, apply):
+    """
+    Run `apply(tmp_path)` on a copy of `filepath`, then atomically replace it.
+
+    `apply` opens the copy with mutagen, changes tags and saves it. If it
+    raises, the original file is left untouched.
+    """
+    filepath = os.fspath(filepath)
+    directory, name = os.path.split(filepath)
+    tmp_path = os.path.join(directory, f".{name}.tagtmp")
+
+    try:
+        shutil.copyfile(filepath, tmp_path)
+        shutil.copymode(filepath, tmp_path)
+        apply(tmp_path)
+        with open(tmp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory or '.')
+
+
+class TagWriterPool:
+    """Bounded thread pool for tag writes; results are read back from futures."""
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tag-writer')
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def submit_recorded(self, manifest, filepath, source, tool, fn, *args):
+        """
+        Submit the tag write fn(*args) (True on success) and record `filepath`
+        in the manifest from the writer thread as soon as it succeeds, so an
+        interrupted run keeps every entry for files it already tagged.
+        """
+        def write():
+            if not fn(*args):
+                return False
+            manifest.record(filepath, source, tool)
+            return True
+        return self.executor.submit(write)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
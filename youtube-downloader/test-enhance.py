@@ -4,12 +4,10 @@ Test enhanced metadata on a few sample files.
 """
 
 import os
-import re
-import time
-import json
 from pathlib import Path
-from urllib.request import urlopen, Request
-from urllib.parse import quote
+
+import mb_cache
+from filename_parser import clean_filename
 
 try:
     from mutagen.oggopus import OggOpus
@@ -21,63 +19,35 @@ except ImportError:
 MUSIC_DIR = "/mnt/boston/media/music/YouTube-Downloads"
 USER_AGENT = "YouTubeMetadataEnhancer/1.0 (https://github.com/bmbell23/docker)"
 
-def clean_filename(filename):
-    """Extract clean artist and title from YouTube filename."""
-    name = Path(filename).stem
-    
-    # Remove common YouTube suffixes
-    name = re.sub(r'\s*\(.*?(Official|Lyric|Music|Audio|Video|HD|4K|Live|Visualizer).*?\)', '', name, flags=re.IGNORECASE)
-    name = re.sub(r'\s*\[.*?(Official|Lyric|Music|Audio|Video|HD|4K|Live|Visualizer).*?\]', '', name, flags=re.IGNORECASE)
-    
-    # Remove track numbers at the start
-    name = re.sub(r'^\d+\.?\s*', '', name)
-    
-    # Pattern 1: "Artist - Title"
-    match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', name)
-    if match:
-        return match.group(1).strip(), match.group(2).strip()
-    
-    # Pattern 2: "Title by Artist"
-    match = re.search(r'^(.+?)\s+by\s+(.+)$', name, re.IGNORECASE)
-    if match:
-        return match.group(2).strip(), match.group(1).strip()
-    
-    return "Unknown Artist", name.strip()
-
 def search_musicbrainz(artist, title):
-    """Search MusicBrainz for recording metadata."""
-    query = f'artist:"{artist}" AND recording:"{title}"'
-    url = f"https://musicbrainz.org/ws/2/recording/?query={quote(query)}&fmt=json&limit=3"
-    
+    """Search MusicBrainz for recording metadata (cached on disk, see mb_cache.py)."""
     try:
-        req = Request(url, headers={'User-Agent': USER_AGENT})
-        with urlopen(req, timeout=10) as response:
-            data = json.loads(response.read().decode())
-            
-            if data.get('recordings'):
-                results = []
-                for recording in data['recordings'][:3]:
-                    metadata = {
-                        'artist': recording.get('artist-credit', [{}])[0].get('name', artist),
-                        'title': recording.get('title', title),
-                        'album': None,
-                        'year': None,
-                        'score': recording.get('score', 0)
-                    }
-                    
-                    if recording.get('releases'):
-                        release = recording['releases'][0]
-                        metadata['album'] = release.get('title')
-                        if release.get('date'):
-                            metadata['year'] = release['date'][:4]
-                        metadata['release_mbid'] = release.get('id')
-                    
-                    results.append(metadata)
-                
-                return results
+        recordings = mb_cache.search_recordings(artist, title, USER_AGENT)
+
+        if recordings:
+            results = []
+            for recording in recordings[:3]:
+                metadata = {
+                    'artist': recording.get('artist-credit', [{}])[0].get('name', artist),
+                    'title': recording.get('title', title),
+                    'album': None,
+                    'year': None,
+                    'score': recording.get('score', 0)
+                }
+
+                if recording.get('releases'):
+                    release = recording['releases'][0]
+                    metadata['album'] = release.get('title')
+                    if release.get('date'):
+                        metadata['year'] = release['date'][:4]
+                    metadata['release_mbid'] = release.get('id')
+
+                results.append(metadata)
+
+            return results
     except Exception as e:
         print(f"  ❌ Error: {e}")
-    
+
     return None
 
 def main():
@@ -122,7 +92,6 @@ def main():
             print(f"  ❌ No matches found")
         
         print()
-        time.sleep(1)  # Rate limiting
     
     print("=" * 60)
     print("Test complete! If results look good, run enhance-metadata.py")
@@ -0,0 +1,112 @@
+import asyncio
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+import mb_cache
+import ollama_client
+from tag_state import TagManifest
+
+SCRIPTS = Path(__file__).resolve().parent.parent
+
+
+def load_script(name):
+    """Import a hyphenated tagger script as a module."""
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), SCRIPTS / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class DownOllama:
+    stats = ollama_client.OllamaStats()
+
+    def extract_batch(self, filenames):
+        raise ConnectionError('ollama is down')
+
+    def extract(self, filename):
+        raise ConnectionError('ollama is down')
+
+
+class EmptyOllama:
+    stats = ollama_client.OllamaStats()
+
+    def extract_batch(self, filenames):
+        return [None] * len(filenames)
+
+    def extract(self, filename):
+        return None
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = TagManifest(str(tmp_path / 'manifest.sqlite3'))
+    yield manifest
+    manifest.close()
+
+
+@pytest.fixture
+def music(tmp_path):
+    folder = tmp_path / 'music'
+    folder.mkdir()
+    files = [folder / 'Aerosmith - Dream On.opus', folder / 'Lofi Hip Hop Radio.opus']
+    for f in files:
+        f.write_bytes(b'OggS')
+    return folder, files
+
+
+def mb_down(*args, **kwargs):
+    raise OSError('MusicBrainz unreachable')
+
+
+def test_enhance_metadata_leaves_failed_lookups_pending(monkeypatch, music, manifest):
+    tagger = load_script('enhance-metadata')
+    folder, files = music
+    monkeypatch.setattr(tagger, 'MUSIC_DIR', str(folder))
+    monkeypatch.setattr(tagger, 'TagManifest', lambda: manifest)
+    monkeypatch.setattr(mb_cache, 'search_recordings', mb_down)
+    monkeypatch.setattr(sys, 'argv', ['enhance-metadata.py', '--auto', '--skip-art'])
+
+    tagger.main()
+
+    assert manifest.pending(files, tagger.TOOL, ('musicbrainz',)) == files
+
+
+def test_enhance_metadata_records_a_real_miss(monkeypatch, music, manifest):
+    tagger = load_script('enhance-metadata')
+    folder, files = music
+    monkeypatch.setattr(tagger, 'MUSIC_DIR', str(folder))
+    monkeypatch.setattr(tagger, 'TagManifest', lambda: manifest)
+    monkeypatch.setattr(mb_cache, 'search_recordings', lambda *a, **k: [])
+    monkeypatch.setattr(sys, 'argv', ['enhance-metadata.py', '--auto', '--skip-art'])
+
+    tagger.main()
+
+    assert manifest.pending(files, tagger.TOOL, ('musicbrainz',)) == []
+
+
+def test_hybrid_leaves_failed_lookups_pending(monkeypatch, music, manifest):
+    tagger = load_script('enhance-metadata-hybrid')
+    _, files = music
+    monkeypatch.setattr(mb_cache, 'search_recordings', mb_down)
+    monkeypatch.setattr(ollama_client, 'get_client', DownOllama)
+
+    counts = asyncio.run(tagger.run_pipeline(files, manifest))
+
+    assert counts['failed'] == len(files)
+    assert manifest.pending(files, tagger.TOOL, ('musicbrainz', 'ollama', 'filename')) == files
+
+
+def test_hybrid_records_a_real_miss(monkeypatch, music, manifest):
+    tagger = load_script('enhance-metadata-hybrid')
+    _, files = music
+    monkeypatch.setattr(mb_cache, 'search_recordings', lambda *a, **k: [])
+    monkeypatch.setattr(ollama_client, 'get_client', EmptyOllama)
+
+    asyncio.run(tagger.run_pipeline(files, manifest))
+
+    # 'Aerosmith - Dream On' is a confident parse, so it is tagged from the
+    # filename; the fake .opus can't be written, so only the other is recorded
+    assert manifest.pending(files, tagger.TOOL, ('musicbrainz', 'ollama', 'filename')) == files[:1]
@@ -0,0 +1,71 @@
+import json
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+import mb_index
+
+SAMPLE = Path(__file__).resolve().parent.parent / 'mb-dump-sample.jsonl'
+SAMPLE_ROWS = sum(1 for line in SAMPLE.open() if line.strip())
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / 'mb.sqlite3')
+
+
+def lookup(index_path, artist, title):
+    index = mb_index.RecordingIndex(index_path)
+    try:
+        return [(rec['id'], rec['title']) for rec in index.lookup(artist, title)]
+    finally:
+        index.close()
+
+
+def count(index_path, sql):
+    conn = sqlite3.connect(index_path)
+    try:
+        return conn.execute(sql).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_import_sample(index_path):
+    assert mb_index.import_dump(str(SAMPLE), index_path, progress=False) == (SAMPLE_ROWS, 0)
+    assert lookup(index_path, 'Aerosmith', 'Dream On') == [
+        ('564e6f5d-6860-505a-926d-a5cd56d70c67', 'Dream On')]
+    # Accent-insensitive, through the normalized key
+    assert lookup(index_path, 'Sigur Ros', 'Hoppipolla')[0][1] == 'Hoppípolla'
+
+
+def test_reimport_does_not_duplicate(index_path):
+    mb_index.import_dump(str(SAMPLE), index_path, progress=False)
+    exact = lookup(index_path, 'Daft Punk', 'Get Lucky')
+    fuzzy = lookup(index_path, 'Nirvana', 'Smells Like Teen Spirt')
+
+    assert mb_index.import_dump(str(SAMPLE), index_path, progress=False) == (0, SAMPLE_ROWS)
+
+    assert count(index_path, "SELECT COUNT(*) FROM recordings") == SAMPLE_ROWS
+    # Two different Get Lucky recordings, each once
+    assert sorted(lookup(index_path, 'Daft Punk', 'Get Lucky')) == sorted(exact)
+    assert len({mbid for mbid, _ in exact}) == len(exact) == 2
+    # The FTS path must not see the replaced rows twice either
+    assert lookup(index_path, 'Nirvana', 'Smells Like Teen Spirt') == fuzzy
+    assert len(fuzzy) == 1
+
+
+def test_overlapping_dump_updates_in_place(index_path, tmp_path):
+    mb_index.import_dump(str(SAMPLE), index_path, progress=False)
+
+    first = json.loads(SAMPLE.open().readline())
+    first['title'] = 'Dream On (2023 Remaster)'
+    overlap = tmp_path / 'overlap.jsonl'
+    overlap.write_text(json.dumps(first) + '\n')
+
+    assert mb_index.import_dump(str(overlap), index_path, progress=False) == (0, 1)
+    assert count(index_path, "SELECT COUNT(*) FROM recordings") == SAMPLE_ROWS
+    assert lookup(index_path, 'Aerosmith', 'Dream On (2023 Remaster)') == [
+        (first['id'], 'Dream On (2023 Remaster)')]
+    assert lookup(index_path, 'Aerosmith', 'Dream On') == []
+
@@ -0,0 +1,119 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import ollama_client
+import ratelimit
+
+TIMINGS = {
+    'done': True, 'total_duration': 2_000_000, 'load_duration': 100_000,
+    'prompt_eval_count': 40, 'prompt_eval_duration': 400_000,
+    'eval_count': 20, 'eval_duration': 1_000_000,
+}
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    """Answers /api/generate by splitting 'Artist - Title' out of the prompt."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, payload, headers=()):
+        payload = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        seen = self.server.seen
+        seen['bodies'].append(body)
+        seen['ports'].add(self.client_address[1])
+        if seen['throttle']:
+            seen['throttle'] -= 1
+            self.reply(429, {'error': 'busy'}, [('Retry-After', '0')])
+            return
+
+        names = re.findall(r'^(\d+)\. (.+)$', body['prompt'], re.MULTILINE)
+        if names:
+            # Drop the last track to exercise the caller's per-item fallback
+            tracks = [{'index': int(i), 'artist': n.split(' - ')[0], 'title': n.split(' - ')[1]}
+                      for i, n in names[:-1]]
+            text = json.dumps({'tracks': tracks})
+        elif body['prompt']:
+            name = body['prompt'].split('Filename: ')[1].split('\n')[0]
+            text = json.dumps({'artist': name.split(' - ')[0], 'title': name.split(' - ')[1]})
+        else:
+            text = ''
+        self.reply(200, dict(TIMINGS, response=text))
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubOllama)
+    server.seen = {'bodies': [], 'ports': set(), 'throttle': 0}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server, tmp_path):
+    client = ollama_client.OllamaClient(f"http://127.0.0.1:{server.server_port}", keep_alive='5m')
+    # Keep the test's 429s out of the real ~/.cache state
+    client.limiter = ratelimit.RateLimiter({client.host: (None, 1)},
+                                           state_path=str(tmp_path / 'ratelimit.json'))
+    yield client
+    client.close()
+
+
+def test_batch_and_single_extract(client, server):
+    client.warm()
+    names = ['Queen - Bohemian Rhapsody', 'Aerosmith - Dream On', 'Toto - Africa']
+    batch = client.extract_batch(names)
+    single = client.extract(names[2])
+
+    assert batch[0] == {'artist': 'Queen', 'title': 'Bohemian Rhapsody'}
+    assert batch[1] == {'artist': 'Aerosmith', 'title': 'Dream On'}
+    assert batch[2] is None
+    assert single == {'artist': 'Toto', 'title': 'Africa'}
+
+    bodies = server.seen['bodies']
+    assert all(b['keep_alive'] == '5m' for b in bodies)
+    assert all(b.get('format') == 'json' for b in bodies[1:])
+    assert len(server.seen['ports']) == 1, 'every call should reuse one pooled connection'
+    assert client.stats.calls == 3
+    assert client.stats.eval_tokens == 60
+
+
+def test_single_name_batch_uses_plain_prompt(client, server):
+    assert client.extract_batch(['Toto - Africa']) == [{'artist': 'Toto', 'title': 'Africa'}]
+    assert 'Filename: Toto - Africa' in server.seen['bodies'][0]['prompt']
+
+
+def test_retries_after_429(client, server):
+    server.seen['throttle'] = 2
+    assert client.extract('Toto - Africa') == {'artist': 'Toto', 'title': 'Africa'}
+    assert len(server.seen['bodies']) == 3
+    # A success after the retries clears the failure count
+    assert client.limiter.hosts[client.host].failures == 0
+
+
+def test_final_429_is_recorded(client, server, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'MAX_RETRIES', 1)
+    server.seen['throttle'] = 2
+    with pytest.raises(requests.HTTPError):
+        client.extract('Toto - Africa')
+    assert len(server.seen['bodies']) == 2
+    assert client.limiter.hosts[client.host].failures == 2